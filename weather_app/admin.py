@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import WeatherRequest, PopularCity, UserActivity
+from .models import WeatherRequest, PopularCity, UserActivity, WeatherRollup, ActivityRollup
 
 # Register your models with the admin interface
 @admin.register(PopularCity)
@@ -17,6 +17,7 @@ class WeatherRequestAdmin(admin.ModelAdmin):
     list_filter = ('country', 'request_type', 'requested_at')
     search_fields = ('city', 'country')
     ordering = ('-requested_at',)
+    show_full_result_count = False  # don't count the whole log table on every page
 
 @admin.register(UserActivity)
 class UserActivityAdmin(admin.ModelAdmin):
@@ -24,3 +25,18 @@ class UserActivityAdmin(admin.ModelAdmin):
     list_filter = ('action', 'timestamp')
     search_fields = ('ip_address', 'city_requested')
     ordering = ('-timestamp',)
+    show_full_result_count = False
+
+# Analytics: use these instead of counting the raw log tables
+@admin.register(WeatherRollup)
+class WeatherRollupAdmin(admin.ModelAdmin):
+    list_display = ('city', 'country', 'period', 'bucket_start', 'count', 'avg_response_time')
+    list_filter = ('period', 'bucket_start')
+    search_fields = ('city', 'country')
+    ordering = ('-bucket_start', '-count')
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ('action', 'period', 'bucket_start', 'count', 'avg_response_time')
+    list_filter = ('period', 'action', 'bucket_start')
+    ordering = ('-bucket_start', 'action')
@@ -5,6 +5,6 @@ class WeatherAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather_app'
 
-    def read(sself):
+    def ready(self):
         #imoprt signals to audo invalidate cache
         import weather_app.cache_manager
\ No newline at end of file
@@ -0,0 +1,111 @@
+# weather_app/cache_generations.py
+# Versioned namespaces for the weather cache
+#
+# Weather keys embed a global generation number (weather:g<N>:<city>), so
+# invalidating every city is one INCR: nothing reads the old keys any more
+# and they age out through their TTL. A city's country is only known once it
+# has been fetched, so per-country invalidation works on the entry instead:
+# each entry records its country's generation when written, and entries
+# older than the country's current generation are treated as misses.
+#
+# Both numbers are cached in-process for WEATHER_GENERATION_TTL seconds, so
+# after an invalidation other processes can serve old entries for that long.
+# Async code refreshes them with arefresh() before using them; on an event
+# loop the sync accessors never go to Redis themselves.
+
+import asyncio
+import threading
+import time
+import redis
+from django.conf import settings
+from .redis_clients import get_redis
+
+GENERATION_KEY = "weather:generation"
+COUNTRY_GENERATIONS_KEY = "weather:country_generations"
+
+redis_client = get_redis('cache')
+
+
+class NamespaceGenerations:
+    """Global and per-country weather cache generations, read through a short in-process cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._countries = {}
+        self._loaded_at = None
+
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.time() - self._loaded_at < settings.WEATHER_GENERATION_TTL
+
+    def _refresh_if_due(self):
+        """Sync refresh when due, except on an event loop (blocking it is worse than a stale generation)"""
+        if self._is_fresh():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.refresh()
+
+    def _store(self, generation, countries):
+        with self._lock:
+            self._generation = int(generation or 0)
+            self._countries = {country: int(value) for country, value in (countries or {}).items()}
+            self._loaded_at = time.time()
+
+    def refresh(self):
+        """Reload both generations from Redis in one round-trip (keeps the old ones if Redis is down)"""
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.get(GENERATION_KEY)
+            pipe.hgetall(COUNTRY_GENERATIONS_KEY)
+            self._store(*pipe.execute())
+        except redis.RedisError:
+            self._loaded_at = time.time()
+
+    async def arefresh(self, async_redis_client):
+        """Async refresh, only when the cached values are due (call before building keys in async code)"""
+        if self._is_fresh():
+            return
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            pipe.get(GENERATION_KEY)
+            pipe.hgetall(COUNTRY_GENERATIONS_KEY)
+            self._store(*await pipe.execute())
+        except redis.RedisError:
+            self._loaded_at = time.time()
+
+    def current(self):
+        """The global generation"""
+        self._refresh_if_due()
+        return self._generation
+
+    def country(self, country):
+        """A country's generation (0 until it's first invalidated)"""
+        self._refresh_if_due()
+        return self._countries.get((country or '').lower(), 0)
+
+    def is_current(self, cache_entry):
+        """False for entries written before their country was last invalidated"""
+        data = cache_entry.get('data', {}) if 'fresh_until' in cache_entry else cache_entry
+        return cache_entry.get('country_gen', 0) >= self.country(data.get('country'))
+
+    def bump(self):
+        """Invalidate every weather entry, returns the new generation"""
+        generation = redis_client.incr(GENERATION_KEY)
+        self.refresh()
+        return generation
+
+    def bump_country(self, country):
+        """Invalidate one country's weather entries, returns its new generation"""
+        generation = redis_client.hincrby(COUNTRY_GENERATIONS_KEY, country.lower(), 1)
+        self.refresh()
+        return generation
+
+
+weather_generations = NamespaceGenerations()
+
+
+def weather_cache_key(city_name):
+    """Cache key of a city's weather in the current generation"""
+    return f"weather:g{weather_generations.current()}:{city_name.lower()}"
@@ -3,10 +3,15 @@
 
 import logging
 from django.core.cache import cache
+from django_redis import get_redis_connection
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import WeatherRequest, PopularCity, UserActivity
-from datetime import datetime
+from .local_cache import weather_l1_cache
+from .city_counters import reseed_from_database, sync_city, remove_city
+from .redis_clients import scan_keys, unlink_keys
+from .cache_generations import weather_generations, weather_cache_key
+from .cache_metrics import cache_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -22,20 +27,26 @@ class CacheManager:
         Invalidate weather cache for a specific city
         Call this when weather data becomes stale
         """
-        cache_key = f"weather:{city_name.lower()}"
+        cache_key = weather_cache_key(city_name)
         result = cache.delete(cache_key)
+        #drop the in-process copy in every worker too
+        weather_l1_cache.delete(cache_key, publish=True)
         logger.info(f"Invalidated weather cache for {city_name}: {result}")
         return result
     
     @staticmethod
     def invalidate_popular_cities_cache():
         """
-        Invalidate popular cities cache
-        Call this when PopularCity model is updated
+        Rebuild the popular city counters from the database
+        Call this after PopularCity was changed in bulk
         """
-        result = cache.delete("popular_cities")
-        logger.info(f"Invalidated popular cities cache: {result}")
-        return result
+        try:
+            result = reseed_from_database()
+            logger.info(f"Rebuilt popular city counters: {result} cities")
+            return result
+        except Exception as e:
+            logger.error(f"Error rebuilding popular city counters: {e}")
+            return 0
     
     @staticmethod
     def invalidate_cache_stats():
@@ -43,28 +54,9 @@ class CacheManager:
         Clear cache statistics
         Call this for cache reset or testing
         """
-        import redis
-        from django.conf import settings
-        
         try:
-            redis_client = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=settings.REDIS_DB,
-                decode_responses=True
-            )
-            
-            # Delete cache statistics keys
-            today = datetime.now().strftime('%Y-%m-%d')
-            keys_to_delete = [
-                f"cache_hits:{today}",
-                f"cache_misses:{today}"
-            ]
-            
-            deleted_count = 0
-            for key in keys_to_delete:
-                if redis_client.delete(key):
-                    deleted_count += 1
+            # Delete every per-minute and per-hour metrics bucket
+            deleted_count = cache_metrics.delete_all()
             
             logger.info(f"Cleared {deleted_count} cache statistics keys")
             return deleted_count
@@ -78,52 +70,69 @@ class CacheManager:
         """
         Clear all weather cache entries
         Use for bulk cache refresh or testing
+        One INCR of the cache generation: nothing reads the old keys any more
+        and they age out through their TTL. Returns the new generation.
         """
         try:
-            # Get all weather cache keys
-            import redis
-            from django.conf import settings
-            
-            redis_client = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=0,  # Weather cache DB
-                decode_responses=True
-            )
-            
-            # Find all weather cache keys
-            weather_keys = redis_client.keys("weather_app:1:weather:*")
-            
-            if weather_keys:
-                deleted_count = redis_client.delete(*weather_keys)
-                logger.info(f"Cleared {deleted_count} weather cache entries")
-                return deleted_count
-            else:
-                logger.info("No weather cache entries to clear")
-                return 0
+            generation = weather_generations.bump()
+            weather_l1_cache.clear(publish=True)
+            logger.info(f"Weather cache moved to generation {generation}")
+            return generation
                 
         except Exception as e:
             logger.error(f"Error clearing all weather cache: {e}")
             return 0
+
+    @staticmethod
+    def invalidate_country_weather_cache(country):
+        """
+        Clear the weather cache entries of one country (one HINCRBY)
+        Entries written before this are treated as misses from now on.
+        """
+        try:
+            generation = weather_generations.bump_country(country)
+            logger.info(f"Weather cache for {country} moved to generation {generation}")
+            return generation
+        except Exception as e:
+            logger.error(f"Error clearing weather cache for {country}: {e}")
+            return 0
+
+    @staticmethod
+    def purge_old_generations(progress=None):
+        """
+        UNLINK weather entries of earlier generations now instead of waiting for their TTL
+        Keys are found with SCAN and unlinked in batches, so Redis never blocks on it.
+        progress(deleted so far) is called after each batch. Returns the number deleted.
+        """
+        # Weather entries live in the Django cache, so use its own (pooled) connection
+        redis_client = get_redis_connection('default')
+        current_prefix = cache.make_key(f"weather:g{weather_generations.current()}:").encode()
+        old_keys = (
+            key for key in scan_keys(redis_client, cache.make_key("weather:*"))
+            if not key.startswith(current_prefix)
+        )
+        deleted_count = unlink_keys(redis_client, old_keys, progress=progress)
+        logger.info(f"Purged {deleted_count} old weather cache entries")
+        return deleted_count
     
-    '''@staticmethod
+    @staticmethod
     def warm_cache_for_popular_cities():
         """
         Pre-populate cache with popular cities weather
         Call this after cache clearing or during maintenance
         """
-        #from .tasks import preload_popular_cities_cache
+        from .tasks import warm_weather_cache
         
         try:
             # Start async task to warm cache
-            task = preload_popular_cities_cache.delay()
+            task = warm_weather_cache.delay()
             logger.info(f"Started cache warming task: {task.id}")
             return task.id
             
         except Exception as e:
             logger.error(f"Error starting cache warming: {e}")
             return None
-    '''
+    
     @staticmethod
     def sync_database_to_cache():
         """
@@ -131,19 +140,10 @@ class CacheManager:
         Use for ensuring consistency after database updates
         """
         try:
-            # Refresh popular cities cache from database
-            from .models import PopularCity
-            
-            popular_cities = list(
-                PopularCity.objects.values('city', 'country', 'request_count')
-                .order_by('-request_count')[:10]
-            )
-            
-            # Update cache
-            cache.set("popular_cities", popular_cities, 3600)  # 1 hour
-            
-            logger.info(f"Synced {len(popular_cities)} popular cities to cache")
-            return len(popular_cities)
+            # Rebuild the popular city counters from the database
+            synced = reseed_from_database()
+            logger.info(f"Synced {synced} popular cities to cache")
+            return synced
             
         except Exception as e:
             logger.error(f"Error syncing database to cache: {e}")
@@ -151,21 +151,31 @@ class CacheManager:
 
 # Django signals to auto-invalidate cache when database changes
 
+# The counter flush uses bulk_update/bulk_create, which don't send these,
+# so they only fire for rows saved one at a time (admin, management commands)
+
 @receiver(post_save, sender=PopularCity)
 def invalidate_popular_cities_on_save(sender, instance, **kwargs):
    
-   #Automatically invalidate popular cities cache when PopularCity is updated
+   #Keep the Redis counter in step when a PopularCity is saved directly
    
-   CacheManager.invalidate_popular_cities_cache()
-   logger.info(f"Auto-invalidated popular cities cache due to {instance.city} update")
+   try:
+       instance.refresh_from_db(fields=['request_count'])
+       sync_city(instance.city, instance.country, instance.request_count)
+       logger.info(f"Synced popular city counter for {instance.city}")
+   except Exception as e:
+       logger.error(f"Error syncing popular city counter for {instance.city}: {e}")
 
 @receiver(post_delete, sender=PopularCity)
 def invalidate_popular_cities_on_delete(sender, instance, **kwargs):
    
-   # Automatically invalidate popular cities cache when PopularCity is deleted
+   # Drop the Redis counter when a PopularCity is deleted
    
-   CacheManager.invalidate_popular_cities_cache()
-   logger.info(f"Auto-invalidated popular cities cache due to {instance.city} deletion")
+   try:
+       remove_city(instance.city)
+       logger.info(f"Removed popular city counter for {instance.city}")
+   except Exception as e:
+       logger.error(f"Error removing popular city counter for {instance.city}: {e}")
 
 
 @receiver(post_save, sender=WeatherRequest)
@@ -189,7 +199,7 @@ def clear_all_caches():
     Use for testing or emergency cache reset
     """
     results = {
-        'weather_cache': CacheManager.invalidate_all_weather_cache(),
+        'weather_cache': f"generation {CacheManager.invalidate_all_weather_cache()}",
         'popular_cities': CacheManager.invalidate_popular_cities_cache(),
         'cache_stats': CacheManager.invalidate_cache_stats(),
     }
@@ -204,7 +214,7 @@ def refresh_all_caches():
     """
     results = {
         'sync_popular_cities': CacheManager.sync_database_to_cache(),
-        #'warm_weather_cache': CacheManager.warm_cache_for_popular_cities(),
+        'warm_weather_cache': CacheManager.warm_cache_for_popular_cities(),
     }
     
     logger.info(f"Cache refresh results: {results}")
@@ -0,0 +1,180 @@
+# weather_app/cache_metrics.py
+# Weather cache hit/miss metrics
+#
+# Lookups are counted in process memory and written by a background thread
+# (see flushers.py) every CACHE_METRICS_FLUSH_INTERVAL seconds, one pipeline
+# per flush, so a cache lookup never waits on Redis to count itself. Counts
+# land in one hash per minute and one per hour:
+#
+#   cache_metrics:m:<unix minute>  HASH
+#   cache_metrics:h:<unix hour>    HASH
+#
+# both with the fields hit / miss (all cities) and hit:<city> / miss:<city>.
+#
+# Rolling hit rates over the last 1m/5m/1h come from the minute buckets and
+# 24h from the hour buckets (the current hour and the 23 before it), all in
+# one round-trip. Rates lag behind by up to one flush interval.
+
+import threading
+import time
+import logging
+import redis
+from django.conf import settings
+from . import flushers
+from .redis_clients import get_redis, unlink_matching
+
+logger = logging.getLogger(__name__)
+
+redis_client = get_redis('cache')
+
+MINUTE_PREFIX = "cache_metrics:m"
+HOUR_PREFIX = "cache_metrics:h"
+MINUTE_BUCKET_TTL = 2 * 3600
+HOUR_BUCKET_TTL = 25 * 3600
+
+# rolling windows: (bucket prefix, number of buckets)
+WINDOWS = {
+    '1m': (MINUTE_PREFIX, 1),
+    '5m': (MINUTE_PREFIX, 5),
+    '1h': (MINUTE_PREFIX, 60),
+    '24h': (HOUR_PREFIX, 24),
+}
+
+
+def current_minute():
+    return int(time.time() // 60)
+
+
+def summarize(hits, misses):
+    """Counts to the {'hits', 'misses', 'total', 'hit_rate'} shape the stats API returns"""
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'total': total,
+        'hit_rate': round(hits / total * 100, 2) if total else 0,
+    }
+
+
+class CacheMetrics(flushers.PeriodicFlusher):
+    """Per-process buffer of cache hit/miss counts, flushed to per-minute and per-hour Redis hashes"""
+
+    thread_name = 'cache-metrics'
+
+    def __init__(self, flush_interval=5.0):
+        super().__init__(flush_interval)
+        self._counts = {}  # {(minute, field): count}
+        self._flush_lock = threading.Lock()
+
+    def record(self, city_name, hit=True):
+        """Count one lookup (never touches Redis)"""
+        self.ensure_flusher()
+        outcome = 'hit' if hit else 'miss'
+        minute = current_minute()
+        with self._lock:
+            for field in (outcome, f"{outcome}:{city_name.lower()}"):
+                self._counts[minute, field] = self._counts.get((minute, field), 0) + 1
+
+    def flush(self):
+        """Write the buffered counts in one pipeline, returns the number of lookups written"""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, {}
+            if not counts:
+                return 0
+
+            pipe = redis_client.pipeline(transaction=False)
+            for (minute, field), count in counts.items():
+                pipe.hincrby(f"{MINUTE_PREFIX}:{minute}", field, count)
+                pipe.hincrby(f"{HOUR_PREFIX}:{minute // 60}", field, count)
+            for minute in {minute for minute, _ in counts}:
+                pipe.expire(f"{MINUTE_PREFIX}:{minute}", MINUTE_BUCKET_TTL)
+                pipe.expire(f"{HOUR_PREFIX}:{minute // 60}", HOUR_BUCKET_TTL)
+            try:
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Error flushing cache metrics: {e}")
+                self._restore(counts)
+                return 0
+            return sum(count for (_, field), count in counts.items() if ':' not in field)
+
+    def _restore(self, counts):
+        """Put counts back for the next flush, dropping the ones older than the longest window"""
+        oldest = current_minute() - 24 * 60
+        with self._lock:
+            for (minute, field), count in counts.items():
+                if minute >= oldest:
+                    self._counts[minute, field] = self._counts.get((minute, field), 0) + count
+
+    def clear(self):
+        with self._lock:
+            self._counts = {}
+
+    def reset(self):
+        self._counts = {}
+
+    # READING
+
+    @staticmethod
+    def _bucket_counts():
+        """{prefix: buckets read}, enough for the longest window of each kind"""
+        counts = {}
+        for prefix, buckets in WINDOWS.values():
+            counts[prefix] = max(counts.get(prefix, 0), buckets)
+        return counts
+
+    def _window_commands(self, pipe, fields):
+        """Queue one HMGET per bucket read, newest first"""
+        now = current_minute()
+        for prefix, buckets in self._bucket_counts().items():
+            current = now if prefix == MINUTE_PREFIX else now // 60
+            for bucket in range(current, current - buckets, -1):
+                pipe.hmget(f"{prefix}:{bucket}", fields)
+
+    def _windows(self, rows):
+        """Sum the HMGET rows into rolling {'1m': stats, ...}"""
+        by_prefix, start = {}, 0
+        for prefix, buckets in self._bucket_counts().items():
+            by_prefix[prefix] = rows[start:start + buckets]
+            start += buckets
+
+        windows = {}
+        for name, (prefix, buckets) in WINDOWS.items():
+            window = by_prefix[prefix][:buckets]
+            windows[name] = summarize(
+                sum(int(row[0] or 0) for row in window),
+                sum(int(row[1] or 0) for row in window),
+            )
+        return windows
+
+    @staticmethod
+    def fields(city_name=None):
+        if city_name:
+            return [f"hit:{city_name.lower()}", f"miss:{city_name.lower()}"]
+        return ['hit', 'miss']
+
+    def delete_all(self):
+        """Drop the buffered counts and every bucket in Redis, returns the number of buckets deleted"""
+        self.clear()
+        return unlink_matching(redis_client, "cache_metrics:*")
+
+    def hit_rates(self, city_name=None):
+        """Rolling hit rates for every window (all cities, or one), in one round-trip"""
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            self._window_commands(pipe, self.fields(city_name))
+            return self._windows(pipe.execute())
+        except redis.RedisError:
+            return {name: summarize(0, 0) for name in WINDOWS}
+
+    async def ahit_rates(self, async_redis_client, city_name=None):
+        """Async hit_rates"""
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            self._window_commands(pipe, self.fields(city_name))
+            return self._windows(await pipe.execute())
+        except redis.RedisError:
+            return {name: summarize(0, 0) for name in WINDOWS}
+
+
+cache_metrics = flushers.register(CacheMetrics(flush_interval=settings.CACHE_METRICS_FLUSH_INTERVAL))
@@ -0,0 +1,186 @@
+# weather_app/cache_serializer.py
+# Compact serializer for the Django cache (weather entries, sessions, ...)
+#
+# Values are encoded with orjson (or msgpack) instead of pickle, and payloads
+# of CACHE_COMPRESS_MIN_SIZE bytes or more are compressed. Every value starts
+# with a small header so the format can change without breaking old keys:
+#
+#   b'W' | header version | codec << 4 | compression | payload
+#
+# Values the codec can't represent exactly (datetimes, Decimals, model
+# instances, non-string dict keys, NaN/Infinity with orjson, which would
+# write them as null, ...) are pickled behind the same header.
+# Tuples are the exception: like any JSON serializer this returns them as
+# lists. Values without a header are pre-header pickles and still load.
+#
+# Django stores plain ints unserialized (so INCR works); they never get here.
+
+import functools
+import math
+import pickle
+import zlib
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django_redis.serializers.base import BaseSerializer
+
+MAGIC = b'W'
+HEADER_VERSION = 1
+HEADER_SIZE = 3
+
+# codec ids (high nibble of the flags byte)
+PICKLE, ORJSON, MSGPACK = 0, 1, 2
+CODECS = {'pickle': PICKLE, 'orjson': ORJSON, 'msgpack': MSGPACK}
+
+# compression ids (low nibble)
+NONE, ZLIB, ZSTD, LZ4 = 0, 1, 2, 3
+COMPRESSIONS = {'none': NONE, 'zlib': ZLIB, 'zstd': ZSTD, 'lz4': LZ4}
+
+
+class SerializerError(ValueError):
+    """A cached value has a header this process can't decode"""
+
+
+class _Unsupported(TypeError):
+    """Raised from the codec default hooks: the value is pickled instead"""
+
+
+def _unsupported(value):
+    raise _Unsupported(type(value).__name__)
+
+
+def _has_non_finite(value):
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(_has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_has_non_finite(item) for item in value)
+    return False
+
+
+def _load_orjson():
+    import orjson
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS
+
+    def dumps(value):
+        payload = orjson.dumps(value, default=_unsupported, option=options)
+        # orjson writes NaN/Infinity as null; only payloads with a null can hold one
+        if b'null' in payload and _has_non_finite(value):
+            raise _Unsupported('non-finite float')
+        return payload
+
+    return dumps, orjson.loads, (orjson.JSONEncodeError,)
+
+
+def _load_msgpack():
+    import msgpack
+    return (
+        functools.partial(msgpack.packb, use_bin_type=True, default=_unsupported),
+        functools.partial(msgpack.unpackb, raw=False, strict_map_key=False),
+        (TypeError, OverflowError, ValueError),
+    )
+
+
+def _load_zstd():
+    import zstandard
+    compressor, decompressor = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+    return compressor.compress, decompressor.decompress
+
+
+def _load_lz4():
+    import lz4.frame
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+_CODEC_LOADERS = {ORJSON: _load_orjson, MSGPACK: _load_msgpack}
+_COMPRESSION_LOADERS = {
+    ZLIB: lambda: (functools.partial(zlib.compress, level=1), zlib.decompress),
+    ZSTD: _load_zstd,
+    LZ4: _load_lz4,
+}
+
+
+def _load(loaders, names, kind, key):
+    try:
+        return loaders[key]()
+    except ImportError as e:
+        name = next(name for name, id in names.items() if id == key)
+        raise ImproperlyConfigured(f"Cache {kind} '{name}' needs a package that isn't installed: {e}") from e
+
+
+class WeatherCacheSerializer(BaseSerializer):
+    """
+    django_redis serializer with a versioned header, see the module docstring
+
+    Configured by CACHE_SERIALIZER_FORMAT, CACHE_COMPRESSION and
+    CACHE_COMPRESS_MIN_SIZE; keyword arguments override them (for benchmarks).
+    """
+
+    def __init__(self, options=None, format=None, compression=None, min_size=None):
+        format = format or settings.CACHE_SERIALIZER_FORMAT
+        compression = compression or settings.CACHE_COMPRESSION
+        if format not in CODECS:
+            raise ImproperlyConfigured(f"Unknown cache serializer format: {format}")
+        if compression not in COMPRESSIONS:
+            raise ImproperlyConfigured(f"Unknown cache compression: {compression}")
+        self.format = format
+        self.compression = compression
+        self.codec = CODECS[format]
+        self.compression_id = COMPRESSIONS[compression]
+        self.min_size = settings.CACHE_COMPRESS_MIN_SIZE if min_size is None else min_size
+        self._codecs = {}
+        self._compressors = {}
+        # load the configured codec/compressor now: fail at startup rather than on the first write
+        self._dumps, _, self._errors = self._codec(self.codec) if self.codec != PICKLE else (None, None, ())
+        self._compress = self._compressor(self.compression_id)[0] if self.compression_id != NONE else None
+        self._headers = {
+            (codec, compression): MAGIC + bytes((HEADER_VERSION, codec << 4 | compression))
+            for codec in (PICKLE, self.codec) for compression in (NONE, self.compression_id)
+        }
+
+    def _codec(self, codec):
+        if codec not in self._codecs:
+            if codec not in _CODEC_LOADERS:
+                raise SerializerError(f"Unknown cache codec id {codec}")
+            self._codecs[codec] = _load(_CODEC_LOADERS, CODECS, 'serializer format', codec)
+        return self._codecs[codec]
+
+    def _compressor(self, compression):
+        if compression not in self._compressors:
+            if compression not in _COMPRESSION_LOADERS:
+                raise SerializerError(f"Unknown cache compression id {compression}")
+            self._compressors[compression] = _load(_COMPRESSION_LOADERS, COMPRESSIONS, 'compression', compression)
+        return self._compressors[compression]
+
+    def encode_payload(self, value):
+        """(codec id, payload), pickling values the configured codec can't represent"""
+        if self._dumps is not None:
+            try:
+                return self.codec, self._dumps(value)
+            except _Unsupported:
+                pass
+            except self._errors:
+                pass
+        return PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def dumps(self, value):
+        codec, payload = self.encode_payload(value)
+        compression = NONE
+        if self._compress is not None and len(payload) >= self.min_size:
+            compressed = self._compress(payload)
+            if len(compressed) < len(payload):
+                compression, payload = self.compression_id, compressed
+        return self._headers[codec, compression] + payload
+
+    def loads(self, value):
+        if value[:1] != MAGIC:
+            return pickle.loads(value)  #written before the header existed
+        if value[1] != HEADER_VERSION:
+            raise SerializerError(f"Unknown cache header version {value[1]}")
+        codec, compression = value[2] >> 4, value[2] & 0x0F
+        payload = value[HEADER_SIZE:]
+        if compression != NONE:
+            payload = self._compressor(compression)[1](payload)
+        if codec == PICKLE:
+            return pickle.loads(payload)
+        return self._codec(codec)[1](payload)
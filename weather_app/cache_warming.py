@@ -0,0 +1,105 @@
+# weather_app/cache_warming.py
+# Keeps the weather of likely-requested cities in the cache
+#
+# Every WEATHER_WARM_INTERVAL seconds the warm_weather_cache beat task collects
+# the cities users are likely to ask for (the most requested ones, the
+# WeatherService.cities list behind the random view, and every location with
+# a pending digest request) and re-fetches those whose cache entry goes stale
+# within WEATHER_WARM_LEAD seconds, so user requests find a fresh entry.
+#
+# Refreshes go out as bulk WeatherAPI calls spread over the interval, and
+# are capped at WEATHER_WARM_LOOKUPS_PER_MINUTE locations per minute across
+# all workers so warming can't use up the upstream quota. Nothing is planned
+# while either circuit breaker (single lookups or bulk calls) is open.
+
+import time
+import redis
+from django.conf import settings
+from .models import CeleryWeatherRequest
+from .city_counters import top_cities
+from .redis_clients import get_redis
+from .upstream import weather_breaker, weather_bulk_breaker
+from .views import WeatherService
+
+redis_client = get_redis('cache')
+
+LOOKUPS_KEY = "warming:lookups"
+
+# KEYS[1] counter | ARGV limit, requested, ttl_s -> granted
+RESERVE_LOOKUPS_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local granted = math.max(0, math.min(tonumber(ARGV[2]), tonumber(ARGV[1]) - used))
+if granted > 0 then
+    if redis.call('INCRBY', KEYS[1], granted) == granted then
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    end
+end
+return granted
+"""
+
+_reserve_lookups = redis_client.register_script(RESERVE_LOOKUPS_SCRIPT)
+
+
+def warm_targets(top_n=None):
+    """Cities worth keeping warm, most requested first, without duplicates"""
+    popular = [city['city'] for city in top_cities(top_n or settings.WEATHER_WARM_TOP_N)]
+    pending = (
+        CeleryWeatherRequest.objects.filter(status='pending')
+        .order_by('location').values_list('location', flat=True).distinct()
+    )
+
+    targets, seen = [], set()
+    for city in [*popular, *pending, *WeatherService().cities]:
+        if city and city.lower() not in seen:
+            seen.add(city.lower())
+            targets.append(city)
+    return targets
+
+
+def due_cities(cities, lead=None):
+    """
+    Cities whose cache entry is missing or goes stale within lead seconds,
+    the ones going stale first (missing ones before all others)
+    """
+    lead = settings.WEATHER_WARM_LEAD if lead is None else lead
+    service = WeatherService()
+    cache_keys = {city: service.get_cache_key(city) for city in cities}
+    cached = service.get_cache_entries(list(cache_keys.values()))
+
+    now = time.time()
+    remaining = {}
+    for city in cities:
+        cache_entry = cached.get(cache_keys[city])
+        remaining[city] = cache_entry.get('fresh_until', 0) - now if cache_entry else float('-inf')
+    return sorted((city for city in cities if remaining[city] <= lead), key=remaining.get)
+
+
+def reserve_lookups(count):
+    """
+    Take up to count upstream lookups from this minute's warming budget
+    (shared by every worker), returns how many were granted
+    """
+    if count <= 0:
+        return 0
+    limit = settings.WEATHER_WARM_LOOKUPS_PER_MINUTE
+    key = f"{LOOKUPS_KEY}:{int(time.time() // 60)}"
+    try:
+        return int(_reserve_lookups(keys=[key], args=[limit, count, 120]))
+    except redis.RedisError:
+        return 0
+
+
+def plan_warming(targets=None):
+    """
+    [(countdown seconds, cities)] - the due cities in bulk-call batches,
+    spread evenly over the next WEATHER_WARM_INTERVAL seconds
+    """
+    if 'open' in (weather_breaker.state(), weather_bulk_breaker.state()):
+        return []
+    due = due_cities(warm_targets() if targets is None else targets)
+    due = due[:reserve_lookups(len(due))]
+
+    batch_size = settings.WEATHER_BULK_BATCH_SIZE
+    batches = [due[i:i + batch_size] for i in range(0, len(due), batch_size)]
+    spacing = settings.WEATHER_WARM_INTERVAL / len(batches) if batches else 0
+    return [(round(i * spacing, 1), batch) for i, batch in enumerate(batches)]
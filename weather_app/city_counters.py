@@ -0,0 +1,234 @@
+# weather_app/city_counters.py
+# Popular city request counters kept in Redis, flushed to PostgreSQL in bulk
+#
+#   popular_cities:counts    ZSET  city -> total requests (database count + unflushed)
+#   popular_cities:pending   HASH  city -> requests not yet written to PopularCity
+#   popular_cities:country   HASH  city -> country
+#   popular_cities:last      HASH  city -> last requested (unix time), until flushed
+#
+# Every upstream fetch is one pipelined round-trip, top-N is one ZREVRANGE,
+# and PopularCity rows are only touched by the periodic flush task.
+
+import time
+import logging
+from datetime import datetime, timezone as dt_timezone
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .redis_clients import get_redis
+from django.db import transaction
+from .models import PopularCity
+
+logger = logging.getLogger(__name__)
+
+COUNTS_KEY = "popular_cities:counts"
+PENDING_KEY = "popular_cities:pending"
+FLUSHING_KEY = "popular_cities:pending:flushing"
+COUNTRY_KEY = "popular_cities:country"
+LAST_REQUESTED_KEY = "popular_cities:last"
+SEEDED_KEY = "popular_cities:seeded"
+
+redis_client = get_redis('counters')
+
+# KEYS[1] last requested hash | ARGV city, timestamp, ... -> fields deleted
+# Drops the timestamps a flush wrote to the database, unless a newer request replaced them meanwhile
+PRUNE_LAST_REQUESTED_SCRIPT = """
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        deleted = deleted + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return deleted
+"""
+
+_prune_last_requested = redis_client.register_script(PRUNE_LAST_REQUESTED_SCRIPT)
+
+
+def _queue_increment(pipe, city, country):
+    pipe.zincrby(COUNTS_KEY, 1, city)
+    pipe.hincrby(PENDING_KEY, city, 1)
+    pipe.hset(COUNTRY_KEY, city, country)
+    pipe.hset(LAST_REQUESTED_KEY, city, time.time())
+
+
+def record_city_request(city, country):
+    """Count one upstream request for a city"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        _queue_increment(pipe, city, country)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not count request for {city}: {e}")
+
+
+def record_city_requests(cities):
+    """Count one upstream request for each (city, country), in one round-trip"""
+    cities = list(cities)
+    if not cities:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for city, country in cities:
+            _queue_increment(pipe, city, country)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not count requests for {len(cities)} cities: {e}")
+
+
+async def arecord_city_request(async_redis_client, city, country):
+    """Async record_city_request"""
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        _queue_increment(pipe, city, country)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not count request for {city}: {e}")
+
+
+def _format_top(ranked, countries):
+    return [
+        {'city': city, 'country': country or '', 'request_count': int(score)}
+        for (city, score), country in zip(ranked, countries)
+    ]
+
+
+def top_cities(limit=10):
+    """Most requested cities, same shape as PopularCity.objects.values('city', 'country', 'request_count')"""
+    try:
+        if not redis_client.exists(SEEDED_KEY):
+            seed_from_database()
+        ranked = redis_client.zrevrange(COUNTS_KEY, 0, limit - 1, withscores=True)
+        countries = redis_client.hmget(COUNTRY_KEY, [city for city, _ in ranked]) if ranked else []
+        return _format_top(ranked, countries)
+    except redis.RedisError:
+        return list(
+            PopularCity.objects.values('city', 'country', 'request_count')
+            .order_by('-request_count')[:limit]
+        )
+
+
+async def atop_cities(async_redis_client, limit=10):
+    """Async top_cities"""
+    try:
+        if not await async_redis_client.exists(SEEDED_KEY):
+            await sync_to_async(seed_from_database)()
+        ranked = await async_redis_client.zrevrange(COUNTS_KEY, 0, limit - 1, withscores=True)
+        countries = await async_redis_client.hmget(COUNTRY_KEY, [city for city, _ in ranked]) if ranked else []
+        return _format_top(ranked, countries)
+    except redis.RedisError:
+        return [
+            row async for row in PopularCity.objects.values('city', 'country', 'request_count')
+            .order_by('-request_count')[:limit]
+        ]
+
+
+def seed_from_database():
+    """
+    Load PopularCity counts into the sorted set the first time it is used
+    (or after Redis lost it). Increments that arrived first are kept, since
+    seeding adds to whatever is already there.
+    """
+    if not redis_client.set(SEEDED_KEY, 1, nx=True):
+        return 0
+
+    cities = list(PopularCity.objects.values_list('city', 'country', 'request_count'))
+    if cities:
+        pipe = redis_client.pipeline(transaction=False)
+        for city, country, request_count in cities:
+            pipe.zincrby(COUNTS_KEY, request_count, city)
+            pipe.hsetnx(COUNTRY_KEY, city, country)
+        pipe.execute()
+    logger.info(f"Seeded {len(cities)} popular cities into Redis")
+    return len(cities)
+
+
+def reseed_from_database():
+    """Rebuild the sorted set from PopularCity plus unflushed deltas (after bulk database changes)"""
+    pending = redis_client.hgetall(PENDING_KEY)
+    totals = {}
+    countries = {}
+    for city, country, request_count in PopularCity.objects.values_list('city', 'country', 'request_count'):
+        totals[city] = request_count
+        countries[city] = country
+    for city, delta in pending.items():
+        totals[city] = totals.get(city, 0) + int(delta)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(COUNTS_KEY)
+    if totals:
+        pipe.zadd(COUNTS_KEY, totals)
+    if countries:
+        pipe.hset(COUNTRY_KEY, mapping=countries)
+    pipe.set(SEEDED_KEY, 1)
+    pipe.execute()
+    return len(totals)
+
+
+def sync_city(city, country, request_count):
+    """Set one city's total after its PopularCity row was saved directly (admin, management commands)"""
+    pending = int(redis_client.hget(PENDING_KEY, city) or 0)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(COUNTS_KEY, {city: request_count + pending})
+    pipe.hset(COUNTRY_KEY, city, country)
+    pipe.execute()
+
+
+def remove_city(city):
+    """Forget a city whose PopularCity row was deleted"""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zrem(COUNTS_KEY, city)
+    pipe.hdel(COUNTRY_KEY, city)
+    pipe.hdel(LAST_REQUESTED_KEY, city)
+    pipe.execute()
+
+
+def flush_counts_to_database():
+    """
+    Apply unflushed deltas to PopularCity in bulk
+    The pending hash is renamed away first, so increments that arrive while we
+    write go into a fresh hash for the next flush. A leftover hash from a failed
+    flush is retried before new deltas are taken.
+    """
+    if not redis_client.exists(FLUSHING_KEY):
+        try:
+            redis_client.rename(PENDING_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            return 0  # nothing pending
+
+    deltas = {city: int(delta) for city, delta in redis_client.hgetall(FLUSHING_KEY).items() if int(delta)}
+    cities = list(deltas)
+    countries, last_requested = {}, {}
+    if cities:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hmget(COUNTRY_KEY, cities)
+        pipe.hmget(LAST_REQUESTED_KEY, cities)
+        country_values, last_values = pipe.execute()
+        countries = dict(zip(cities, country_values))
+        last_requested = {city: ts for city, ts in zip(cities, last_values) if ts}
+
+    def requested_at(city):
+        ts = last_requested.get(city)
+        return datetime.fromtimestamp(float(ts), tz=dt_timezone.utc) if ts else datetime.now(tz=dt_timezone.utc)
+
+    with transaction.atomic():
+        existing = {
+            popular_city.city: popular_city
+            for popular_city in PopularCity.objects.select_for_update().filter(city__in=list(deltas))
+        }
+        for city, popular_city in existing.items():
+            popular_city.request_count += deltas[city]
+            popular_city.last_requested = requested_at(city)
+        PopularCity.objects.bulk_update(existing.values(), ['request_count', 'last_requested'], batch_size=500)
+
+        PopularCity.objects.bulk_create([
+            PopularCity(city=city, country=countries.get(city) or '', request_count=delta,
+                        last_requested=requested_at(city))
+            for city, delta in deltas.items() if city not in existing
+        ], batch_size=500)
+
+    redis_client.delete(FLUSHING_KEY)
+    if last_requested:
+        _prune_last_requested(keys=[LAST_REQUESTED_KEY], args=[v for item in last_requested.items() for v in item])
+    logger.info(f"Flushed request counts for {len(deltas)} cities")
+    return len(deltas)
@@ -1,5 +1,5 @@
 # weather_app/email_client.py
-from django.core.mail import send_mail
+from django.core.mail import send_mail, get_connection, EmailMessage as MailMessage
 from django.conf import settings
 import logging
 
@@ -23,6 +23,43 @@ class EmailAPI:
             logger.error(f"Email sending error: {str(e)}", exc_info=True)
             raise Exception(f"Email sending error: {str(e)}")
 
+    def send_batch(self, messages):
+        """
+        Send many emails over one SMTP connection
+        messages is a list of (email_address, message, subject) tuples, returns one
+        result per message in the same order, so a bad address doesn't fail the batch
+        """
+        logger.info(f"Attempting to send a batch of {len(messages)} emails")
+        results = []
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for email_address, message, subject in messages:
+                try:
+                    connection.send_messages([MailMessage(
+                        subject=subject,
+                        body=message,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        to=[email_address],
+                        connection=connection,
+                    )])
+                    results.append({"success": True, "messages": [{"id": "email_sent"}]})
+                except Exception as e:
+                    logger.error(f"Email sending error for {email_address}: {str(e)}")
+                    results.append({"success": False, "error": str(e)})
+                    #the server may have dropped us, start clean for the next message
+                    connection.close()
+                    connection.open()
+        except Exception as e:
+            # couldn't (re)connect, everything not sent yet fails
+            logger.error(f"Email connection error: {str(e)}", exc_info=True)
+            results.extend({"success": False, "error": str(e)} for _ in messages[len(results):])
+        finally:
+            connection.close()
+
+        logger.info(f"Sent {sum(r['success'] for r in results)}/{len(messages)} emails in batch")
+        return results
+
 # Create instance
 email_api = EmailAPI()
 
@@ -0,0 +1,151 @@
+# weather_app/exports.py
+# Streaming CSV/NDJSON exports of the log tables
+#
+# Rows come from a server-side cursor (.iterator) and are encoded one at a
+# time, so memory stays flat however many rows are exported. Used by the
+# export_data management command and the /api/export/<kind>/ endpoint.
+
+import csv
+import itertools
+import json
+import zlib
+from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import WeatherRequest, UserActivity
+
+# kind -> (model, exported fields, time field, field the city filter applies to)
+EXPORTS = {
+    'weather': (
+        WeatherRequest,
+        ['id', 'city', 'country', 'temperature', 'feels_like', 'description', 'humidity',
+         'pressure', 'wind_speed', 'requested_at', 'api_response_time', 'request_type'],
+        'requested_at',
+        'city',
+    ),
+    'activity': (
+        UserActivity,
+        ['id', 'session_key', 'ip_address', 'user_agent', 'action', 'city_requested',
+         'timestamp', 'response_time'],
+        'timestamp',
+        'city_requested',
+    ),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a start/end filter: an ISO datetime, or a date meaning the start
+    of that day (for end, the whole day is included)
+    """
+    if not value:
+        return None
+    try:
+        # parse_datetime also accepts a bare date, so try the date first
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+    elif moment is None:
+        raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(kind, city=None, start=None, end=None, request_type=None, action=None, chunk_size=None):
+    """Returns (field names, row iterator) for an export, filters are optional"""
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export: {kind}")
+    model, fields, time_field, city_field = EXPORTS[kind]
+
+    queryset = model.objects.all()
+    if city:
+        queryset = queryset.filter(**{f'{city_field}__iexact': city})
+    if start:
+        queryset = queryset.filter(**{f'{time_field}__gte': parse_bound(start)})
+    if end:
+        queryset = queryset.filter(**{f'{time_field}__lt': parse_bound(end, end=True)})
+    if request_type and model is WeatherRequest:
+        queryset = queryset.filter(request_type=request_type)
+    if action and model is UserActivity:
+        queryset = queryset.filter(action=action)
+
+    rows = queryset.order_by(time_field, 'id').values_list(*fields).iterator(
+        chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE
+    )
+    return fields, rows
+
+
+class _LineBuffer:
+    """File-like object that hands back what csv.writer writes"""
+    def write(self, value):
+        return value
+
+
+def iter_csv(fields, rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def iter_gzip(chunks, flush_size=64 * 1024):
+    """gzip a stream of text chunks, yielding compressed blocks of about flush_size"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = chunk.encode()
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= flush_size:
+            compressed = compressor.compress(b"".join(pending))
+            pending, pending_size = [], 0
+            if compressed:
+                yield compressed
+    compressed = compressor.compress(b"".join(pending)) + compressor.flush()
+    if compressed:
+        yield compressed
+
+
+def stream_export(kind, fmt='csv', gzip=False, **filters):
+    """Encoded chunks (str, or bytes when gzip is set) for an export"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    fields, rows = export_rows(kind, **filters)
+    chunks = iter_csv(fields, rows) if fmt == 'csv' else iter_ndjson(fields, rows)
+    return iter_gzip(chunks) if gzip else chunks
+
+
+async def aiter_chunks(chunks, batch_size=500):
+    """
+    Async iterator over a sync chunk iterator, for StreamingHttpResponse under ASGI
+    (given a sync iterator there, Django reads it all into memory first).
+    Chunks are pulled batch_size at a time on the sync thread the ORM uses.
+    """
+    chunks = iter(chunks)
+
+    def next_batch():
+        return list(itertools.islice(chunks, batch_size))
+
+    while True:
+        batch = await sync_to_async(next_batch)()
+        if not batch:
+            return
+        yield batch[0][:0].join(batch)  # '' or b'' join
@@ -0,0 +1,95 @@
+# weather_app/flushers.py
+# Background flushing for per-process buffers (write buffer, cache metrics)
+#
+# A buffer subclasses PeriodicFlusher and implements flush(); the first use in
+# a process starts a daemon thread that calls it every flush_interval seconds
+# (or sooner when woken). Buffers registered with register() are also flushed
+# when the process exits, at interpreter exit or Celery worker shutdown.
+
+import atexit
+import os
+import threading
+import logging
+from celery.signals import worker_process_shutdown
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """
+    Base for per-process buffers flushed by a background thread
+    Subclasses implement flush() and may override reset() (drop state a forked
+    child inherited from its parent) and after_flush() (clean up per flush).
+    """
+
+    thread_name = 'flusher'
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def flush(self):
+        raise NotImplementedError
+
+    def reset(self):
+        """Called with the lock held in a forked child"""
+
+    def after_flush(self):
+        """Called on the flush thread after every flush"""
+
+    def wake(self):
+        """Flush now instead of at the end of the interval"""
+        self._wakeup.set()
+
+    def ensure_flusher(self):
+        """Start the flush thread once per process; a forked child resets the parent's state"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                self.reset()
+            self._pid = pid
+        if self.flush_interval:
+            threading.Thread(target=self._run, name=self.thread_name, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in {self.thread_name} flush: {e}")
+            finally:
+                self.after_flush()
+
+
+_registered = []
+
+def register(flusher):
+    """Flush flusher when the process exits, returns it"""
+    _registered.append(flusher)
+    return flusher
+
+def flush_registered():
+    """Flush every registered buffer, returns the number of items written"""
+    total = 0
+    for flusher in list(_registered):
+        try:
+            total += flusher.flush()
+        except Exception as e:
+            logger.error(f"Error flushing {flusher.thread_name} at shutdown: {e}")
+    return total
+
+
+# Don't lose buffered data when a web or Celery worker process exits
+atexit.register(flush_registered)
+
+@worker_process_shutdown.connect
+def flush_on_worker_shutdown(**kwargs):
+    flush_registered()
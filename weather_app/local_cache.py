@@ -0,0 +1,150 @@
+# weather_app/local_cache.py
+# Small in-process (L1) cache in front of the Redis cache for hot weather keys
+
+import copy
+import os
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+import redis
+from django.conf import settings
+from .redis_clients import get_redis
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "weather_app:l1_invalidate"
+INVALIDATE_ALL = "*"
+
+
+class LocalCache:
+    """
+    Bounded LRU cache with a per-entry TTL, local to one process
+
+    Keys are invalidated across processes through Redis pub/sub: set and
+    delete publish the key when called with publish=True (the default only
+    touches this process), and a listener thread in each process drops
+    published keys from its own copy, except the ones this instance sent.
+    Writers that change a value other processes may hold must publish.
+    The TTL bounds how stale an entry can get if a message is missed.
+    """
+
+    def __init__(self, max_entries, ttl, channel=INVALIDATION_CHANNEL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.channel = channel
+        self.enabled = max_entries > 0 and ttl > 0
+        self.instance_id = uuid.uuid4().hex
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def get(self, key):
+        """Return a copy of the cached value, or None if missing/expired"""
+        if not self.enabled:
+            return None
+        self._ensure_listener()
+
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+
+        #callers decorate what they get back, keep our copy clean
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl=None, publish=False):
+        """Store a value, evicting the least recently used entry when full (other processes drop theirs when publish is set)"""
+        if not self.enabled:
+            return
+        self._ensure_listener()
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if publish:
+            self.publish_invalidation(key)
+
+    def delete(self, key, publish=False):
+        """Drop a key locally, and in every other process when publish is set"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if publish:
+            self.publish_invalidation(key)
+
+    def clear(self, publish=False):
+        """Drop everything locally, and in every other process when publish is set"""
+        with self._lock:
+            self._entries.clear()
+        if publish:
+            self.publish_invalidation(INVALIDATE_ALL)
+
+    def invalidation_message(self, key):
+        """Pub/sub payload telling the other processes to drop key"""
+        return f"{self.instance_id}|{key}"
+
+    def publish_invalidation(self, key):
+        """Tell the other processes to drop key"""
+        try:
+            get_redis('cache').publish(self.channel, self.invalidation_message(key))
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish L1 invalidation for {key}: {e}")
+
+    def _ensure_listener(self):
+        """Start the invalidation listener once per process (again after a fork)"""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            if self._listener_pid is not None:
+                #forked child: the parent's entries aren't ours (redis_clients resets the connections)
+                self._entries.clear()
+            self._listener_pid = pid
+            # A fresh id per process so we still hear invalidations from a forked parent
+            self.instance_id = uuid.uuid4().hex
+        thread = threading.Thread(target=self._listen, name="l1-cache-invalidation", daemon=True)
+        thread.start()
+
+    def _handle_message(self, data):
+        sender, _, key = data.partition("|")
+        if sender == self.instance_id:
+            return
+        if key == INVALIDATE_ALL:
+            self.clear()
+        else:
+            self.delete(key)
+
+    def _listen(self):
+        backoff = 1
+        while True:
+            try:
+                pubsub = get_redis('pubsub').pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                #anything published while we were disconnected is lost
+                self.clear()
+                backoff = 1
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle_message(message["data"])
+            except redis.RedisError as e:
+                logger.debug(f"L1 invalidation listener disconnected: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+# Shared L1 cache for weather entries
+weather_l1_cache = LocalCache(
+    max_entries=settings.WEATHER_L1_MAX_ENTRIES,
+    ttl=settings.WEATHER_L1_TTL
+)
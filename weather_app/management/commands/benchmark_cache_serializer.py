@@ -0,0 +1,125 @@
+# weather_app/management/commands/benchmark_cache_serializer.py
+# Compare the cache serializer formats and compressions against pickle
+
+import pickle
+import time
+import uuid
+import redis
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+from weather_app.cache_serializer import CODECS, COMPRESSIONS, WeatherCacheSerializer
+from weather_app.views import WeatherService
+
+
+def sample_payloads():
+    """Values shaped like the ones the app caches"""
+    service = WeatherService()
+    weather = {
+        "city": "Buenos Aires",
+        "country": "Argentina",
+        "temperature": 24,
+        "feels_like": 25,
+        "description": "Partly cloudy",
+        "humidity": 61,
+        "pressure": 1012,
+        "wind_speed": 4.2,
+        "icon": "https://cdn.weatherapi.com/weather/64x64/day/116.png",
+        "timestamp": "14:05:09",
+    }
+    return {
+        'weather entry': service.make_cache_entry(weather, fetch_time=0.42),
+        'last known good': weather,
+        'popular cities': [
+            {'city': city, 'country': 'Country', 'request_count': 1000 - i}
+            for i, city in enumerate(service.cities[:10])
+        ],
+        'session': {
+            '_auth_user_id': '42',
+            '_auth_user_backend': 'django.contrib.auth.backends.ModelBackend',
+            '_auth_user_hash': 'f' * 64,
+        },
+        'weather batch': {city: dict(weather, city=city) for city in service.cities},
+    }
+
+
+class PickleSerializer:
+    """django_redis's default, the baseline"""
+    format, compression = 'pickle', 'none'
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.DEFAULT_PROTOCOL)
+
+    def loads(self, value):
+        return pickle.loads(value)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark cache serializers: encode/decode time and Redis memory per key against pickle'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Encodes/decodes timed per value')
+        parser.add_argument('--formats', nargs='+', choices=sorted(CODECS), default=['orjson', 'msgpack'])
+        parser.add_argument('--compressions', nargs='+', choices=sorted(COMPRESSIONS), default=sorted(COMPRESSIONS))
+        parser.add_argument('--min-size', type=int, help='Compression threshold in bytes (default: CACHE_COMPRESS_MIN_SIZE)')
+
+    def handle(self, *args, **options):
+        serializers = [PickleSerializer()]
+        for format in options['formats']:
+            for compression in options['compressions']:
+                try:
+                    serializers.append(WeatherCacheSerializer(
+                        format=format, compression=compression, min_size=options['min_size']
+                    ))
+                except ImproperlyConfigured as e:
+                    self.stdout.write(self.style.WARNING(f'Skipping {format}+{compression}: {e}'))
+
+        redis_client = get_redis_connection('default')
+        iterations = options['iterations']
+
+        for name, value in sample_payloads().items():
+            self.stdout.write(f'\n{name}:')
+            self.stdout.write(f"  {'serializer':<18} {'bytes':>7} {'redis':>7} {'encode µs':>10} {'decode µs':>10}")
+            for serializer in serializers:
+                row = self.measure(serializer, value, iterations, redis_client)
+                label = serializer.format if serializer.compression == 'none' else f'{serializer.format}+{serializer.compression}'
+                self.stdout.write(
+                    f"  {label:<18} {row['bytes']:>7,} {row['redis']:>7} "
+                    f"{row['encode']:>10.2f} {row['decode']:>10.2f}"
+                )
+        self.stdout.write('\nredis is MEMORY USAGE per key (value, key and overhead), "-" if the server lacks it')
+
+    def measure(self, serializer, value, iterations, redis_client):
+        """Payload size, Redis memory and mean encode/decode time (µs) of one value"""
+        payload = serializer.dumps(value)
+        assert serializer.loads(payload) == value, f'{serializer.format} changed the value'
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            serializer.dumps(value)
+        encode = (time.perf_counter() - start) / iterations * 1e6
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            serializer.loads(payload)
+        decode = (time.perf_counter() - start) / iterations * 1e6
+
+        key = cache.make_key(f'serializer_benchmark:{uuid.uuid4().hex}')
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.set(key, payload, ex=60)
+            pipe.memory_usage(key)
+            pipe.unlink(key)
+            memory = pipe.execute(raise_on_error=False)[1]
+        except redis.RedisError:
+            memory = None
+        if isinstance(memory, Exception):
+            memory = None
+
+        return {
+            'bytes': len(payload),
+            'redis': f'{memory:,}' if memory is not None else '-',
+            'encode': encode,
+            'decode': decode,
+        }
@@ -0,0 +1,52 @@
+# weather_app/management/commands/export_data.py
+# Stream WeatherRequest/UserActivity history to a CSV or NDJSON file
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from weather_app.exports import EXPORTS, FORMATS, stream_export
+
+class Command(BaseCommand):
+    help = 'Export weather requests or user activity as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='What to export')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Output format')
+        parser.add_argument('--gzip', action='store_true', help='gzip the output')
+        parser.add_argument('--city', help='Only rows for this city')
+        parser.add_argument('--start', help='Start date/datetime (inclusive, ISO format)')
+        parser.add_argument('--end', help='End date/datetime (a date includes the whole day)')
+        parser.add_argument('--request-type', help='Only weather requests of this type')
+        parser.add_argument('--action', help='Only user activity with this action')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        try:
+            chunks = stream_export(
+                options['kind'], options['format'], options['gzip'],
+                city=options['city'],
+                start=options['start'],
+                end=options['end'],
+                request_type=options['request_type'],
+                action=options['action'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            if options['gzip']:
+                f = open(options['output'], 'wb')
+            else:
+                f = open(options['output'], 'w', newline='', encoding='utf-8')
+            with f:
+                for chunk in chunks:
+                    f.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Exported {options['kind']} to {options['output']}"))
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
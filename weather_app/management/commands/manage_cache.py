@@ -3,10 +3,15 @@
 
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
-from django.db import transaction
-from weather_app.models import WeatherRequest, PopularCity, UserActivity
+from django.utils import timezone
+from weather_app.models import WeatherRequest, PopularCity, UserActivity, EmailMessage
 from weather_app.cache_manager import CacheManager, clear_all_caches, refresh_all_caches
-import redis
+from weather_app.rollups import weather_summary, activity_summary
+from weather_app.partitions import is_partitioned, drop_partitions_before, delete_in_chunks
+from weather_app.redis_clients import get_redis, registry as redis_registry, count_keys
+from weather_app.cache_generations import weather_generations
+from weather_app.cache_metrics import cache_metrics
+from django_redis import get_redis_connection
 from django.conf import settings
 from datetime import datetime, timedelta
 
@@ -35,6 +40,17 @@ class Command(BaseCommand):
             metavar='DAYS',
             help='Clear database records older than N days'
         )
+        parser.add_argument(
+            '--detach-only',
+            action='store_true',
+            help='With --clear-old-data, detach old partitions instead of dropping them'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows deleted per transaction by --clear-old-data'
+        )
         parser.add_argument(
             '--populate-test-data',
             action='store_true',
@@ -51,6 +67,17 @@ class Command(BaseCommand):
             metavar='CITY_NAME',
             help='Invalidate cache for specific city'
         )
+        parser.add_argument(
+            '--invalidate-country',
+            type=str,
+            metavar='COUNTRY',
+            help='Invalidate cache for every city in a country'
+        )
+        parser.add_argument(
+            '--purge-old-generations',
+            action='store_true',
+            help='Delete weather entries of earlier cache generations now instead of waiting for their TTL'
+        )
     
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('🌤️  Weather App Database & Cache Manager'))
@@ -69,7 +96,7 @@ class Command(BaseCommand):
             self.sync_database_cache()
         
         if options['clear_old_data']:
-            self.clear_old_data(options['clear_old_data'])
+            self.clear_old_data(options['clear_old_data'], options['detach_only'], options['chunk_size'])
         
         if options['populate_test_data']:
             self.populate_test_data()
@@ -77,6 +104,12 @@ class Command(BaseCommand):
         if options['invalidate_city']:
             self.invalidate_city_cache(options['invalidate_city'])
         
+        if options['invalidate_country']:
+            self.invalidate_country_cache(options['invalidate_country'])
+        
+        if options['purge_old_generations']:
+            self.purge_old_generations()
+        
         if not any(options.values()):
             self.show_help()
     
@@ -86,9 +119,9 @@ class Command(BaseCommand):
         self.stdout.write('-' * 40)
         
         try:
-            # Database statistics
-            weather_requests = WeatherRequest.objects.count()
-            user_activities = UserActivity.objects.count()
+            # Database statistics (from the rollups, not the raw log tables)
+            weather_requests = weather_summary()['requests']
+            user_activities = sum(activity_summary().values())
             popular_cities = PopularCity.objects.count()
             
             self.stdout.write(f'Database Records:')
@@ -97,17 +130,14 @@ class Command(BaseCommand):
             self.stdout.write(f'  Popular Cities:   {popular_cities:,}')
             
             # Cache statistics
-            redis_client = redis.Redis(
-                host=settings.REDIS_HOST,
-                port=settings.REDIS_PORT,
-                db=0,
-                decode_responses=True
-            )
+            redis_client = get_redis('cache')
             
-            # Count different types of cache keys
-            weather_keys = len(redis_client.keys("weather_app:1:weather:*"))
-            rate_limit_keys = len(redis_client.keys("rate_limit:*"))
-            cache_stat_keys = len(redis_client.keys("cache_*"))
+            # Count different types of cache keys (SCAN, so Redis keeps serving meanwhile)
+            weather_keys = count_keys(
+                get_redis_connection('default'), cache.make_key(f"weather:g{weather_generations.current()}:*")
+            )
+            rate_limit_keys = count_keys(get_redis('ratelimit'), "rate_limit:*")
+            cache_stat_keys = count_keys(redis_client, "cache_metrics:*")
             
             self.stdout.write(f'\nCache Entries:')
             self.stdout.write(f'  Weather Cache:    {weather_keys}')
@@ -118,13 +148,30 @@ class Command(BaseCommand):
             memory_info = redis_client.info('memory')
             used_memory = memory_info.get('used_memory_human', 'Unknown')
             self.stdout.write(f'  Redis Memory:     {used_memory}')
+            for purpose, pool in redis_registry.pool_stats().items():
+                usage = f"{pool['in_use']} in use, {pool['idle']} idle" if pool['in_use'] is not None else "usage unknown"
+                self.stdout.write(f"  Pool {purpose + ':':<13} {usage} (max {pool['max']})")
+            
+            # Rolling weather cache hit rates
+            self.stdout.write(f'\nCache Hit Rate:')
+            for window, stats in cache_metrics.hit_rates().items():
+                self.stdout.write(f"  {window + ':':<5} {stats['hit_rate']:>6}% of {stats['total']:,} lookups")
             
             # Recent activity
-            recent_requests = WeatherRequest.objects.filter(
-                requested_at__gte=datetime.now() - timedelta(hours=24)
-            ).count()
+            recent = weather_summary(hours=24)
             self.stdout.write(f'\nRecent Activity (24h):')
-            self.stdout.write(f'  Weather Requests: {recent_requests:,}')
+            self.stdout.write(f'  Weather Requests: {recent["requests"]:,}')
+            if recent['avg_response_time'] is not None:
+                p50, p95 = (
+                    f'{recent[key]}s' if recent[key] is not None else 'unknown'
+                    for key in ('p50_response_time', 'p95_response_time')
+                )
+                self.stdout.write(f'  API Response:     avg {recent["avg_response_time"]:.3f}s, p50 <= {p50}, p95 <= {p95}')
+            for request_type, count in sorted(recent['request_types'].items()):
+                self.stdout.write(f'    {request_type}: {count:,}')
+            for action, count in sorted(activity_summary(hours=24).items()):
+                self.stdout.write(f'  {action}: {count:,}')
+            self.stdout.write('  (rollups are updated every 5 minutes)')
             
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error getting statistics: {e}'))
@@ -184,33 +231,43 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'❌ Error synchronizing: {e}'))
 
     
-    def clear_old_data(self, days):
+    def clear_old_data(self, days, detach_only=False, chunk_size=5000):
         """Clear old database records"""
         self.stdout.write(f'\n🧹 Clearing Data Older Than {days} Days:')
         self.stdout.write('-' * 45)
         
         try:
-            cutoff_date = datetime.now() - timedelta(days=days)
+            cutoff_date = timezone.now() - timedelta(days=days)
+            total = 0
             
-            with transaction.atomic():
-                # Clear old weather requests
-                old_weather = WeatherRequest.objects.filter(requested_at__lt=cutoff_date)
-                weather_count = old_weather.count()
-                old_weather.delete()
-                
-                # Clear old user activities
-                old_activities = UserActivity.objects.filter(timestamp__lt=cutoff_date)
-                activity_count = old_activities.count()
-                old_activities.delete()
+            for model, column, label in [
+                (WeatherRequest, 'requested_at', 'weather requests'),
+                (UserActivity, 'timestamp', 'user activities'),
+                (EmailMessage, 'timestamp', 'email messages'),
+            ]:
+                table = model._meta.db_table
                 
-                self.stdout.write(f'  Deleted {weather_count:,} old weather requests')
-                self.stdout.write(f'  Deleted {activity_count:,} old user activities')
+                # Whole months go by dropping (or detaching) their partitions
+                if is_partitioned(table):
+                    removed = drop_partitions_before(table, cutoff_date, detach_only=detach_only)
+                    action = 'Detached' if detach_only else 'Dropped'
+                    for name in removed:
+                        self.stdout.write(f'  {action} partition {name}')
                 
-                # Update cache to reflect changes
-                CacheManager.invalidate_popular_cities_cache()
-                CacheManager.sync_database_to_cache()
+                # The rest in small batches, each its own transaction
+                def progress(deleted, label=label):
+                    self.stdout.write(f'  Deleting old {label}: {deleted:,}', ending='\r')
+                    self.stdout.flush()
                 
-                self.stdout.write(self.style.SUCCESS(f'✅ Cleared {weather_count + activity_count:,} old records'))
+                deleted = delete_in_chunks(table, column, cutoff_date, chunk_size=chunk_size, progress=progress)
+                self.stdout.write(f'  Deleted {deleted:,} old {label}' + ' ' * 10)
+                total += deleted
+            
+            # Update cache to reflect changes
+            CacheManager.invalidate_popular_cities_cache()
+            CacheManager.sync_database_to_cache()
+            
+            self.stdout.write(self.style.SUCCESS(f'✅ Cleared {total:,} old records (plus any dropped partitions)'))
                 
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'❌ Error clearing old data: {e}'))
@@ -274,6 +331,32 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'❌ Error invalidating cache: {e}'))
     
+    def invalidate_country_cache(self, country):
+        """Invalidate cache for every city in a country"""
+        self.stdout.write(f'\n🎯 Invalidating Cache for {country}:')
+        self.stdout.write('-' * 40)
+        
+        generation = CacheManager.invalidate_country_weather_cache(country)
+        if generation:
+            self.stdout.write(self.style.SUCCESS(f'✅ Cache for {country} moved to generation {generation}'))
+        else:
+            self.stdout.write(self.style.ERROR(f'❌ Error invalidating cache for {country}'))
+    
+    def purge_old_generations(self):
+        """Delete weather entries of earlier cache generations"""
+        self.stdout.write('\n🗑️  Purging Old Weather Cache Generations:')
+        self.stdout.write('-' * 40)
+        
+        try:
+            def progress(deleted):
+                self.stdout.write(f'  Unlinking old weather keys: {deleted:,}', ending='\r')
+            
+            deleted = CacheManager.purge_old_generations(progress)
+            self.stdout.write(f'  Unlinked {deleted:,} old weather keys' + ' ' * 10)
+            
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'❌ Error purging old generations: {e}'))
+    
     def show_help(self):
         """Show usage examples"""
         self.stdout.write('\n💡 Usage Examples:')
@@ -283,6 +366,9 @@ class Command(BaseCommand):
         self.stdout.write('python manage.py manage_cache --refresh-cache')
         self.stdout.write('python manage.py manage_cache --sync-db-cache')
         self.stdout.write('python manage.py manage_cache --clear-old-data 30')
+        self.stdout.write('python manage.py manage_cache --clear-old-data 90 --detach-only')
         self.stdout.write('python manage.py manage_cache --populate-test-data')
         self.stdout.write('python manage.py manage_cache --invalidate-city London')
+        self.stdout.write('python manage.py manage_cache --invalidate-country France')
+        self.stdout.write('python manage.py manage_cache --purge-old-generations')
 
@@ -0,0 +1,123 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('phone_number', models.CharField(max_length=100)),
+                ('message', models.TextField()),
+                ('error', models.TextField()),
+                ('failed_at', models.DateTimeField()),
+                ('status', models.CharField(default='failed', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-failed_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PopularCity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100, unique=True)),
+                ('country', models.CharField(max_length=100)),
+                ('request_count', models.IntegerField(default=1)),
+                ('last_requested', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Popular Cities',
+                'ordering': ['-request_count'],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('ip_address', models.GenericIPAddressField()),
+                ('user_agent', models.TextField()),
+                ('action', models.CharField(choices=[('page_load', 'Page Load'), ('random_weather', 'Random Weather Request'), ('search_weather', 'Search Weather Request')], max_length=50)),
+                ('city_requested', models.CharField(blank=True, max_length=100)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('response_time', models.FloatField(blank=True, help_text='Total response time in seconds', null=True)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [models.Index(fields=['ip_address'], name='weather_app_ip_addr_880d5b_idx'), models.Index(fields=['timestamp'], name='weather_app_timesta_926106_idx'), models.Index(fields=['session_key'], name='weather_app_session_ed4f55_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeatherRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=100)),
+                ('country', models.CharField(max_length=100)),
+                ('temperature', models.FloatField()),
+                ('feels_like', models.FloatField()),
+                ('description', models.CharField(max_length=200)),
+                ('humidity', models.IntegerField()),
+                ('pressure', models.FloatField()),
+                ('wind_speed', models.FloatField()),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('api_response_time', models.FloatField(help_text='API response time in seconds')),
+                ('request_type', models.CharField(choices=[('default', 'Default Cupertino'), ('random', 'Random Cities'), ('search', 'User Search')], default='default', max_length=20)),
+            ],
+            options={
+                'ordering': ['-requested_at'],
+                'indexes': [models.Index(fields=['city'], name='weather_app_city_2fa382_idx'), models.Index(fields=['requested_at'], name='weather_app_request_c9682c_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CeleryWeatherRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location', models.CharField(max_length=100)),
+                ('message_type', models.CharField(max_length=50)),
+                ('priority', models.CharField(default='normal', max_length=10)),
+                ('status', models.CharField(default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='weather_app_created_c73d30_idx'), models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='celery_req_pending_idx'), models.Index(condition=models.Q(('status', 'processing')), fields=['claimed_at'], name='celery_req_claimed_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EmailMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_type', models.CharField(max_length=50)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('temperature', models.FloatField()),
+                ('location', models.CharField(max_length=100)),
+                ('email_message_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('delivery_status', models.CharField(max_length=20)),
+                ('priority', models.CharField(default='normal', max_length=10)),
+                ('retry_count', models.IntegerField(default=0)),
+                ('subject', models.CharField(blank=True, max_length=200)),
+                ('body', models.TextField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['timestamp', 'delivery_status'], name='email_timestamp_status_idx'), models.Index(condition=models.Q(('delivery_status', 'failed'), ('retry_count__gte', 3)), fields=['-timestamp'], name='email_dead_letter_idx'), models.Index(condition=models.Q(('delivery_status', 'queued')), fields=['id'], name='email_queued_idx')],
+            },
+        ),
+    ]
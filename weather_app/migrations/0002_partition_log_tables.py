@@ -0,0 +1,112 @@
+# Convert the log tables to monthly range-partitioned tables (PostgreSQL only)
+
+from django.db import migrations
+from django.utils import timezone
+from weather_app.partitions import month_start, add_months, create_month_partition
+
+# model -> partition key field
+PARTITIONED_MODELS = {
+    'WeatherRequest': 'requested_at',
+    'UserActivity': 'timestamp',
+    'EmailMessage': 'timestamp',
+}
+
+MONTHS_AHEAD = 2
+
+
+def partition_table(schema_editor, model, column):
+    """
+    Rebuild model's table as PARTITION BY RANGE (column)
+    PostgreSQL requires the partition key in the primary key, so it becomes
+    (id, column); Django still treats id as the primary key.
+    """
+    table = model._meta.db_table
+    old_table = f"{table}_unpartitioned"
+    qn = schema_editor.quote_name
+
+    with schema_editor.connection.cursor() as cursor:
+        schema_editor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old_table)}")
+        schema_editor.execute(
+            f"CREATE TABLE {qn(table)} (LIKE {qn(old_table)} INCLUDING DEFAULTS) PARTITION BY RANGE ({qn(column)})"
+        )
+
+        # a partition per month from the oldest row to a couple of months ahead
+        cursor.execute(f"SELECT MIN({qn(column)}) FROM {qn(old_table)}")
+        oldest = cursor.fetchone()[0] or timezone.now()
+        start, last = month_start(oldest), add_months(month_start(timezone.now()), MONTHS_AHEAD)
+        while start <= last:
+            create_month_partition(cursor, table, start)
+            start = add_months(start, 1)
+        schema_editor.execute(f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(table)} DEFAULT")
+
+        schema_editor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old_table)}")
+        schema_editor.execute(f"DROP TABLE {qn(old_table)}")
+
+    # id was an identity column on the old table, use a plain sequence here
+    sequence = f"{table}_id_seq"
+    schema_editor.execute(f"CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id")
+    schema_editor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    schema_editor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)")
+    schema_editor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {qn(column)})")
+
+    # LIKE doesn't copy indexes or foreign keys
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            target = field.target_field
+            schema_editor.execute(
+                f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(f'{table}_{field.column}_fk')} "
+                f"FOREIGN KEY ({qn(field.column)}) "
+                f"REFERENCES {qn(target.model._meta.db_table)} ({qn(target.column)}) DEFERRABLE INITIALLY DEFERRED"
+            )
+        if field.db_index and not field.primary_key:
+            schema_editor.execute(
+                f"CREATE INDEX {qn(f'{table}_{field.column}_idx')} ON {qn(table)} ({qn(field.column)})"
+            )
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+
+def partition_log_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, column in PARTITIONED_MODELS.items():
+        partition_table(schema_editor, apps.get_model('weather_app', model_name), column)
+
+
+def unpartition_table(schema_editor, model):
+    """
+    Rebuild model's partitioned table as the plain table 0001 created
+    The rows are parked in a scratch table while the partitioned one (with its
+    partitions and sequence) is dropped and the original recreated.
+    """
+    table = model._meta.db_table
+    rows_table = f"{table}_rows"
+    qn = schema_editor.quote_name
+    columns = ", ".join(qn(field.column) for field in model._meta.local_concrete_fields)
+
+    schema_editor.execute(f"CREATE TABLE {qn(rows_table)} AS SELECT {columns} FROM {qn(table)}")
+    schema_editor.execute(f"DROP TABLE {qn(table)} CASCADE")
+    schema_editor.create_model(model)
+    schema_editor.execute(f"INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(rows_table)}")
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)"
+    )
+    schema_editor.execute(f"DROP TABLE {qn(rows_table)}")
+
+
+def unpartition_log_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name in PARTITIONED_MODELS:
+        unpartition_table(schema_editor, apps.get_model('weather_app', model_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_log_tables, unpartition_log_tables),
+    ]
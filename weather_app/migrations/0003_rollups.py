@@ -0,0 +1,58 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0002_partition_log_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('timed_count', models.IntegerField(default=0)),
+                ('total_response_time', models.FloatField(default=0)),
+                ('latency_histogram', models.JSONField(default=list)),
+                ('action', models.CharField(max_length=50)),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket_start', 'action'), name='activity_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('timed_count', models.IntegerField(default=0)),
+                ('total_response_time', models.FloatField(default=0)),
+                ('latency_histogram', models.JSONField(default=list)),
+                ('city', models.CharField(max_length=100)),
+                ('country', models.CharField(max_length=100)),
+                ('request_types', models.JSONField(default=dict)),
+            ],
+            options={
+                'ordering': ['-bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket_start', 'city'), name='weather_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0003_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='weatherrequest',
+            name='request_type',
+            field=models.CharField(choices=[('default', 'Default Cupertino'), ('random', 'Random Cities'), ('search', 'User Search'), ('bulk', 'Bulk Ingestion')], default='default', max_length=20),
+        ),
+    ]
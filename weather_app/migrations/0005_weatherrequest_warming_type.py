@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0004_weatherrequest_bulk_type'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='weatherrequest',
+            name='request_type',
+            field=models.CharField(choices=[('default', 'Default Cupertino'), ('random', 'Random Cities'), ('search', 'User Search'), ('bulk', 'Bulk Ingestion'), ('warming', 'Cache Warming')], default='default', max_length=20),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0005_weatherrequest_warming_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='emailmessage',
+            index=models.Index(condition=models.Q(('delivery_status', 'sending')), fields=['claimed_at'], name='email_sending_claimed_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0006_emailmessage_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='gaps',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-17 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0007_rollupwatermark_gaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityrollup',
+            name='max_response_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='weatherrollup',
+            name='max_response_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
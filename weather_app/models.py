@@ -33,7 +33,9 @@ class WeatherRequest(models.Model):
         choices=[
             ('default', 'Default Cupertino'),
             ('random', 'Random Cities'),
-            ('search', 'User Search')  # For future features
+            ('search', 'User Search'),  # For future features
+            ('bulk', 'Bulk Ingestion'),
+            ('warming', 'Cache Warming')
         ],
         default='default'
     )
@@ -111,9 +113,28 @@ class EmailMessage(models.Model):
     temperature = models.FloatField()
     location = models.CharField(max_length=100)
     email_message_id = models.CharField(max_length=100, null=True, blank=True)
-    delivery_status = models.CharField(max_length=20)  # 'queued', 'sent', 'delivered', 'failed'
+    delivery_status = models.CharField(max_length=20)  # 'queued', 'sending', 'sent', 'delivered', 'failed'
     priority = models.CharField(max_length=10, default='normal')
     retry_count = models.IntegerField(default=0)
+    subject = models.CharField(max_length=200, blank=True)
+    body = models.TextField(blank=True)  # rendered by format_messages, so send tasks only need the id
+    claimed_at = models.DateTimeField(null=True, blank=True)  # set when send_message_batch claims the row
+
+    class Meta:
+        indexes = [
+            # dashboard: today's counts per status, recent messages
+            models.Index(fields=['timestamp', 'delivery_status'], name='email_timestamp_status_idx'),
+            # dead letter list/count: failed and out of retries, newest first
+            models.Index(
+                fields=['-timestamp'],
+                condition=models.Q(delivery_status='failed', retry_count__gte=3),
+                name='email_dead_letter_idx'
+            ),
+            # send_message_batch drains queued messages oldest first
+            models.Index(fields=['id'], condition=models.Q(delivery_status='queued'), name='email_queued_idx'),
+            # release_stale_sends: claims older than EMAIL_SEND_CLAIM_TIMEOUT
+            models.Index(fields=['claimed_at'], condition=models.Q(delivery_status='sending'), name='email_sending_claimed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.message_type} - {self.timestamp}"
@@ -128,11 +149,19 @@ class CeleryWeatherRequest(models.Model):
     location = models.CharField(max_length=100)
     message_type = models.CharField(max_length=50)
     priority = models.CharField(max_length=10, default='normal')
-    status = models.CharField(max_length=20, default='pending')
+    status = models.CharField(max_length=20, default='pending')  # 'pending', 'processing', 'completed'
     created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # set when collect_weather_requests claims the row
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+            # collect_weather_requests claims pending rows in id order every 60 seconds
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='celery_req_pending_idx'),
+            # stale claim release
+            models.Index(fields=['claimed_at'], condition=models.Q(status='processing'), name='celery_req_claimed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.location} - {self.status}"
@@ -156,3 +185,68 @@ class DeadLetterMessage(models.Model):
     def __str__(self):
         return f"Failed message to {self.phone_number} at {self.failed_at}"
 
+
+
+# ROLLUPS (maintained by weather_app.rollups from the raw log tables)
+class Rollup(models.Model):
+    """
+    Counts and latency for one time bucket, merged incrementally
+    latency_histogram holds counts per rollups.LATENCY_BUCKETS bucket (plus
+    one overflow bucket), so percentiles can be estimated after merging;
+    max_response_time bounds the overflow bucket.
+    """
+    period = models.CharField(max_length=4, choices=[('hour', 'Hourly'), ('day', 'Daily')])
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    timed_count = models.IntegerField(default=0)  # rows that had a response time
+    total_response_time = models.FloatField(default=0)
+    latency_histogram = models.JSONField(default=list)
+    max_response_time = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def avg_response_time(self):
+        return self.total_response_time / self.timed_count if self.timed_count else None
+
+
+class WeatherRollup(Rollup):
+    """WeatherRequest counts per city per hour/day"""
+    city = models.CharField(max_length=100)
+    country = models.CharField(max_length=100)
+    request_types = models.JSONField(default=dict)  # request_type -> count
+
+    class Meta:
+        ordering = ['-bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket_start', 'city'], name='weather_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.city} {self.period} {self.bucket_start}: {self.count}"
+
+
+class ActivityRollup(Rollup):
+    """UserActivity counts per action per hour/day"""
+    action = models.CharField(max_length=50)
+
+    class Meta:
+        ordering = ['-bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket_start', 'action'], name='activity_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.period} {self.bucket_start}: {self.count}"
+
+
+class RollupWatermark(models.Model):
+    """Highest source row id already merged into a rollup"""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    gaps = models.JSONField(default=list)  # [first id, last id, unix time first seen]: ids below last_id not committed yet
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
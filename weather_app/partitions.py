@@ -0,0 +1,142 @@
+# weather_app/partitions.py
+# Monthly range partitions for the append-only log tables (PostgreSQL only)
+#
+# Migration 0002 turns these tables into partitioned tables. Partitions are
+# named <table>_pYYYYMM and cover one UTC month; <table>_default catches
+# anything outside them. Retention detaches/drops whole partitions instead
+# of deleting rows, with a chunked DELETE for everything else.
+
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# table -> partition key column
+PARTITIONED_TABLES = {
+    'weather_app_weatherrequest': 'requested_at',
+    'weather_app_useractivity': 'timestamp',
+    'weather_app_emailmessage': 'timestamp',
+}
+
+
+def month_start(value):
+    """First instant of value's month (UTC)"""
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(start, months):
+    """month_start() shifted by a number of months"""
+    month = start.month - 1 + months
+    return start.replace(year=start.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y%m}"
+
+
+def create_month_partition(cursor, table, start):
+    """Create the partition for the month starting at start if it doesn't exist"""
+    name = partition_name(table, start)
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+    )
+    return name
+
+
+def is_partitioned(table, using='default'):
+    """True if table is a partitioned table in this database"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = %s",
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def list_month_partitions(table, using='default'):
+    """[(partition name, month start)] of a table's monthly partitions, oldest first"""
+    prefix = f"{table}_p"
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        suffix = name[len(prefix):] if name.startswith(prefix) else ''
+        if len(suffix) == 6 and suffix.isdigit():
+            start = datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)
+            partitions.append((name, start))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(months_ahead, using='default'):
+    """Create this month's and the next months_ahead months' partitions for every partitioned table"""
+    created = []
+    this_month = month_start(timezone.now())
+    with connections[using].cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table, using):
+                continue
+            for months in range(months_ahead + 1):
+                created.append(create_month_partition(cursor, table, add_months(this_month, months)))
+    return created
+
+
+def drop_partitions_before(table, cutoff, detach_only=False, using='default'):
+    """
+    Remove the monthly partitions that end on or before cutoff
+    With detach_only the partitions are kept as standalone tables (for archiving)
+    Returns the names of the partitions removed.
+    Each DETACH + DROP is one transaction, so a failed DROP leaves the partition
+    attached (and its rows visible) instead of detached and forgotten.
+    """
+    removed = []
+    for name, start in list_month_partitions(table, using):
+        if add_months(start, 1) > cutoff:
+            break
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            if not detach_only:
+                cursor.execute(f'DROP TABLE "{name}"')
+        removed.append(name)
+        logger.info(f"{'Detached' if detach_only else 'Dropped'} partition {name}")
+    return removed
+
+
+def delete_in_chunks(table, column, cutoff, chunk_size=5000, progress=None, using='default'):
+    """
+    Delete rows with column < cutoff, chunk_size rows per transaction
+    Plain SQL, so no primary keys are loaded into Python and no signals are sent.
+    progress(deleted_so_far) is called after each chunk. Returns the total deleted.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = (
+        f"DELETE FROM {qn(table)} WHERE id IN "
+        f"(SELECT id FROM {qn(table)} WHERE {qn(column)} < %s LIMIT %s)"
+    )
+
+    total = 0
+    while True:
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [cutoff, chunk_size])
+                deleted = cursor.rowcount
+        total += deleted
+        if progress:
+            progress(total)
+        if deleted < chunk_size:
+            return total
@@ -0,0 +1,193 @@
+# weather_app/redis_clients.py
+# One registry for the app's own Redis connections
+#
+# Each purpose gets a logical client on its own connection pool, so a burst
+# in one (say, rate limiting) can't starve another of connections, and every
+# socket timeout / pool size is tuned in one place (REDIS_* settings, with
+# per-purpose overrides in REDIS_CLIENTS). Pools are per process: after a
+# fork (Celery prefork, gunicorn) the child drops the parent's connections
+# and builds its own. The Django cache keeps its own django_redis pool.
+#
+#   cache     - cache stats, refill locks, dashboard snapshot, circuit breaker
+#   ratelimit - IP and email rate limit counters
+#   counters  - popular city counters
+#   celery    - small state kept by the Celery tasks (last_temp:*)
+#   pubsub    - the L1 cache invalidation listener (no read timeout)
+#
+# It also has the SCAN/UNLINK helpers used to count and bulk-delete keys.
+
+import asyncio
+import os
+import threading
+import weakref
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+PURPOSES = ('cache', 'ratelimit', 'counters', 'celery', 'pubsub')
+
+# Per-purpose defaults, applied before the REDIS_CLIENTS overrides
+PURPOSE_DEFAULTS = {
+    'pubsub': {'socket_timeout': None},
+}
+
+
+def client_options(purpose):
+    """Connection pool keyword arguments for a purpose"""
+    if purpose not in PURPOSES:
+        raise ValueError(f"Unknown Redis client purpose: {purpose}")
+    options = {
+        'host': settings.REDIS_HOST or 'localhost',
+        'port': int(settings.REDIS_PORT or 6379),
+        'db': int(settings.REDIS_DB or 0),
+        'decode_responses': True,
+        'max_connections': settings.REDIS_MAX_CONNECTIONS,
+        'timeout': settings.REDIS_POOL_TIMEOUT,
+        'socket_timeout': settings.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        'health_check_interval': settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+    options.update(PURPOSE_DEFAULTS.get(purpose, {}))
+    options.update(settings.REDIS_CLIENTS.get(purpose, {}))
+    return options
+
+
+class RedisRegistry:
+    """Lazily built, per-process Redis clients, one pool per purpose"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+        #async pools are bound to the event loop that uses them, so keep them per loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self.after_fork()
+
+    def get(self, purpose):
+        """The sync client for a purpose"""
+        self._check_fork()
+        client = self._clients.get(purpose)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(purpose)
+                if client is None:
+                    pool = redis.BlockingConnectionPool(**client_options(purpose))
+                    client = redis.Redis(connection_pool=pool)
+                    self._clients[purpose] = client
+        return client
+
+    def get_async(self, purpose):
+        """The asyncio client for a purpose on the running event loop"""
+        self._check_fork()
+        loop = asyncio.get_running_loop()
+        clients = self._async_clients.setdefault(loop, {})
+        client = clients.get(purpose)
+        if client is None:
+            pool = aioredis.BlockingConnectionPool(**client_options(purpose))
+            client = clients[purpose] = aioredis.Redis(connection_pool=pool)
+        return client
+
+    def after_fork(self):
+        """
+        Drop the connections inherited from the parent process
+        The client objects stay valid (modules keep references to them), only
+        their pools are emptied so the child opens its own connections.
+        """
+        self._lock = threading.Lock()  #the parent may have held it while forking
+        for client in list(self._clients.values()):
+            client.connection_pool.reset()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._pid = os.getpid()
+
+    def pool_stats(self):
+        """
+        {purpose: connection counts} for the sync pools of this process
+        redis-py has no public API for pool usage, so in_use and idle come from
+        BlockingConnectionPool internals and are None if a release moves them.
+        """
+        stats = {}
+        for purpose, client in list(self._clients.items()):
+            pool = client.connection_pool
+            connections = getattr(pool, '_connections', None)
+            queue = getattr(getattr(pool, 'pool', None), 'queue', None)
+            if connections is None or queue is None:
+                in_use = idle = None
+            else:
+                idle = sum(1 for connection in list(queue) if connection is not None)
+                in_use = len(connections) - idle
+            stats[purpose] = {
+                'in_use': in_use,
+                'idle': idle,
+                'max': getattr(pool, 'max_connections', None),
+            }
+        return stats
+
+
+registry = RedisRegistry()
+
+# Drop the parent's connections in forked children straight away rather than on first use
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.after_fork)
+
+
+def get_redis(purpose):
+    """Pooled sync Redis client for a purpose (see PURPOSES)"""
+    return registry.get(purpose)
+
+
+def get_async_redis(purpose):
+    """Pooled asyncio Redis client for a purpose, for the running event loop"""
+    return registry.get_async(purpose)
+
+
+# KEY SCANNING
+# Never KEYS: it walks the whole keyspace in one command and blocks every
+# other client meanwhile. SCAN walks it a COUNT-sized slice per call.
+
+def scan_keys(client, pattern, count=None):
+    """Iterate the keys matching pattern with SCAN (count is the per-call COUNT hint)"""
+    return client.scan_iter(match=pattern, count=count or settings.REDIS_SCAN_COUNT)
+
+
+def count_keys(client, pattern, count=None):
+    """Number of keys matching pattern, without blocking the server"""
+    return sum(1 for _ in scan_keys(client, pattern, count))
+
+
+def unlink_keys(client, keys, batch_size=None, progress=None):
+    """
+    UNLINK keys batch_size at a time (memory is reclaimed in the background)
+    Batches go out in one non-transactional pipeline per batch_size keys, split
+    into UNLINK calls of at most 100 keys so no single command is long.
+    progress(unlinked so far) is called after each batch. Returns the number unlinked.
+    """
+    batch_size = batch_size or settings.REDIS_UNLINK_BATCH_SIZE
+    total = 0
+    batch = []
+
+    def flush():
+        pipe = client.pipeline(transaction=False)
+        for i in range(0, len(batch), 100):
+            pipe.unlink(*batch[i:i + 100])
+        return sum(pipe.execute())
+
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            total += flush()
+            batch = []
+            if progress:
+                progress(total)
+    if batch:
+        total += flush()
+        if progress:
+            progress(total)
+    return total
+
+
+def unlink_matching(client, pattern, batch_size=None, progress=None, count=None):
+    """SCAN for keys matching pattern and UNLINK them in batches, returns the number unlinked"""
+    return unlink_keys(client, scan_keys(client, pattern, count), batch_size, progress)
@@ -0,0 +1,282 @@
+# weather_app/rollups.py
+# Incremental hourly/daily rollups of WeatherRequest and UserActivity
+#
+# update_rollups() reads only rows past each table's watermark (by id), and
+# analytics read a few thousand rollup rows instead of scanning the raw log
+# tables.
+#
+# Ids are handed out at INSERT time, not commit time: with several processes
+# flushing write buffers, a higher id range can commit before a lower one.
+# Ids the watermark moves past without seeing are kept as gaps and re-checked
+# on every run until their rows show up, or ROLLUP_GAP_TIMEOUT passes (the
+# insert was rolled back), so late rows are still counted exactly once.
+
+import logging
+import time
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import WeatherRequest, UserActivity, WeatherRollup, ActivityRollup, RollupWatermark
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, plus one overflow bucket
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0]
+
+PERIODS = ('hour', 'day')
+
+
+def bucket_start(value, period):
+    """Start of the UTC hour or day containing value"""
+    value = value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if period == 'day' else value
+
+
+def latency_bucket(response_time):
+    for i, upper in enumerate(LATENCY_BUCKETS):
+        if response_time <= upper:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def merge_histograms(into, other):
+    """Add other's bucket counts to into (either may be shorter/empty)"""
+    if len(into) < len(other):
+        into.extend([0] * (len(other) - len(into)))
+    for i, count in enumerate(other):
+        into[i] += count
+    return into
+
+
+def merge_max(a, b):
+    """Larger of two optional values"""
+    return b if a is None else a if b is None else max(a, b)
+
+
+def percentile(histogram, fraction, max_value=None):
+    """
+    Estimate a percentile (fraction 0-1) as the upper bound of the bucket it falls in
+    The overflow bucket has no fixed bound, it's reported as max_value (the
+    slowest recorded), or None when that isn't known.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    cumulative = 0
+    for i, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= rank:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else max_value
+    return max_value
+
+
+# UPDATING
+
+def _new_delta(**extra):
+    return {
+        'count': 0, 'timed_count': 0, 'total_response_time': 0.0, 'max_response_time': None,
+        'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1), **extra
+    }
+
+
+def _add_row(delta, response_time):
+    delta['count'] += 1
+    if response_time is not None:
+        delta['timed_count'] += 1
+        delta['total_response_time'] += response_time
+        delta['max_response_time'] = merge_max(delta['max_response_time'], response_time)
+        delta['latency_histogram'][latency_bucket(response_time)] += 1
+
+
+def _merge(rollup_model, key_field, deltas, set_fields=(), counter_fields=()):
+    """
+    Add {(period, bucket_start, key): delta} into rollup rows, creating the missing ones
+    set_fields are overwritten from the delta, counter_fields are {name: count} dicts added together
+    """
+    existing = {
+        (rollup.period, rollup.bucket_start, getattr(rollup, key_field)): rollup
+        for rollup in rollup_model.objects.select_for_update().filter(
+            bucket_start__in={bucket for _, bucket, _ in deltas},
+            **{f'{key_field}__in': {key for _, _, key in deltas}}
+        )
+    }
+
+    to_create, to_update = [], []
+    for (period, bucket, key), delta in deltas.items():
+        rollup = existing.get((period, bucket, key))
+        if rollup is None:
+            rollup = rollup_model(period=period, bucket_start=bucket, **{key_field: key})
+            to_create.append(rollup)
+        else:
+            to_update.append(rollup)
+        rollup.count += delta['count']
+        rollup.timed_count += delta['timed_count']
+        rollup.total_response_time += delta['total_response_time']
+        rollup.max_response_time = merge_max(rollup.max_response_time, delta['max_response_time'])
+        rollup.latency_histogram = merge_histograms(list(rollup.latency_histogram), delta['latency_histogram'])
+        for field in set_fields:
+            setattr(rollup, field, delta[field])
+        for field in counter_fields:
+            counts = dict(getattr(rollup, field) or {})
+            for name, count in delta[field].items():
+                counts[name] = counts.get(name, 0) + count
+            setattr(rollup, field, counts)
+
+    rollup_model.objects.bulk_update(
+        to_update,
+        ['count', 'timed_count', 'total_response_time', 'max_response_time', 'latency_histogram',
+         *set_fields, *counter_fields],
+        batch_size=500
+    )
+    rollup_model.objects.bulk_create(to_create, batch_size=500)
+
+
+def _apply_weather_rows(rows):
+    deltas = {}
+    for _, city, country, requested_at, response_time, request_type in rows:
+        for period in PERIODS:
+            delta = deltas.setdefault(
+                (period, bucket_start(requested_at, period), city),
+                _new_delta(country=country, request_types={})
+            )
+            _add_row(delta, response_time)
+            delta['country'] = country
+            delta['request_types'][request_type] = delta['request_types'].get(request_type, 0) + 1
+    _merge(WeatherRollup, 'city', deltas, set_fields=('country',), counter_fields=('request_types',))
+
+
+def _apply_activity_rows(rows):
+    deltas = {}
+    for _, action, timestamp, response_time in rows:
+        for period in PERIODS:
+            delta = deltas.setdefault((period, bucket_start(timestamp, period), action), _new_delta())
+            _add_row(delta, response_time)
+    _merge(ActivityRollup, 'action', deltas)
+
+
+def _remaining_gaps(gaps, ids):
+    """Split the [first, last, seen] gaps around the ids that showed up"""
+    remaining = []
+    for first, last, seen in gaps:
+        for found in (i for i in ids if first <= i <= last):
+            if found > first:
+                remaining.append([first, found - 1, seen])
+            first = found + 1
+        if first <= last:
+            remaining.append([first, last, seen])
+    return remaining
+
+
+def _new_gaps(last_id, ids, seen):
+    """Gaps between the old watermark and the (sorted) new ids past it"""
+    gaps = []
+    for found in ids:
+        if found > last_id + 1:
+            gaps.append([last_id + 1, found - 1, seen])
+        last_id = found
+    return gaps
+
+
+def _process_new_rows(name, model, fields, apply_rows, batch_size):
+    """
+    Feed rows with id past the watermark or in one of its gaps to apply_rows, batch_size at a time
+    Each batch and its watermark move are one transaction, so a batch is
+    counted exactly once even if the task dies halfway.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=name)
+            now = time.time()
+            gaps = [gap for gap in watermark.gaps if now - gap[2] < settings.ROLLUP_GAP_TIMEOUT]
+            if len(gaps) < len(watermark.gaps):
+                logger.warning(f"{name} rollup gave up on {len(watermark.gaps) - len(gaps)} id gaps")
+
+            unseen = Q(id__gt=watermark.last_id)
+            for first, last, _ in gaps:
+                unseen |= Q(id__range=(first, last))
+            rows = list(model.objects.filter(unseen).order_by('id').values_list('id', *fields)[:batch_size])
+            if rows:
+                apply_rows(rows)
+            ids = [row[0] for row in rows]
+            new_ids = [i for i in ids if i > watermark.last_id]
+            gaps = _remaining_gaps(gaps, ids) + _new_gaps(watermark.last_id, new_ids, now)
+            if new_ids or gaps != watermark.gaps:
+                watermark.last_id = new_ids[-1] if new_ids else watermark.last_id
+                watermark.gaps = gaps
+                watermark.save(update_fields=['last_id', 'gaps', 'updated_at'])
+        processed += len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def update_rollups(batch_size=None):
+    """Merge new WeatherRequest and UserActivity rows into the rollups, returns rows processed per table"""
+    batch_size = batch_size or settings.ROLLUP_BATCH_SIZE
+    result = {
+        'weather_requests': _process_new_rows(
+            'weather_request', WeatherRequest,
+            ('city', 'country', 'requested_at', 'api_response_time', 'request_type'),
+            _apply_weather_rows, batch_size
+        ),
+        'user_activity': _process_new_rows(
+            'user_activity', UserActivity,
+            ('action', 'timestamp', 'response_time'),
+            _apply_activity_rows, batch_size
+        ),
+    }
+    logger.info(f"Updated rollups: {result}")
+    return result
+
+
+# READING
+
+def _since_filter(period, hours):
+    if hours is None:
+        return {'period': period}
+    since = bucket_start(timezone.now() - timedelta(hours=hours), period)
+    return {'period': period, 'bucket_start__gte': since}
+
+
+def weather_summary(hours=None, top=10):
+    """
+    Request totals, latency and mix from the rollups
+    hours=None covers everything (from the daily rollups), otherwise the last
+    N hours (from the hourly rollups, so up to an hour more than asked for).
+    """
+    period = 'day' if hours is None else 'hour'
+    totals = {'requests': 0, 'timed': 0, 'total_response_time': 0.0, 'max_response_time': None}
+    histogram, request_types, cities = [], {}, {}
+
+    for rollup in WeatherRollup.objects.filter(**_since_filter(period, hours)).iterator():
+        totals['requests'] += rollup.count
+        totals['timed'] += rollup.timed_count
+        totals['total_response_time'] += rollup.total_response_time
+        totals['max_response_time'] = merge_max(totals['max_response_time'], rollup.max_response_time)
+        merge_histograms(histogram, rollup.latency_histogram)
+        for request_type, count in (rollup.request_types or {}).items():
+            request_types[request_type] = request_types.get(request_type, 0) + count
+        city = cities.setdefault(rollup.city, {'city': rollup.city, 'country': rollup.country, 'requests': 0})
+        city['requests'] += rollup.count
+
+    return {
+        'requests': totals['requests'],
+        'avg_response_time': totals['total_response_time'] / totals['timed'] if totals['timed'] else None,
+        'p50_response_time': percentile(histogram, 0.50, totals['max_response_time']),
+        'p95_response_time': percentile(histogram, 0.95, totals['max_response_time']),
+        'max_response_time': totals['max_response_time'],
+        'request_types': request_types,
+        'top_cities': sorted(cities.values(), key=lambda city: -city['requests'])[:top],
+    }
+
+
+def activity_summary(hours=None):
+    """{action: count} from the rollups, same hours semantics as weather_summary"""
+    period = 'day' if hours is None else 'hour'
+    counts = {}
+    for action, count in ActivityRollup.objects.filter(**_since_filter(period, hours)).values_list('action', 'count'):
+        counts[action] = counts.get(action, 0) + count
+    return counts
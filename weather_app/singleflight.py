@@ -0,0 +1,138 @@
+# weather_app/singleflight.py
+# Request coalescing so concurrent cache misses for a city make one upstream call
+
+import asyncio
+import threading
+import uuid
+import weakref
+import logging
+from concurrent.futures import Future
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Only delete the lock if we still own it (it may have expired and been taken by someone else)
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    In-process coalescing: one future per key
+    The first caller runs the function, everyone who arrives while it is
+    running waits on the same future and gets the same result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers of key
+        Returns (result, shared) - shared is False only for the caller that ran fn
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight, calls are kept per event loop
+    coro_fn runs as its own task that every caller (the first one included)
+    only awaits, so a caller that is cancelled (its request's deadline, a
+    client disconnect) stops waiting without cancelling the call for the others.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, coro_fn):
+        """Await coro_fn() once for all concurrent callers of key, returns (result, shared)"""
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+
+        task = calls.get(key)
+        shared = task is not None
+        if not shared:
+            task = loop.create_task(coro_fn())
+            calls[key] = task
+            task.add_done_callback(lambda done: self._finished(calls, key, done))
+        return await asyncio.shield(task), shared
+
+    @staticmethod
+    def _finished(calls, key, task):
+        if calls.get(key) is task:
+            del calls[key]
+        #everyone may have stopped waiting, don't let asyncio complain about it
+        if not task.cancelled():
+            task.exception()
+
+
+def acquire_fill_lock(redis_client, key, ttl):
+    """
+    Try to become the one process allowed to refill key
+    Returns a token to release with, or None if another process holds the lock.
+    If Redis is unreachable every caller is allowed through.
+    """
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(f"lock:{key}", token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+    except redis.RedisError:
+        return token
+
+
+def release_fill_lock(redis_client, key, token):
+    """Release a lock taken with acquire_fill_lock"""
+    try:
+        redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{key}", token)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release fill lock for {key}: {e}")
+
+
+async def aacquire_fill_lock(redis_client, key, ttl):
+    """Async acquire_fill_lock"""
+    token = uuid.uuid4().hex
+    try:
+        if await redis_client.set(f"lock:{key}", token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+    except redis.RedisError:
+        return token
+
+
+async def arelease_fill_lock(redis_client, key, token):
+    """Async release_fill_lock"""
+    try:
+        await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{key}", token)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release fill lock for {key}: {e}")
+
+
+# Shared per-process instances used by WeatherService
+weather_flight = SingleFlight()
+async_weather_flight = AsyncSingleFlight()
@@ -1,40 +1,88 @@
 # weather_app/tasks.py
+from datetime import timedelta
+from functools import partial
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
-import redis
 from .models import EmailMessage, WeatherRequest, DeadLetterMessage, CeleryWeatherRequest
 from .email_client import email_api
-from .views import WeatherService
+from .views import WeatherService, store_dashboard_snapshot, store_celery_inspection
 from .utils import check_email_rate_limit
+from .city_counters import flush_counts_to_database
+from .partitions import ensure_partitions
+from .rollups import update_rollups
+from .cache_warming import plan_warming
+from .redis_clients import get_redis
 import logging
 
-# Connect to Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0)
+# Small state kept between task runs (last_temp:*)
+redis_client = get_redis('celery')
 
 logger = logging.getLogger(__name__)
 
-def get_weather_from_api(location):
-    """Get weather data using existing WeatherService"""
-    weather_service = WeatherService()
-    return weather_service.get_weather(location)
+# Same limit as send_message's max_retries, after that messages go to the dead letter queue
+MAX_SEND_RETRIES = 3
 
 def log_message_sent(user_id, message, priority, status):
     """Log message sending to database"""
     print(f"Message sent - User: {user_id}, Priority: {priority}, Status: {status}")
 
+def chunked(items, size):
+    """Split a list into lists of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def claim_pending_requests(chunk_size):
+    """
+    Claim up to chunk_size pending requests, returns {location: [request ids]}
+    SKIP LOCKED lets several collectors run at once without claiming the same rows
+    """
+    with transaction.atomic():
+        claimed = list(
+            CeleryWeatherRequest.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('id')
+            .values_list('id', 'location')[:chunk_size]
+        )
+        if claimed:
+            CeleryWeatherRequest.objects.filter(id__in=[request_id for request_id, _ in claimed]).update(
+                status='processing', claimed_at=timezone.now()
+            )
+
+    by_location = {}
+    for request_id, location in claimed:
+        by_location.setdefault(location, []).append(request_id)
+    return by_location
+
+def release_stale_claims():
+    """Put requests back to pending if the worker that claimed them never finished"""
+    cutoff = timezone.now() - timedelta(seconds=settings.DIGEST_CLAIM_TIMEOUT)
+    return CeleryWeatherRequest.objects.filter(status='processing', claimed_at__lt=cutoff).update(
+        status='pending', claimed_at=None
+    )
+
 # DIGEST TASKS
 @shared_task
 def collect_weather_requests():
     """Runs every 60 seconds to batch requests"""
-    pending_requests = CeleryWeatherRequest.objects.filter(status='pending')
-    
-    if pending_requests.exists():
-        locations = pending_requests.values_list('location', flat=True).distinct()
-        
-        for location in locations:
-            location_requests = list(pending_requests.filter(location=location).values())
-            convert_temperature.delay(location, location_requests)
+    released = release_stale_claims()
+    if released:
+        logger.warning(f"Released {released} stale weather request claims")
+
+    claimed_total = 0
+    for _ in range(settings.DIGEST_MAX_CHUNKS):
+        by_location = claim_pending_requests(settings.DIGEST_CHUNK_SIZE)
+        if by_location:
+            #one conversion task per chunk, so its locations share bulk upstream calls
+            convert_temperatures.delay(by_location)
+
+        claimed = sum(len(request_ids) for request_ids in by_location.values())
+        claimed_total += claimed
+        if claimed < settings.DIGEST_CHUNK_SIZE:
+            break
+
+    return claimed_total
 
 @shared_task
 def trigger_scheduled_weather():
@@ -49,59 +97,133 @@ def trigger_scheduled_weather():
         )
 
 # CONVERSION TASKS  
+def update_last_temps(temperatures):
+    """
+    Store {location: temperature} in the last_temp:* keys in two round trips
+    Returns {location: change since the previous reading (0 for a first reading)}
+    """
+    locations = list(temperatures)
+    keys = [f"last_temp:{location}" for location in locations]
+    previous = redis_client.mget(keys) if keys else []
+
+    pipe = redis_client.pipeline(transaction=False)
+    for key, location in zip(keys, locations):
+        pipe.set(key, temperatures[location])
+    pipe.execute()
+
+    return {
+        location: abs(temperatures[location] - float(last_temp)) if last_temp else 0
+        for location, last_temp in zip(locations, previous)
+    }
+
 @shared_task
-def convert_temperature(location, user_requests):
-    """Convert Fahrenheit to Celsius + detect changes"""
-    weather_data = get_weather_from_api(location)
-    
-    if 'error' in weather_data:
-        return
-    
-    temp_c = weather_data.get('temperature', 0)
-    
-    # Check for temperature changes
-    last_temp_key = f"last_temp:{location}"
-    last_temp = redis_client.get(last_temp_key)
-    temp_change = abs(temp_c - float(last_temp)) if last_temp else 0
-    
-    # Determine priority
-    priority = 'high' if temp_change >= 5 else 'normal'
-    
-    # Update last temperature
-    redis_client.set(last_temp_key, temp_c)
-    
-    # Send to formatting queue
-    for request in user_requests:
-        format_message.delay(
-            request['user_id'],
-            location,
-            temp_c,
-            temp_change,
-            priority
+def convert_temperatures(by_location):
+    """
+    Fetch every location of a digest chunk with bulk WeatherAPI calls + detect changes
+    by_location is {location: [request ids]}, returns the number of locations converted
+    """
+    weather = WeatherService().ingest_weather_bulk(list(by_location))
+
+    failed = [location for location in by_location if 'error' in weather[location]]
+    if failed:
+        #let the next digest run pick them up again
+        CeleryWeatherRequest.objects.filter(
+            id__in=[request_id for location in failed for request_id in by_location[location]]
+        ).update(status='pending', claimed_at=None)
+
+    temperatures = {
+        location: weather[location].get('temperature', 0)
+        for location in by_location if location not in failed
+    }
+    changes = update_last_temps(temperatures)
+
+    for location, temp_c in temperatures.items():
+        # Determine priority
+        priority = 'high' if changes[location] >= 5 else 'normal'
+        # Send to formatting queue, one task per batch of users
+        for batch in chunked(by_location[location], settings.DIGEST_USER_BATCH_SIZE):
+            format_messages.delay(batch, location, temp_c, changes[location], priority)
+
+    return len(temperatures)
+
+def claim_requests(request_ids):
+    """Claim the given requests that are still pending, returns their ids"""
+    with transaction.atomic():
+        claimed = list(
+            CeleryWeatherRequest.objects.select_for_update(skip_locked=True)
+            .filter(id__in=request_ids, status='pending')
+            .values_list('id', flat=True)
         )
+        CeleryWeatherRequest.objects.filter(id__in=claimed).update(status='processing', claimed_at=timezone.now())
+    return claimed
+
+@shared_task
+def convert_temperature(location, request_ids):
+    """
+    Convert Fahrenheit to Celsius + detect changes for a single location
+    Still accepts the request dicts queued before requests were claimed
+    (remove after one release): those are claimed here unless a digest run already has them.
+    """
+    if request_ids and isinstance(request_ids[0], dict):
+        request_ids = claim_requests([request['id'] for request in request_ids])
+        if not request_ids:
+            return 0
+    return convert_temperatures({location: request_ids})
+
+def default_subject(message_type):
+    """Subject for messages queued before subjects were stored"""
+    return "🚨 Temperature Alert" if message_type == 'temp_alert' else "🌤️ Weather Update"
 
 # FORMATTING TASKS
+def queue_messages(user_ids, location, temp_c, temp_change, priority, request_ids=()):
+    """Render one message per user into queued EmailMessage rows, complete request_ids and send them in a batch"""
+    if temp_change >= 5:
+        message = f"🚨 Temperature alert for {location}!\nChanged by {temp_change:.1f}°C\nCurrent: {temp_c:.1f}°C"
+        message_type, subject = 'temp_alert', "🚨 URGENT: Temperature Alert"
+    else:
+        message = f"🌤️ Weather update for {location}: {temp_c:.1f}°C"
+        message_type, subject = 'weather_update', "🌤️ Weather Update"
+
+    with transaction.atomic():
+        messages = EmailMessage.objects.bulk_create([
+            EmailMessage(
+                user_id=user_id,
+                message_type=message_type,
+                temperature=temp_c,
+                location=location,
+                delivery_status='queued',
+                priority=priority,
+                subject=subject,
+                body=message
+            )
+            for user_id in user_ids
+        ])
+        if request_ids:
+            CeleryWeatherRequest.objects.filter(id__in=request_ids).update(status='completed')
+
+    message_ids = [msg.id for msg in messages]
+    if not message_ids:
+        return
+
+    # Route to appropriate sending queue
+    if priority == 'high':
+        send_message_batch.apply_async(args=[message_ids], queue='priority_sending')
+    else:
+        send_message_batch.apply_async(args=[message_ids], countdown=5)
+
+@shared_task
+def format_messages(request_ids, location, temp_c, temp_change, priority):
+    """Format messages for a batch of requests and queue them for sending"""
+    user_ids = CeleryWeatherRequest.objects.filter(id__in=request_ids).values_list('user_id', flat=True)
+    queue_messages(list(user_ids), location, temp_c, temp_change, priority, request_ids)
+
 @shared_task
 def format_message(user_id, location, temp_c, temp_change, priority):
-    """Format message based on context"""
-    try:
-        user = User.objects.get(id=user_id)
-        
-        if temp_change >= 5:
-            message = f"🚨 Temperature alert for {location}!\nChanged by {temp_change:.1f}°C\nCurrent: {temp_c:.1f}°C"
-        else:
-            message = f"🌤️ Weather update for {location}: {temp_c:.1f}°C"
-        
-        # Route to appropriate sending queue
-        if priority == 'high':
-            send_priority_message.delay(user.email, message, user_id, location, temp_c, 'temp_alert')
-        else:
-            send_message.apply_async(
-                args=[user.email, message, user_id, location, temp_c, 'weather_update'],
-                countdown=5
-            )
-    except User.DoesNotExist:
-        print(f"User {user_id} not found")
+    """Single-user format_messages for tasks queued before batching (remove after one release)"""
+    if not User.objects.filter(id=user_id).exists():
+        logger.warning(f"User {user_id} not found")
+        return
+    queue_messages([user_id], location, temp_c, temp_change, priority)
 
 # SENDING TASKS
 @shared_task(bind=True, max_retries=3)
@@ -124,7 +246,7 @@ def send_message(self, email_address, message, user_id, location, temperature, m
             self.retry(countdown=30)
         
         # Send message
-        subject = "🚨 Temperature Alert" if message_type == 'temp_alert' else "🌤️ Weather Update"
+        subject = default_subject(message_type)
         logger.info(f"Sending email to {email_address} with subject: {subject}")
         
         try:
@@ -154,6 +276,83 @@ def send_message(self, email_address, message, user_id, location, temperature, m
             return
         self.retry(countdown=60 * (self.request.retries + 1), exc=exc)
 
+def claim_queued_messages(message_ids=None):
+    """
+    Claim up to EMAIL_BATCH_SIZE queued messages (oldest first) by moving them to 'sending'
+    The row locks only last for this short transaction, SKIP LOCKED lets
+    concurrent drains claim different rows.
+    """
+    with transaction.atomic():
+        queued = EmailMessage.objects.select_for_update(skip_locked=True).filter(delivery_status='queued')
+        if message_ids is not None:
+            queued = queued.filter(id__in=message_ids)
+        claimed = list(queued.order_by('id').values_list('id', flat=True)[:settings.EMAIL_BATCH_SIZE])
+        if claimed:
+            EmailMessage.objects.filter(id__in=claimed).update(delivery_status='sending', claimed_at=timezone.now())
+
+    return list(EmailMessage.objects.filter(id__in=claimed).select_related('user').order_by('id'))
+
+def release_stale_sends():
+    """Put messages back to queued if the worker that claimed them never recorded the outcome"""
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_SEND_CLAIM_TIMEOUT)
+    return EmailMessage.objects.filter(delivery_status='sending', claimed_at__lt=cutoff).update(
+        delivery_status='queued', claimed_at=None
+    )
+
+@shared_task
+def send_message_batch(message_ids=None):
+    """
+    Send queued EmailMessage rows over one SMTP connection
+    With message_ids sends those, otherwise drains up to EMAIL_BATCH_SIZE of the
+    oldest queued messages. Messages are claimed ('sending') before the SMTP
+    round-trip, which runs outside any transaction, so a timeout partway
+    through a batch can't roll back messages that already went out.
+    """
+    released = release_stale_sends()
+    if released:
+        logger.warning(f"Released {released} stale email send claims")
+
+    messages = claim_queued_messages(message_ids)
+
+    to_send, deferred = [], 0
+    for msg in messages:
+        msg.claimed_at = None
+        if check_email_rate_limit(msg.user.email):
+            to_send.append(msg)
+        else:
+            #back to queued for the next drain
+            logger.warning(f"Rate limit exceeded for {msg.user.email}, deferring")
+            msg.delivery_status = 'queued'
+            deferred += 1
+
+    results = email_api.send_batch([
+        (msg.user.email, msg.body, msg.subject or default_subject(msg.message_type))
+        for msg in to_send
+    ]) if to_send else []
+
+    failed = 0
+    with transaction.atomic():
+        for msg, result in zip(to_send, results):
+            if result['success']:
+                msg.email_message_id = result.get('messages', [{}])[0].get('id', '')
+                msg.delivery_status = 'sent'
+                continue
+            failed += 1
+            msg.retry_count += 1
+            if msg.retry_count > MAX_SEND_RETRIES:
+                msg.delivery_status = 'failed'
+                transaction.on_commit(partial(
+                    send_to_dead_letter.delay, msg.user.email, msg.body, msg.user_id, result['error']
+                ))
+            else:
+                msg.delivery_status = 'queued'  # retried by the next drain
+
+        EmailMessage.objects.bulk_update(
+            messages, ['email_message_id', 'delivery_status', 'retry_count', 'claimed_at']
+        )
+
+    return {'sent': len(to_send) - failed, 'deferred': deferred, 'failed': failed}
+
 @shared_task(bind=True, max_retries=3)
 def send_priority_message(self, email_address, message, user_id, location, temperature, message_type):
     """High priority - immediate send"""
@@ -194,13 +393,67 @@ def process_dead_letter_queue():
         msg.status = 'retried'
         msg.save()
 
+# CACHE REFRESH TASKS
+@shared_task
+def refresh_weather_cache(city_name, request_type='default'):
+    """Refresh a stale or nearly-stale weather cache entry in the background"""
+    weather_service = WeatherService()
+    try:
+        weather_service.fetch_coalesced(city_name, request_type)
+    except Exception as e:
+        logger.warning(f"Background refresh failed for {city_name}: {e}")
+
+@shared_task
+def warm_weather_cache():
+    """Runs every WEATHER_WARM_INTERVAL seconds to queue paced refreshes of cities about to go stale"""
+    batches = plan_warming()
+    for countdown, cities in batches:
+        warm_cities.apply_async((cities,), countdown=countdown)
+    return sum(len(cities) for _, cities in batches)
+
+@shared_task
+def warm_cities(cities):
+    """Refresh one batch of warming cities with a bulk upstream call (skips any refreshed meanwhile)"""
+    weather = WeatherService().ingest_weather_bulk(cities, 'warming', refresh_within=settings.WEATHER_WARM_LEAD)
+    return sum(1 for city in cities if 'error' not in weather[city])
+
+@shared_task
+def flush_popular_city_counts():
+    """Runs every 30 seconds to write the Redis city counters to PopularCity in bulk"""
+    return flush_counts_to_database()
+
+# ANALYTICS TASKS
+@shared_task
+def update_analytics_rollups():
+    """Runs every 5 minutes to merge new log rows into the hourly/daily rollups"""
+    return update_rollups()
+
+# MAINTENANCE TASKS
+@shared_task
+def create_upcoming_partitions():
+    """Runs daily so the log tables always have next months' partitions ready"""
+    return ensure_partitions(settings.PARTITION_MONTHS_AHEAD)
+
+# DASHBOARD TASKS
+@shared_task
+def refresh_dashboard_snapshot():
+    """Runs every 10 seconds so the dashboard API only ever reads a snapshot"""
+    version, _ = store_dashboard_snapshot()
+    return version
+
+@shared_task
+def collect_celery_inspection():
+    """Runs every 15 seconds, the only place the dashboard broadcasts to the workers"""
+    inspection = store_celery_inspection()
+    return len(inspection.get('ping') or {})
+
 @shared_task
 def check_temperature_changes():
     """Check for temperature changes across all locations"""
     locations = ['Cupertino', 'San Francisco', 'New York', 'London']
-    
-    for location in locations:
-        convert_temperature.delay(location, [])
+
+    #one bulk upstream call for all of them instead of one task per location
+    return convert_temperatures({location: [] for location in locations})
 
  
 
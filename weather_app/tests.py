@@ -1,9 +1,69 @@
 # weather_app/tests.py
-from django.test import TestCase, Client
+import asyncio
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import pickle
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from datetime import timedelta
+import threading
+import uuid
+import redis
+import requests
+from unittest import skipUnless
+from django.db import connection, DatabaseError
+from django.test import TestCase, Client, AsyncClient, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.contrib.auth.models import User
-from unittest.mock import patch, MagicMock
-from .models import EmailMessage, CeleryWeatherRequest
+from django.conf import settings
+from django.utils import timezone
+from django.core import mail
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from django.core.mail import get_connection
+from unittest.mock import patch, MagicMock, AsyncMock
+from .models import (
+    EmailMessage, CeleryWeatherRequest, WeatherRequest, PopularCity, UserActivity, WeatherRollup, RollupWatermark
+)
 from .email_client import EmailAPI
+from .views import (
+    WeatherService, AsyncWeatherService, get_day_range, get_message_status_counts, build_dashboard_stats,
+    store_dashboard_snapshot, store_celery_inspection, DASHBOARD_SNAPSHOT_KEY, CELERY_INSPECT_KEY,
+    fetch_executor
+)
+from .singleflight import SingleFlight
+from .local_cache import LocalCache, weather_l1_cache
+from .write_buffer import WriteBuffer, flush_all_buffers
+from . import flushers
+from .redis_clients import RedisRegistry, client_options, get_redis, get_async_redis, count_keys, scan_keys, unlink_matching
+from .cache_manager import CacheManager
+from .cache_generations import weather_generations
+from .cache_warming import warm_targets, due_cities, reserve_lookups, plan_warming
+from .cache_metrics import cache_metrics
+from .cache_serializer import WeatherCacheSerializer, SerializerError
+from .upstream import CircuitBreaker, UpstreamUnavailable, is_upstream_failure, weather_breaker, weather_bulk_breaker
+from .rollups import update_rollups, weather_summary, activity_summary, percentile, LATENCY_BUCKETS
+from .partitions import (
+    is_partitioned, ensure_partitions, create_month_partition, drop_partitions_before,
+    delete_in_chunks, month_start, partition_name
+)
+from . import city_counters
+from .tasks import (
+    collect_weather_requests, format_messages, format_message, send_message_batch, convert_temperature,
+    convert_temperatures, check_temperature_changes,
+    warm_weather_cache, warm_cities,
+    redis_client as task_redis_client
+)
+from .utils import (
+    check_rate_limit, check_email_rate_limit, acheck_ip_rate_limit, RateLimitResult, HybridRateLimiter, redis_client
+)
 
 class WeatherAppTestCase(TestCase):
     def setUp(self):
@@ -14,7 +74,7 @@ class WeatherAppTestCase(TestCase):
             password='testpass123'
         )
 
-    @patch('weather_app.views.requests.get')
+    @patch('weather_app.views.httpx.AsyncClient.get', new_callable=AsyncMock)
     def test_index_view(self, mock_requests):
         """Test the main weather page loads - mocking external weather API"""
         # Mock the weather API response
@@ -36,6 +96,31 @@ class WeatherAppTestCase(TestCase):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
 
+    @patch('weather_app.views.httpx.AsyncClient.get', new_callable=AsyncMock)
+    def test_random_weather_api(self, mock_get):
+        """Test the async random weather endpoint fetches 4 cities"""
+        cache.clear()
+        weather_l1_cache.clear()
+        mock_response = MagicMock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            'location': {'name': 'London', 'country': 'UK'},
+            'current': {
+                'temp_c': 15,
+                'feelslike_c': 14,
+                'condition': {'text': 'Rain', 'icon': '//cdn.weatherapi.com/weather/64x64/day/296.png'},
+                'humidity': 80,
+                'pressure_mb': 1005,
+                'wind_kph': 12
+            }
+        }
+        mock_get.return_value = mock_response
+
+        response = self.client.post('/random-weather/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['cities']), 4)
+        self.assertEqual(mock_get.call_count, 4)
+
     def test_dashboard_view(self):
         """Test dashboard loads"""
         response = self.client.get('/dashboard/')
@@ -70,6 +155,1373 @@ class WeatherAppTestCase(TestCase):
         self.assertEqual(request.user, self.user)
         self.assertEqual(request.status, 'pending')
 
+class WeatherBatchTestCase(TestCase):
+    """Test the batched multi-city fetch"""
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+
+    def make_response(self, city):
+        mock_response = MagicMock()
+        mock_response.raise_for_status.return_value = None
+        mock_response.json.return_value = {
+            'location': {'name': city, 'country': 'Testland'},
+            'current': {
+                'temp_c': 20,
+                'feelslike_c': 21,
+                'condition': {'text': 'Cloudy', 'icon': '//cdn.weatherapi.com/weather/64x64/day/119.png'},
+                'humidity': 50,
+                'pressure_mb': 1010,
+                'wind_kph': 5
+            }
+        }
+        return mock_response
+
+    @override_settings(WRITE_BUFFER_ENABLED=True)
+    @patch('weather_app.views.http_session.get')
+    def test_batch_fetches_only_misses_in_order(self, mock_get):
+        """Cached cities are served from cache, misses are fetched, order is kept"""
+        service = WeatherService()
+        service.cache_weather_data('London', {'city': 'London', 'temperature': 10, 'timestamp': '10:00:00'})
+        mock_get.side_effect = lambda url, timeout: self.make_response('Paris' if 'Paris' in url else 'Tokyo')
+
+        results = service.get_weather_batch(['Paris', 'London', 'Tokyo'], request_type='random')
+        flush_all_buffers()
+
+        self.assertEqual([r['city'] for r in results], ['Paris', 'London', 'Tokyo'])
+        self.assertTrue(results[1]['from_cache'])
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(WeatherRequest.objects.count(), 2)
+
+    @patch('weather_app.views.WeatherService.record_api_response')
+    @patch('weather_app.views.http_session.get')
+    def test_unparsable_response_not_cached(self, mock_get, mock_record):
+        """A response that can't be parsed is neither cached nor kept as last-known-good"""
+        response = self.make_response('Oslo')
+        del response.json.return_value['current']
+        mock_get.return_value = response
+
+        results = WeatherService().get_weather_batch(['Oslo'])
+
+        self.assertIn('error', results[0])
+        self.assertIsNone(cache.get(WeatherService.get_cache_key('Oslo')))
+        self.assertIsNone(cache.get(WeatherService.get_lkg_key('Oslo')))
+        mock_record.assert_not_called()
+
+    @override_settings(WEATHER_BATCH_DEADLINE=0.2)
+    @patch('weather_app.views.WeatherService.record_api_response')
+    @patch('weather_app.views.http_session.get')
+    def test_batch_deadline(self, mock_get, mock_record):
+        """Slow upstream calls past the deadline come back as errors, and are still recorded once they finish"""
+        release, recorded = threading.Event(), threading.Event()
+        def slow_get(url, timeout):
+            release.wait(1)
+            return self.make_response('Oslo')
+        mock_get.side_effect = slow_get
+        mock_record.side_effect = lambda *args: recorded.set()
+
+        start = time.time()
+        results = WeatherService().get_weather_batch(['Oslo'])
+
+        self.assertLess(time.time() - start, 1)
+        self.assertIn('error', results[0])
+        release.set()
+        self.assertTrue(recorded.wait(2))
+        mock_record.assert_called_once()
+
+    @patch('weather_app.views.WeatherService.record_api_response')
+    @patch('weather_app.views.http_session.get')
+    def test_fetch_workers_shared_between_batches(self, mock_get, mock_record):
+        """Concurrent batches together stay within the per-process worker cap"""
+        lock, in_flight, peak = threading.Lock(), [0], [0]
+        def slow_get(url, timeout):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return self.make_response(parse_qs(urlparse(url).query)['q'][0])
+        mock_get.side_effect = slow_get
+
+        max_workers = fetch_executor._max_workers
+        batches = [[f"Town {i}-{j}" for j in range(max_workers)] for i in range(3)]
+        threads = [threading.Thread(target=WeatherService().get_weather_batch, args=(batch,)) for batch in batches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mock_get.call_count, 3 * max_workers)
+        self.assertLessEqual(peak[0], max_workers)
+
+class StubWeatherAPIHandler(BaseHTTPRequestHandler):
+    """Answers WeatherAPI bulk POSTs from the server's temperatures dict"""
+
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.calls.append((query, body))
+
+        bulk = []
+        for location in body['locations']:
+            temp_c = self.server.temperatures.get(location['q'])
+            if temp_c is None:
+                answer = {'error': {'code': 1006, 'message': 'No matching location found.'}}
+            else:
+                answer = {
+                    'location': {'name': location['q'], 'country': 'Testland'},
+                    'current': {
+                        'temp_c': temp_c, 'feelslike_c': temp_c, 'humidity': 50, 'pressure_mb': 1010, 'wind_kph': 5,
+                        'condition': {'text': 'Clear', 'icon': '//cdn.weatherapi.com/weather/64x64/day/113.png'},
+                    },
+                }
+            bulk.append({'query': {'custom_id': location['custom_id'], 'q': location['q'], **answer}})
+
+        payload = json.dumps({'bulk': bulk}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BulkIngestionTestCase(TestCase):
+    """Test bulk WeatherAPI ingestion against a local stub server"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubWeatherAPIHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.api_url = f"http://127.0.0.1:{cls.server.server_port}/v1/current.json"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+        task_redis_client.delete(*[f"last_temp:{city}" for city in ('Lima', 'Quito', 'Cusco', 'Cupertino')])
+        self.server.calls = []
+        self.server.temperatures = {'Lima': 18, 'Quito': 12, 'Cusco': 9}
+        self.override = override_settings(WEATHER_API_URL=self.api_url, WEATHER_BULK_BATCH_SIZE=2)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def test_bulk_ingestion(self):
+        """Cities are fetched a batch per call, cached, logged and counted in bulk"""
+        city_counters.redis_client.delete(city_counters.COUNTS_KEY, city_counters.PENDING_KEY)
+        results = WeatherService().ingest_weather_bulk(['Lima', 'Quito', 'Cusco', 'Atlantis'])
+
+        self.assertEqual(len(self.server.calls), 2)
+        query, body = self.server.calls[0]
+        self.assertEqual(query['q'], ['bulk'])
+        self.assertEqual([location['q'] for location in body['locations']], ['Lima', 'Quito'])
+
+        self.assertEqual(results['Lima']['temperature'], 18)
+        self.assertIn('error', results['Atlantis'])
+        self.assertEqual(WeatherRequest.objects.filter(request_type='bulk').count(), 3)
+        self.assertEqual(city_counters.redis_client.hgetall(city_counters.PENDING_KEY),
+                         {'Lima': '1', 'Quito': '1', 'Cusco': '1'})
+        self.assertIsNotNone(cache.get(WeatherService.get_cache_key('Cusco')))
+
+        #warming refreshes are logged but not counted as demand
+        WeatherService().ingest_weather_bulk(['Lima'], 'warming', refresh_within=3600)
+        self.assertEqual(WeatherRequest.objects.filter(request_type='warming').count(), 1)
+        self.assertEqual(city_counters.redis_client.hget(city_counters.PENDING_KEY, 'Lima'), '1')
+
+        #fresh cities come from the cache next time
+        self.server.calls = []
+        results = WeatherService().ingest_weather_bulk(['Lima', 'Quito', 'Cusco'])
+        self.assertEqual(self.server.calls, [])
+        self.assertTrue(results['Quito']['from_cache'])
+
+    @patch('weather_app.tasks.format_messages.delay')
+    def test_convert_temperatures(self, mock_format):
+        """A digest chunk is converted with bulk calls, last_temp keys are updated in batch"""
+        user = User.objects.create_user(username='bulk', email='bulk@example.com', password='testpass123')
+        lima = CeleryWeatherRequest.objects.create(user=user, location='Lima', message_type='weather_update')
+        lost = CeleryWeatherRequest.objects.create(user=user, location='Atlantis', message_type='weather_update',
+                                                   status='processing')
+        task_redis_client.set('last_temp:Lima', 10)
+
+        self.assertEqual(convert_temperatures({'Lima': [lima.id], 'Atlantis': [lost.id]}), 1)
+
+        self.assertEqual(len(self.server.calls), 1)
+        mock_format.assert_called_once_with([lima.id], 'Lima', 18, 8.0, 'high')
+        self.assertEqual(float(task_redis_client.get('last_temp:Lima')), 18)
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, 'pending')
+
+    def test_check_temperature_changes(self):
+        self.server.temperatures['Cupertino'] = 21
+        check_temperature_changes()
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertEqual(float(task_redis_client.get('last_temp:Cupertino')), 21)
+
+    def test_warm_cities(self):
+        """Warming refetches entries about to go stale and leaves fresher ones alone"""
+        service = WeatherService()
+        service.cache_weather_data('Lima', {'city': 'Lima', 'country': 'Testland', 'temperature': 1})
+        entry = service.make_cache_entry({'city': 'Quito', 'country': 'Testland', 'temperature': 1})
+        entry['fresh_until'] = time.time() + 10
+        cache.set(service.get_cache_key('Quito'), entry)
+
+        self.assertEqual(warm_cities(['Lima', 'Quito', 'Cusco']), 3)
+        self.assertEqual([location['q'] for location in self.server.calls[0][1]['locations']], ['Quito', 'Cusco'])
+        self.assertEqual(WeatherRequest.objects.filter(request_type='warming').count(), 2)
+        self.assertEqual(service.get_weather_from_cache('Quito')[0]['temperature'], 12)
+
+class CacheWarmingTestCase(TestCase):
+    """Test picking, ordering and pacing the cities to warm"""
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+
+    def test_warm_targets(self):
+        """Popular cities first, then pending digest locations, then the city list, without duplicates"""
+        PopularCity.objects.create(city='Reykjavik', country='Iceland', request_count=50)
+        PopularCity.objects.create(city='London', country='UK', request_count=40)
+        user = User.objects.create_user(username='warm', email='warm@example.com', password='testpass123')
+        CeleryWeatherRequest.objects.create(user=user, location='Cupertino', message_type='weather_update')
+        CeleryWeatherRequest.objects.create(user=user, location='Nowhere', message_type='weather_update',
+                                            status='completed')
+
+        targets = warm_targets(top_n=5)
+        self.assertEqual(targets[:3], ['Reykjavik', 'London', 'Cupertino'])
+        self.assertIn('Tokyo', targets)
+        self.assertNotIn('Nowhere', targets)
+        self.assertEqual(len(targets), len({city.lower() for city in targets}))
+
+    def test_due_cities(self):
+        """Missing entries first, then the ones going stale soonest, fresh ones are skipped"""
+        service = WeatherService()
+        service.cache_weather_data('London', {'city': 'London', 'country': 'UK'})
+        for city, remaining in [('Paris', 30), ('Rome', 10)]:
+            entry = service.make_cache_entry({'city': city, 'country': 'Europe'})
+            entry['fresh_until'] = time.time() + remaining
+            cache.set(service.get_cache_key(city), entry)
+
+        self.assertEqual(due_cities(['London', 'Paris', 'Rome', 'Tokyo'], lead=60), ['Tokyo', 'Rome', 'Paris'])
+
+    @override_settings(WEATHER_WARM_LOOKUPS_PER_MINUTE=5)
+    def test_lookup_budget(self):
+        self.assertEqual(reserve_lookups(3), 3)
+        self.assertEqual(reserve_lookups(3), 2)
+        self.assertEqual(reserve_lookups(1), 0)
+
+    @override_settings(WEATHER_WARM_LOOKUPS_PER_MINUTE=5, WEATHER_BULK_BATCH_SIZE=2, WEATHER_WARM_INTERVAL=60)
+    @patch('weather_app.tasks.warm_cities.apply_async')
+    def test_warm_weather_cache(self, mock_apply):
+        """Due cities within the budget are queued in batches spread over the interval"""
+        with patch('weather_app.cache_warming.warm_targets', return_value=['A', 'B', 'C', 'D', 'E', 'F']):
+            self.assertEqual(warm_weather_cache(), 5)
+        self.assertEqual(
+            [(call.args[0], call.kwargs['countdown']) for call in mock_apply.call_args_list],
+            [((['A', 'B'],), 0), ((['C', 'D'],), 20.0), ((['E'],), 40.0)]
+        )
+
+    def test_no_warming_while_circuit_open(self):
+        with patch.object(weather_breaker, 'state', return_value='open'):
+            self.assertEqual(plan_warming(['A']), [])
+
+class RedisRegistryTestCase(TestCase):
+    """Test the per-purpose pooled Redis clients"""
+
+    def test_one_pooled_client_per_purpose(self):
+        registry = RedisRegistry()
+        self.assertIs(registry.get('cache'), registry.get('cache'))
+        self.assertIsNot(registry.get('cache').connection_pool, registry.get('ratelimit').connection_pool)
+        with self.assertRaises(ValueError):
+            registry.get('sessions')
+
+    def test_options(self):
+        """Shared settings apply to every purpose, REDIS_CLIENTS overrides one"""
+        self.assertIsNone(client_options('pubsub')['socket_timeout'])
+        with override_settings(REDIS_CLIENTS={'ratelimit': {'max_connections': 7}}):
+            self.assertEqual(client_options('ratelimit')['max_connections'], 7)
+            self.assertEqual(client_options('cache')['max_connections'], settings.REDIS_MAX_CONNECTIONS)
+
+    def test_fork_resets_pools(self):
+        """A forked child keeps the same client objects but none of the parent's connections"""
+        registry = RedisRegistry()
+        client = registry.get('counters')
+        client.ping()
+        self.assertEqual(registry.pool_stats()['counters'], {'in_use': 0, 'idle': 1, 'max': settings.REDIS_MAX_CONNECTIONS})
+
+        registry._pid = -1  #as if we were now in a child process
+        self.assertIs(registry.get('counters'), client)
+        self.assertEqual(client.connection_pool._connections, [])
+        self.assertTrue(client.ping())
+
+    def test_pool_stats_without_pool_internals(self):
+        """Pool usage is reported as unknown when redis-py doesn't expose it"""
+        registry = RedisRegistry()
+        registry._clients['cache'] = MagicMock(connection_pool=MagicMock(spec=['max_connections'], max_connections=5))
+        self.assertEqual(registry.pool_stats()['cache'], {'in_use': None, 'idle': None, 'max': 5})
+
+    def test_scan_and_unlink_in_batches(self):
+        """Keys are counted with SCAN and unlinked a batch per round-trip"""
+        client = get_redis('cache')
+        client.mset({f"scan_test:{i}": i for i in range(25)})
+        client.set("scan_other", 1)
+        self.assertEqual(count_keys(client, "scan_test:*", count=10), 25)
+
+        progress = []
+        self.assertEqual(unlink_matching(client, "scan_test:*", batch_size=10, progress=progress.append), 25)
+        self.assertEqual(progress, [10, 20, 25])
+        self.assertEqual(count_keys(client, "scan_test:*"), 0)
+        self.assertTrue(client.exists("scan_other"))
+
+    def test_invalidate_all_weather_cache(self):
+        """Invalidation moves to a new generation, old keys stay until purged (never with KEYS)"""
+        weather_generations.refresh()
+        old_key = WeatherService.get_cache_key('Oslo')
+        cache.set_many({WeatherService.get_cache_key(city): {'city': city} for city in ['Oslo', 'Lima']})
+        cache.set('not_weather', 1)
+
+        generation = CacheManager.invalidate_all_weather_cache()
+        self.assertEqual(weather_generations.current(), generation)
+        self.assertNotEqual(WeatherService.get_cache_key('Oslo'), old_key)
+        self.assertIsNone(cache.get(WeatherService.get_cache_key('Oslo')))
+        self.assertEqual(cache.get(old_key), {'city': 'Oslo'})
+
+        cache.set(WeatherService.get_cache_key('Oslo'), {'city': 'Oslo'})
+        with patch('redis.Redis.keys', side_effect=AssertionError('KEYS used')):
+            self.assertEqual(CacheManager.purge_old_generations(), 2)
+        self.assertIsNone(cache.get(old_key))
+        self.assertEqual(cache.get(WeatherService.get_cache_key('Oslo')), {'city': 'Oslo'})
+        self.assertEqual(cache.get('not_weather'), 1)
+
+    def test_invalidate_country_weather_cache(self):
+        """Only entries of the invalidated country become misses"""
+        weather_generations.refresh()
+        service = WeatherService()
+        keys = {city: service.get_cache_key(city) for city in ['Paris', 'Lyon', 'Oslo']}
+        countries = {'Paris': 'France', 'Lyon': 'France', 'Oslo': 'Norway'}
+        cache.set_many({
+            keys[city]: service.make_cache_entry({'city': city, 'country': countries[city]})
+            for city in keys
+        })
+        self.assertEqual(len(service.get_cache_entries(list(keys.values()))), 3)
+
+        CacheManager.invalidate_country_weather_cache('France')
+        self.assertEqual(list(service.get_cache_entries(list(keys.values()))), [keys['Oslo']])
+
+        cache.set(keys['Paris'], service.make_cache_entry({'city': 'Paris', 'country': 'France'}))
+        self.assertIn(keys['Paris'], service.get_cache_entries([keys['Paris']]))
+
+    async def test_async_path_never_refreshes_synchronously(self):
+        """On the event loop expired generations are only reloaded by arefresh"""
+        weather_generations._loaded_at = 0
+        with patch.object(weather_generations, 'refresh', side_effect=AssertionError('blocking refresh')):
+            WeatherService().make_cache_entry({'city': 'Oslo', 'country': 'Norway'})
+            WeatherService.get_cache_key('Oslo')
+            await weather_generations.arefresh(get_async_redis('cache'))
+        self.assertTrue(weather_generations._is_fresh())
+
+class CircuitBreakerTestCase(TestCase):
+    """Test the shared circuit breaker, adaptive timeouts and failure fallbacks"""
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+
+    @override_settings(WEATHER_CIRCUIT_FAILURE_THRESHOLD=2)
+    @patch('weather_app.views.http_session.get')
+    def test_circuit_opens_and_fails_fast(self, mock_get):
+        """After enough upstream failures calls are rejected without touching WeatherAPI"""
+        mock_get.side_effect = requests.exceptions.ConnectTimeout()
+        service = WeatherService()
+
+        self.assertIn('error', service.get_weather('Oslo'))
+        self.assertIn('error', service.get_weather('Bergen'))
+        self.assertEqual(weather_breaker.state(), 'open')
+
+        self.assertIn('error', service.get_weather('Tromso'))
+        self.assertEqual(mock_get.call_count, 2)
+
+    @override_settings(WEATHER_CIRCUIT_FAILURE_THRESHOLD=1, WEATHER_CIRCUIT_COOLDOWN=0.05)
+    def test_half_open_probe(self):
+        """After the cooldown exactly one caller probes, its success closes the circuit"""
+        self.assertTrue(weather_breaker.record_failure())
+        with self.assertRaises(UpstreamUnavailable):
+            weather_breaker.before_call()
+
+        time.sleep(0.1)
+        self.assertTrue(weather_breaker.before_call())
+        with self.assertRaises(UpstreamUnavailable):
+            weather_breaker.before_call()
+
+        weather_breaker.record_success(0.2, probe=True)
+        self.assertEqual(weather_breaker.state(), 'closed')
+        self.assertFalse(weather_breaker.before_call())
+
+    @override_settings(WEATHER_CIRCUIT_FAILURE_THRESHOLD=2)
+    @patch('weather_app.views.http_session.post')
+    def test_bulk_calls_have_their_own_breaker(self, mock_post):
+        """Slow bulk calls use their own latency samples, and their timeouts don't open the single-lookup circuit"""
+        redis_client.delete(weather_breaker.latency_key, weather_bulk_breaker.latency_key)
+        mock_post.side_effect = requests.exceptions.ReadTimeout()
+        service = WeatherService()
+
+        for city in ('Oslo', 'Bergen'):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                service.fetch_bulk_from_api([city])
+        self.assertEqual(weather_bulk_breaker.state(), 'open')
+        self.assertEqual(weather_breaker.state(), 'closed')
+
+        weather_bulk_breaker.record_success(4.0)
+        self.assertEqual(redis_client.llen(weather_breaker.latency_key), 0)
+        self.assertEqual(redis_client.llen(weather_bulk_breaker.latency_key), 1)
+
+    @patch('weather_app.views.http_session.get')
+    def test_last_known_good_and_negative_cache(self, mock_get):
+        """A failed fetch serves the last good value and isn't retried right away"""
+        service = WeatherService()
+        service.cache_weather_data('Lima', {'city': 'Lima', 'temperature': 18, 'timestamp': '10:00:00'})
+        cache.delete(service.get_cache_key('Lima'))
+        weather_l1_cache.clear()
+        mock_get.side_effect = requests.exceptions.ReadTimeout()
+
+        weather = service.get_weather('Lima')
+        self.assertEqual(weather['temperature'], 18)
+        self.assertTrue(weather['last_known_good'])
+        self.assertTrue(weather['stale'])
+
+        service.get_weather('Lima')
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_adaptive_timeouts(self):
+        """Read timeouts follow the p99 of recent latencies, within bounds"""
+        breaker = CircuitBreaker('test')
+        redis_client.delete(breaker.latency_key)
+        self.assertEqual(breaker.timeouts(), (settings.WEATHER_CONNECT_TIMEOUT, settings.WEATHER_READ_TIMEOUT_MAX))
+
+        for _ in range(10):
+            breaker.record_success(0.5)
+        breaker._read_timeout_at = 0
+        self.assertAlmostEqual(breaker.timeouts()[1], 1.5)
+        self.assertEqual(breaker.timeouts(cap=0.5)[1], 0.5)
+
+    def test_client_errors_dont_count(self):
+        """An unknown city (4xx) says nothing about WeatherAPI's health"""
+        response = MagicMock(status_code=400)
+        self.assertFalse(is_upstream_failure(requests.exceptions.HTTPError(response=response)))
+        response.status_code = 503
+        self.assertTrue(is_upstream_failure(requests.exceptions.HTTPError(response=response)))
+        self.assertTrue(is_upstream_failure(requests.exceptions.ConnectionError()))
+
+class SingleFlightTestCase(TestCase):
+    """Test cache miss coalescing"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """Callers arriving while a key is in flight get the leader's result"""
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch():
+            calls.append(1)
+            started.set()
+            release.wait(2)
+            return 'weather'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('weather:paris', slow_fetch)))
+        leader.start()
+        started.wait(2)
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do('weather:paris', slow_fetch)))
+            for _ in range(5)
+        ]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(2)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 5)
+        self.assertTrue(all(result == 'weather' for result, _ in results))
+
+    async def test_leader_deadline_does_not_fail_followers(self):
+        """A batch that gives up on a shared fetch at its deadline leaves it running for the other batches"""
+        cache.clear()
+        weather_l1_cache.clear()
+        service = AsyncWeatherService()
+        started = asyncio.Event()
+
+        async def slow_fetch(city_name, timeout=None):
+            started.set()
+            await asyncio.sleep(0.2)
+            return {'city': city_name, 'temperature': 12}, None, 0.2
+
+        with patch.object(AsyncWeatherService, 'afetch_and_cache', side_effect=slow_fetch) as mock_fetch:
+            with override_settings(WEATHER_BATCH_DEADLINE=0.05):
+                leader = asyncio.ensure_future(service.aget_weather_batch(['Oslo']))
+                await started.wait()
+            follower = await service.aget_weather_batch(['Oslo'])
+            leader_result = await leader
+
+        mock_fetch.assert_called_once()
+        self.assertEqual(follower[0]['temperature'], 12)
+        self.assertTrue(leader_result[0]['error'])
+
+    async def test_abandoned_fetch_is_recorded_once(self):
+        """An upstream call nobody waits for any more is still saved, exactly once"""
+        cache.clear()
+        weather_l1_cache.clear()
+        recorded = asyncio.Event()
+
+        async def slow_fetch(city_name, timeout=None):
+            await asyncio.sleep(0.1)
+            return {'city': city_name, 'temperature': 12}, {'location': {'name': city_name}}, 0.1
+
+        with patch.object(AsyncWeatherService, 'afetch_and_cache', side_effect=slow_fetch), \
+                patch.object(AsyncWeatherService, 'arecord_api_response', side_effect=lambda *args: recorded.set()) as mock_record:
+            with override_settings(WEATHER_BATCH_DEADLINE=0.02):
+                results = await AsyncWeatherService().aget_weather_batch(['Oslo'])
+            await asyncio.wait_for(recorded.wait(), 2)
+
+        self.assertTrue(results[0]['error'])
+        mock_record.assert_called_once()
+
+    @patch('weather_app.views.http_session.get')
+    @patch('weather_app.views.acquire_fill_lock', return_value=None)
+    def test_lock_loser_waits_for_cache(self, mock_lock, mock_get):
+        """A process that loses the refill lock reads the winner's value instead of calling the API"""
+        cache.clear()
+        weather_l1_cache.clear()
+        service = WeatherService()
+        service.cache_weather_data('Paris', {'city': 'Paris', 'temperature': 18, 'timestamp': '09:00:00'})
+
+        weather_data, data, api_response_time = service.fetch_and_cache('Paris')
+
+        self.assertEqual(weather_data['city'], 'Paris')
+        self.assertIsNone(data)
+        mock_get.assert_not_called()
+
+class StaleWhileRevalidateTestCase(TestCase):
+    """Test soft expiry and background refresh of weather cache entries"""
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+        self.service = WeatherService()
+
+    @patch('weather_app.tasks.refresh_weather_cache.delay')
+    def test_stale_entry_served_and_refreshed_once(self, mock_refresh):
+        """Past the soft expiry the old value is returned and one refresh is queued"""
+        entry = self.service.make_cache_entry({'city': 'Rome', 'temperature': 25, 'timestamp': '08:00:00'})
+        entry['fresh_until'] = time.time() - 1
+        cache.set(self.service.get_cache_key('Rome'), entry, 60)
+
+        first = self.service.get_weather('Rome')
+        second = self.service.get_weather('Rome')
+
+        self.assertEqual(first['temperature'], 25)
+        self.assertTrue(first['stale'])
+        self.assertTrue(second['from_cache'])
+        mock_refresh.assert_called_once_with('Rome', 'default')
+
+    @patch('weather_app.tasks.refresh_weather_cache.delay')
+    def test_fresh_entry_not_refreshed(self, mock_refresh):
+        """A fresh entry with a fast upstream call is not refreshed early"""
+        self.service.cache_weather_data('Rome', {'city': 'Rome', 'temperature': 25}, fetch_time=0.01)
+
+        self.service.get_weather('Rome')
+
+        mock_refresh.assert_not_called()
+
+    def test_xfetch_refreshes_early_for_slow_fetches(self):
+        """A slow upstream call makes XFetch refresh well before the soft expiry"""
+        entry = {'data': {}, 'fresh_until': time.time() + 1, 'fetch_time': 1000}
+        reasons = {WeatherService.get_refresh_reason(entry) for _ in range(20)}
+        self.assertIn('early', reasons)
+
+class LocalCacheTestCase(TestCase):
+    """Test the in-process L1 cache"""
+
+    def setUp(self):
+        self.l1 = LocalCache(max_entries=2, ttl=60)
+        #no listener thread needed for these tests
+        self.l1._ensure_listener = lambda: None
+
+    def test_lru_eviction(self):
+        """The least recently used key is evicted when full"""
+        self.l1.set('a', 1)
+        self.l1.set('b', 2)
+        self.l1.get('a')
+        self.l1.set('c', 3)
+
+        self.assertEqual(self.l1.get('a'), 1)
+        self.assertIsNone(self.l1.get('b'))
+        self.assertEqual(self.l1.get('c'), 3)
+
+    def test_ttl_expiry(self):
+        """Entries disappear after their TTL"""
+        self.l1.set('a', 1, ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.l1.get('a'))
+
+    def test_returns_copies(self):
+        """Callers can't change what is cached"""
+        self.l1.set('a', {'city': 'Paris'})
+        self.l1.get('a')['from_cache'] = True
+        self.assertEqual(self.l1.get('a'), {'city': 'Paris'})
+
+    def test_invalidation_messages(self):
+        """Messages from other processes drop keys, our own are ignored"""
+        self.l1.set('a', 1)
+        self.l1.set('b', 2)
+
+        self.l1._handle_message(self.l1.invalidation_message('a'))
+        self.assertEqual(self.l1.get('a'), 1)
+
+        self.l1._handle_message('other-process|a')
+        self.assertIsNone(self.l1.get('a'))
+
+        self.l1._handle_message('other-process|*')
+        self.assertIsNone(self.l1.get('b'))
+
+class CacheMetricsTestCase(TestCase):
+    """Test buffered hit/miss metrics and their rolling windows"""
+
+    def setUp(self):
+        cache.clear()
+        weather_l1_cache.clear()
+        cache_metrics.clear()
+        self.redis = get_redis('cache')
+
+    @patch('weather_app.cache_metrics.current_minute', return_value=int(time.time() // 60))
+    def test_buffered_until_flush(self, mock_minute):
+        """Lookups are counted in memory and written in one flush, with a TTL on every bucket"""
+        service = WeatherService()
+        service.cache_weather_data('Oslo', {'city': 'Oslo', 'country': 'Norway'})
+        service.get_weather_from_cache('Oslo')
+        service.get_weather_from_cache('Oslo')
+        service.get_weather_from_cache('Lima')
+        self.assertEqual(count_keys(self.redis, "cache_metrics:*"), 0)
+
+        self.assertEqual(cache_metrics.flush(), 3)
+        for key in scan_keys(self.redis, "cache_metrics:*"):
+            self.assertGreater(self.redis.ttl(key), 0)
+
+        stats = service.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (2, 1, 66.67))
+        self.assertEqual(stats['windows']['1m']['total'], 3)
+        self.assertEqual(service.get_cache_stats('Lima')['windows']['5m']['misses'], 1)
+
+    def test_rolling_windows(self):
+        """Each window only sums the buckets it covers"""
+        minute = int(time.time() // 60)
+        self.redis.hset(f"cache_metrics:m:{minute}", mapping={'hit': 1})
+        self.redis.hset(f"cache_metrics:m:{minute - 3}", mapping={'hit': 2, 'miss': 2})
+        self.redis.hset(f"cache_metrics:m:{minute - 30}", mapping={'miss': 4})
+        self.redis.hset(f"cache_metrics:h:{minute // 60 - 5}", mapping={'hit': 8})
+        self.redis.hset(f"cache_metrics:h:{minute // 60 - 30}", mapping={'hit': 100})
+
+        rates = cache_metrics.hit_rates()
+        self.assertEqual(rates['1m']['total'], 1)
+        self.assertEqual((rates['5m']['hits'], rates['5m']['misses']), (3, 2))
+        self.assertEqual(rates['1h']['misses'], 6)
+        self.assertEqual(rates['24h']['hits'], 8)
+
+    async def test_async_stats(self):
+        cache_metrics.record('Oslo', hit=True)
+        cache_metrics.flush()
+        stats = await AsyncWeatherService().aget_cache_stats()
+        self.assertEqual(stats['windows']['1h']['hits'], 1)
+
+    def test_invalidate_cache_stats(self):
+        cache_metrics.record('Oslo', hit=False)
+        cache_metrics.flush()
+        self.assertEqual(CacheManager.invalidate_cache_stats(), 2)
+        self.assertEqual(WeatherService().get_cache_stats()['total'], 0)
+
+class CacheSerializerTestCase(TestCase):
+    """Test the versioned cache serializer"""
+
+    def setUp(self):
+        cache.clear()
+        self.serializer = WeatherCacheSerializer(format='orjson', compression='zlib', min_size=100)
+
+    def test_cache_round_trip(self):
+        """Cached values go through orjson behind the header"""
+        entry = WeatherService().make_cache_entry({'city': 'Oslo', 'country': 'Norway', 'temperature': 4})
+        cache.set('serializer_test', entry)
+        self.assertEqual(cache.get('serializer_test'), entry)
+        raw = get_redis_connection('default').get(cache.make_key('serializer_test'))
+        self.assertEqual(raw[:3], b'W\x01\x10')
+
+    def test_compression_above_threshold(self):
+        small = {'city': 'Oslo'}
+        large = {'cities': ['Oslo'] * 100}
+        self.assertEqual(self.serializer.dumps(small)[2], 0x10)
+        self.assertEqual(self.serializer.dumps(large)[2], 0x11)
+        self.assertEqual(self.serializer.loads(self.serializer.dumps(large)), large)
+
+    def test_falls_back_to_pickle(self):
+        """Values orjson can't represent exactly are pickled, old headerless pickles still load"""
+        value = {'when': timezone.now(), 1: 'int key'}
+        payload = self.serializer.dumps(value)
+        self.assertEqual(payload[2] >> 4, 0)
+        self.assertEqual(self.serializer.loads(payload), value)
+        self.assertEqual(self.serializer.loads(pickle.dumps(value)), value)
+
+    def test_non_finite_floats_are_pickled(self):
+        """NaN and Infinity survive the round-trip instead of coming back as None"""
+        value = {'city': 'Oslo', 'temperature': float('inf'), 'readings': [1.5, float('nan')], 'wind': None}
+        payload = self.serializer.dumps(value)
+        self.assertEqual(payload[2] >> 4, 0)
+        loaded = self.serializer.loads(payload)
+        self.assertEqual(loaded['temperature'], float('inf'))
+        self.assertTrue(math.isnan(loaded['readings'][1]))
+        self.assertEqual(self.serializer.dumps({'wind': None})[2] >> 4, 1)
+
+    def test_unknown_header_version(self):
+        with self.assertRaises(SerializerError):
+            self.serializer.loads(b'W\x09\x10{}')
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_cache_serializer', iterations=2, formats=['orjson'],
+                     compressions=['none', 'zlib'], stdout=out)
+        self.assertIn('orjson+zlib', out.getvalue())
+        self.assertIn('weather batch', out.getvalue())
+
+class RateLimitTestCase(TestCase):
+    """Test the Lua-backed rate limiter"""
+
+    def setUp(self):
+        self.identity = f"test-{uuid.uuid4().hex}"
+
+    def test_algorithms_stop_at_limit(self):
+        """Each algorithm allows exactly max_requests in a window"""
+        for algorithm in ('fixed_window', 'sliding_log', 'token_bucket'):
+            results = [
+                check_rate_limit(self.identity, max_requests=3, window_seconds=60, algorithm=algorithm)
+                for _ in range(5)
+            ]
+            self.assertEqual([r.allowed for r in results], [True, True, True, False, False], algorithm)
+            self.assertEqual(results[-1].remaining, 0, algorithm)
+            self.assertGreater(results[-1].reset_after, 0, algorithm)
+
+    def test_hybrid_limiter_local_fast_path(self):
+        """Far under the limit checks stay in memory, pending counts reach Redis on sync"""
+        limiter = HybridRateLimiter(window_seconds=60, tolerance=0.5, sync_interval=3600, workers=1)
+        key = f"rate_limit:{self.identity}"
+
+        for _ in range(4):
+            self.assertTrue(limiter.check(self.identity, max_requests=10).allowed)
+        #only the first check (unknown client) went to Redis
+        self.assertEqual(int(redis_client.get(key)), 1)
+
+        limiter.sync()
+        self.assertEqual(int(redis_client.get(key)), 4)
+
+        results = [limiter.check(self.identity, max_requests=10) for _ in range(8)]
+        self.assertEqual(sum(r.allowed for r in results), 6)
+        self.assertEqual(int(redis_client.get(key)), 10)
+
+    def test_hybrid_headroom_split_between_workers(self):
+        """Workers admitting locally at the same time can't together pass (1 - tolerance) of the limit"""
+        workers = [HybridRateLimiter(window_seconds=60, tolerance=0.2, sync_interval=3600, workers=4) for _ in range(4)]
+        for limiter in workers:
+            self.assertTrue(limiter.check(self.identity, max_requests=100).allowed)
+
+        local = [0] * len(workers)
+        with patch('weather_app.utils._registered_scripts') as mock_scripts:
+            for i, limiter in enumerate(workers):
+                while limiter._check_locally(self.identity, 100) is not None:
+                    local[i] += 1
+        mock_scripts.__getitem__.assert_not_called()
+        self.assertLessEqual(int(redis_client.get(f"rate_limit:{self.identity}")) + sum(local), 80)
+
+    @override_settings(RATE_LIMIT_ALGORITHM='sliding_log')
+    async def test_ip_limit_honours_configured_algorithm(self):
+        """With an algorithm other than fixed_window, IP checks don't go through the hybrid limiter"""
+        async_redis_client = MagicMock()
+        with patch('weather_app.utils.ip_rate_limiter.acheck') as mock_hybrid, \
+                patch('weather_app.utils.acheck_rate_limit', new_callable=AsyncMock) as mock_check:
+            await acheck_ip_rate_limit(async_redis_client, '10.0.0.1', 10)
+        mock_hybrid.assert_not_called()
+        mock_check.assert_awaited_once_with(async_redis_client, '10.0.0.1', 10, algorithm='sliding_log')
+
+    def test_headers(self):
+        """Denied results carry Retry-After next to the X-RateLimit-* headers"""
+        result = RateLimitResult(allowed=False, limit=10, used=10, reset_after=42)
+        self.assertEqual(result.headers(), {
+            'X-RateLimit-Limit': '10',
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '42',
+            'Retry-After': '42',
+        })
+
+    @patch('weather_app.utils._registered_scripts')
+    def test_fails_open_when_redis_is_down(self, mock_scripts):
+        """Requests are allowed if Redis can't be reached"""
+        mock_scripts.__getitem__.return_value.side_effect = redis.ConnectionError()
+        self.assertTrue(check_rate_limit(self.identity).allowed)
+        self.assertTrue(check_email_rate_limit(f"{self.identity}@example.com"))
+
+class WriteBufferTestCase(TestCase):
+    """Test write-behind buffering of log rows"""
+
+    def make_row(self, city='Lima'):
+        return WeatherRequest(
+            city=city, country='Peru', temperature=18, feels_like=17, description='Mist',
+            humidity=90, pressure=1012, wind_speed=2, api_response_time=0.2, request_type='random'
+        )
+
+    def test_rows_written_on_flush(self):
+        """Nothing hits the database until the buffer is flushed, then one bulk insert"""
+        buffer = WriteBuffer(WeatherRequest, max_size=100, flush_interval=None)
+        for _ in range(3):
+            buffer.add(self.make_row())
+
+        self.assertEqual(WeatherRequest.objects.count(), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(WeatherRequest.objects.count(), 3)
+
+    def test_periodic_flusher(self):
+        """Buffers are flushed by one background thread per process, and registered ones at shutdown"""
+        class Probe(flushers.PeriodicFlusher):
+            def __init__(self):
+                super().__init__(flush_interval=0.01)
+                self.flushed = threading.Event()
+
+            def flush(self):
+                self.flushed.set()
+                return 1
+
+        probe = Probe()
+        probe.ensure_flusher()
+        self.assertTrue(probe.flushed.wait(2))
+
+        with patch.object(flushers, '_registered', []):
+            flushers.register(Probe())
+            self.assertEqual(flushers.flush_registered(), 1)
+
+    def test_drop_oldest_overflow(self):
+        """When full, the oldest rows are dropped"""
+        buffer = WriteBuffer(WeatherRequest, flush_interval=None, max_pending=2, overflow='drop_oldest')
+        for city in ['A', 'B', 'C']:
+            buffer.add(self.make_row(city))
+
+        buffer.flush()
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(sorted(WeatherRequest.objects.values_list('city', flat=True)), ['B', 'C'])
+
+    def test_flush_overflow(self):
+        """With the flush policy a full buffer is written by the caller"""
+        buffer = WriteBuffer(WeatherRequest, flush_interval=None, max_pending=2, overflow='flush')
+        for city in ['A', 'B', 'C']:
+            buffer.add(self.make_row(city))
+
+        self.assertEqual(WeatherRequest.objects.count(), 2)
+        self.assertEqual(len(buffer), 1)
+
+class PopularCityCountersTestCase(TestCase):
+    """Test Redis popular city counters and the bulk flush"""
+
+    def setUp(self):
+        city_counters.redis_client.delete(
+            city_counters.COUNTS_KEY, city_counters.PENDING_KEY, city_counters.FLUSHING_KEY,
+            city_counters.COUNTRY_KEY, city_counters.LAST_REQUESTED_KEY, city_counters.SEEDED_KEY
+        )
+
+    def test_top_cities_from_counters(self):
+        """Requests are counted in Redis without touching PopularCity"""
+        for city, country in [('Lima', 'Peru'), ('Quito', 'Ecuador'), ('Lima', 'Peru')]:
+            city_counters.record_city_request(city, country)
+
+        self.assertEqual(PopularCity.objects.count(), 0)
+        self.assertEqual(WeatherService().get_popular_cities_from_cache(), [
+            {'city': 'Lima', 'country': 'Peru', 'request_count': 2},
+            {'city': 'Quito', 'country': 'Ecuador', 'request_count': 1},
+        ])
+
+    def test_flush_adds_deltas(self):
+        """The flush adds pending counts to existing rows and creates new ones"""
+        PopularCity.objects.create(city='Lima', country='Peru', request_count=10)
+        for city, country in [('Lima', 'Peru'), ('Quito', 'Ecuador'), ('Lima', 'Peru')]:
+            city_counters.record_city_request(city, country)
+
+        self.assertEqual(city_counters.flush_counts_to_database(), 2)
+        self.assertEqual(PopularCity.objects.get(city='Lima').request_count, 12)
+        self.assertEqual(PopularCity.objects.get(city='Quito').request_count, 1)
+        #already flushed, nothing to do
+        self.assertEqual(city_counters.flush_counts_to_database(), 0)
+
+    def test_flush_prunes_last_requested(self):
+        """Flushed timestamps leave the last-requested hash, ones updated since are kept"""
+        city_counters.record_city_request('Lima', 'Peru')
+        city_counters.record_city_request('Quito', 'Ecuador')
+        real_bulk_create = PopularCity.objects.bulk_create
+
+        def request_during_flush(*args, **kwargs):
+            city_counters.redis_client.hset(city_counters.LAST_REQUESTED_KEY, 'Quito', time.time() + 1)
+            return real_bulk_create(*args, **kwargs)
+
+        with patch.object(PopularCity.objects, 'bulk_create', side_effect=request_during_flush):
+            self.assertEqual(city_counters.flush_counts_to_database(), 2)
+        self.assertEqual(list(city_counters.redis_client.hkeys(city_counters.LAST_REQUESTED_KEY)), ['Quito'])
+
+    def test_top_cities_reads_only_once_seeded(self):
+        """After the first seed, reading the top list doesn't write to Redis"""
+        city_counters.top_cities()
+        with patch.object(city_counters.redis_client, 'set', side_effect=AssertionError('SET NX per read')):
+            city_counters.top_cities()
+
+    def test_seeded_from_database(self):
+        """Counts already in PopularCity are included in the top list"""
+        PopularCity.objects.create(city='Lima', country='Peru', request_count=10)
+        city_counters.redis_client.delete(city_counters.COUNTS_KEY, city_counters.COUNTRY_KEY)
+        city_counters.record_city_request('Quito', 'Ecuador')
+
+        self.assertEqual([c['request_count'] for c in city_counters.top_cities()], [10, 1])
+
+class DigestPipelineTestCase(TestCase):
+    """Test the claim-based digest pipeline"""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'digest{i}', email=f'digest{i}@example.com', password='testpass123')
+            for i in range(3)
+        ]
+
+    def make_request(self, user, location):
+        return CeleryWeatherRequest.objects.create(user=user, location=location, message_type='weather_update')
+
+    @patch('weather_app.tasks.convert_temperatures.delay')
+    def test_requests_claimed_once(self, mock_convert):
+        """Pending requests are claimed, grouped by location and passed on as ids"""
+        lima = [self.make_request(user, 'Lima').id for user in self.users[:2]]
+        quito = self.make_request(self.users[2], 'Quito').id
+
+        self.assertEqual(collect_weather_requests(), 3)
+        mock_convert.assert_called_once_with({'Lima': lima, 'Quito': [quito]})
+        self.assertFalse(CeleryWeatherRequest.objects.filter(status='pending').exists())
+
+        #the next run has nothing left to claim
+        mock_convert.reset_mock()
+        self.assertEqual(collect_weather_requests(), 0)
+        mock_convert.assert_not_called()
+
+    @override_settings(DIGEST_CHUNK_SIZE=2)
+    @patch('weather_app.tasks.convert_temperatures.delay')
+    def test_claimed_in_chunks(self, mock_convert):
+        """Large backlogs are claimed a chunk at a time"""
+        for user in self.users:
+            self.make_request(user, 'Lima')
+
+        self.assertEqual(collect_weather_requests(), 3)
+        self.assertEqual([len(call.args[0]['Lima']) for call in mock_convert.call_args_list], [2, 1])
+
+    @patch('weather_app.tasks.send_message_batch.apply_async')
+    def test_format_batch(self, mock_send):
+        """One formatting task queues messages for the whole batch and one send task"""
+        request_ids = [self.make_request(user, 'Lima').id for user in self.users]
+
+        format_messages(request_ids, 'Lima', 18.0, 1.0, 'normal')
+
+        messages = EmailMessage.objects.filter(location='Lima', delivery_status='queued')
+        self.assertEqual(messages.count(), 3)
+        self.assertIn('18.0', messages.first().body)
+        self.assertEqual(CeleryWeatherRequest.objects.filter(status='completed').count(), 3)
+        mock_send.assert_called_once()
+        self.assertEqual(sorted(mock_send.call_args.kwargs['args'][0]), sorted(messages.values_list('id', flat=True)))
+
+    @patch('weather_app.tasks.convert_temperatures')
+    def test_legacy_convert_temperature_payload(self, mock_convert):
+        """Request dicts queued by the previous release are claimed and converted by id"""
+        pending = self.make_request(self.users[0], 'Lima')
+        taken = self.make_request(self.users[1], 'Lima')
+        CeleryWeatherRequest.objects.filter(id=taken.id).update(status='processing')
+
+        convert_temperature('Lima', list(CeleryWeatherRequest.objects.filter(location='Lima').values()))
+
+        mock_convert.assert_called_once_with({'Lima': [pending.id]})
+        self.assertEqual(CeleryWeatherRequest.objects.get(id=pending.id).status, 'processing')
+
+    @patch('weather_app.tasks.send_message_batch.apply_async')
+    def test_legacy_format_message(self, mock_send):
+        """format_message tasks queued by the previous release go through the batch path"""
+        format_message(self.users[0].id, 'Lima', 18.0, 6.0, 'high')
+        format_message(-1, 'Lima', 18.0, 6.0, 'high')
+
+        message = EmailMessage.objects.get(user=self.users[0])
+        self.assertEqual((message.message_type, message.delivery_status), ('temp_alert', 'queued'))
+        mock_send.assert_called_once_with(args=[[message.id]], queue='priority_sending')
+
+@patch('weather_app.views.current_app')
+class DashboardStatsTestCase(TestCase):
+    """Test the dashboard stats snapshot"""
+
+    def setUp(self):
+        redis_client.delete(DASHBOARD_SNAPSHOT_KEY, CELERY_INSPECT_KEY)
+        self.user = User.objects.create_user(username='dash', email='dash@example.com', password='testpass123')
+        for status in ['sent', 'sent', 'failed', 'queued']:
+            EmailMessage.objects.create(user=self.user, message_type='weather_update', temperature=20,
+                                        location='Lima', delivery_status=status)
+
+    def test_status_counts_single_query(self, mock_app):
+        """All delivery status counts come from one aggregate query"""
+        with self.assertNumQueries(1):
+            counts = get_message_status_counts(timezone.now().date())
+        self.assertEqual(counts, {'messages_sent': 2, 'messages_delivered': 0,
+                                  'messages_failed': 1, 'messages_queued': 1})
+
+    def test_snapshot_served_with_etag(self, mock_app):
+        """The API serves the stored snapshot and answers 304 when it hasn't changed"""
+        store_dashboard_snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/dashboard-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['messages_sent'], 2)
+
+        response = self.client.get('/api/dashboard-stats/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_snapshot_version_tracks_content(self, mock_app):
+        """Rebuilding without changes keeps the version, new data changes it"""
+        version, _ = store_dashboard_snapshot()
+        self.assertEqual(store_dashboard_snapshot()[0], version)
+
+        EmailMessage.objects.create(user=self.user, message_type='weather_update', temperature=20,
+                                    location='Lima', delivery_status='sent')
+        self.assertNotEqual(store_dashboard_snapshot()[0], version)
+
+    def test_worker_data_from_stored_inspection(self, mock_app):
+        """Dashboard helpers read the collector's sweep and never broadcast themselves"""
+        inspect = mock_app.control.inspect.return_value
+        inspect.ping.return_value = {'celery@web1': {'ok': 'pong'}}
+        inspect.active.return_value = {'celery@web1': [{'id': 't1'}]}
+        inspect.reserved.return_value = {'celery@web1': [{'delivery_info': {'routing_key': 'digest'}}]}
+        inspect.scheduled.return_value = {}
+        inspect.stats.return_value = {'celery@web1': {'pool': {'implementation': 'prefork'}}}
+        store_celery_inspection()
+        mock_app.reset_mock()
+
+        stats = build_dashboard_stats()
+        mock_app.control.inspect.assert_not_called()
+        self.assertEqual(stats['active_workers'], 1)
+        self.assertEqual(stats['worker_details'][0]['name'], 'web1')
+        self.assertEqual(stats['queue_stats']['digest_queue'], 1)
+        self.assertEqual(stats['system_health']['rabbitmq'], 'Connected')
+
+    def test_no_inspection_yet(self, mock_app):
+        """Without a stored sweep worker data is Unknown rather than fetched inline"""
+        stats = build_dashboard_stats()
+        mock_app.control.inspect.assert_not_called()
+        self.assertEqual(stats['active_workers'], 0)
+        self.assertEqual(stats['system_health']['celery_workers'], 'Unknown')
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked against PostgreSQL')
+class QueryPlanTestCase(TestCase):
+    """Test the dashboard and digest hot paths use their indexes"""
+
+    ROWS = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        #a couple of months of mostly sent mail and completed requests, with few rows in the hot states
+        user = User.objects.create_user(username='plans', password='testpass123')
+        EmailMessage.objects.bulk_create([
+            EmailMessage(
+                user=user, message_type='weather_update', temperature=20, location='Lima',
+                delivery_status='queued' if i % 400 == 0 else 'failed' if i % 400 == 1 else 'sent',
+                retry_count=3 if i % 400 == 1 else 0
+            )
+            for i in range(cls.ROWS)
+        ], batch_size=5000)
+        CeleryWeatherRequest.objects.bulk_create([
+            CeleryWeatherRequest(user=user, location='Lima', message_type='weather_update',
+                                 status='pending' if i % 400 == 0 else 'completed')
+            for i in range(cls.ROWS)
+        ], batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {EmailMessage._meta.db_table} SET timestamp = timestamp - (id % 60) * interval '1 day'"
+            )
+            cursor.execute(f"ANALYZE {EmailMessage._meta.db_table}")
+            cursor.execute(f"ANALYZE {CeleryWeatherRequest._meta.db_table}")
+
+    def index_names(self, index):
+        """The index plus, on a partitioned table, its per-partition copies"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relid::regclass::text FROM pg_partition_tree(%s::regclass)", [index])
+            return {index} | {name.split('.')[-1].strip('"') for name, in cursor.fetchall()}
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in self.index_names(index)), f"{index} not used:\n{plan}")
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_message_status_counts(self):
+        start, end = get_day_range(timezone.now().date() - timedelta(days=30))
+        self.assertUsesIndex(
+            EmailMessage.objects.filter(timestamp__gte=start, timestamp__lt=end).values('delivery_status'),
+            'email_timestamp_status_idx'
+        )
+
+    def test_dead_letter_messages(self):
+        self.assertUsesIndex(
+            EmailMessage.objects.filter(delivery_status='failed', retry_count__gte=3).order_by('-timestamp')[:10],
+            'email_dead_letter_idx'
+        )
+
+    def test_queued_messages(self):
+        self.assertUsesIndex(
+            EmailMessage.objects.filter(delivery_status='queued').order_by('id').values_list('id', flat=True)[:100],
+            'email_queued_idx'
+        )
+
+    def test_pending_requests(self):
+        self.assertUsesIndex(
+            CeleryWeatherRequest.objects.filter(status='pending').order_by('id').values_list('id', 'location')[:500],
+            'celery_req_pending_idx'
+        )
+
+class RetentionTestCase(TestCase):
+    """Test chunked deletes of old log rows"""
+
+    def make_request(self, days_old):
+        return WeatherRequest.objects.create(
+            city='Lima', country='Peru', temperature=18, feels_like=17, description='Mist', humidity=90,
+            pressure=1012, wind_speed=2, api_response_time=0.2, requested_at=timezone.now() - timedelta(days=days_old)
+        )
+
+    def test_delete_in_chunks(self):
+        """Old rows are deleted a chunk at a time, newer rows are kept"""
+        for days_old in [40, 50, 60, 1]:
+            self.make_request(days_old)
+
+        progress = []
+        deleted = delete_in_chunks(WeatherRequest._meta.db_table, 'requested_at',
+                                   timezone.now() - timedelta(days=30), chunk_size=2, progress=progress.append)
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual(WeatherRequest.objects.count(), 1)
+
+    def test_clear_old_data_covers_every_log_table(self):
+        """--clear-old-data removes old weather requests, activity and email messages"""
+        user = User.objects.create_user(username='retention', email='retention@example.com', password='testpass123')
+        old = timezone.now() - timedelta(days=60)
+        for days_old in [60, 1]:
+            self.make_request(days_old)
+            UserActivity.objects.create(session_key='s', ip_address='127.0.0.1', user_agent='test', action='search')
+            EmailMessage.objects.create(user=user, message_type='weather_update', temperature=20,
+                                        location='Lima', delivery_status='sent')
+        UserActivity.objects.filter(id=UserActivity.objects.earliest('id').id).update(timestamp=old)
+        EmailMessage.objects.filter(id=EmailMessage.objects.earliest('id').id).update(timestamp=old)
+
+        call_command('manage_cache', clear_old_data=30, stdout=io.StringIO())
+
+        self.assertEqual(WeatherRequest.objects.count(), 1)
+        self.assertEqual(UserActivity.objects.count(), 1)
+        self.assertEqual(EmailMessage.objects.count(), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'partitioning is PostgreSQL only')
+    def test_drop_old_partitions(self):
+        """Whole months older than the cutoff are dropped as partitions"""
+        table = WeatherRequest._meta.db_table
+        self.assertTrue(is_partitioned(table))
+        ensure_partitions(1)
+
+        old_month = month_start(timezone.now() - timedelta(days=400))
+        with connection.cursor() as cursor:
+            create_month_partition(cursor, table, old_month)
+        self.make_request(400)
+        recent = self.make_request(1)
+
+        removed = drop_partitions_before(table, timezone.now() - timedelta(days=100))
+        self.assertIn(partition_name(table, old_month), removed)
+        self.assertEqual(list(WeatherRequest.objects.values_list('id', flat=True)), [recent.id])
+
+    @skipUnless(connection.vendor == 'postgresql', 'partitioning is PostgreSQL only')
+    def test_failed_drop_keeps_partition_attached(self):
+        """A partition that can't be dropped stays attached, its rows still visible"""
+        table = WeatherRequest._meta.db_table
+        old_month = month_start(timezone.now() - timedelta(days=400))
+        old_partition = partition_name(table, old_month)
+        with connection.cursor() as cursor:
+            create_month_partition(cursor, table, old_month)
+            #a dependent view makes DROP TABLE fail
+            cursor.execute(f'CREATE VIEW "{old_partition}_view" AS SELECT * FROM "{old_partition}"')
+        old = self.make_request(400)
+
+        with self.assertRaises(DatabaseError):
+            drop_partitions_before(table, timezone.now() - timedelta(days=100))
+        self.assertTrue(WeatherRequest.objects.filter(id=old.id).exists())
+
+class RollupTestCase(TestCase):
+    """Test incremental analytics rollups"""
+
+    def make_request(self, city, response_time, request_type='random'):
+        return WeatherRequest.objects.create(
+            city=city, country='Peru', temperature=18, feels_like=17, description='Mist', humidity=90,
+            pressure=1012, wind_speed=2, api_response_time=response_time, request_type=request_type
+        )
+
+    def test_rollups_are_incremental(self):
+        """Only rows past the watermark are merged, totals add up across runs"""
+        self.make_request('Lima', 0.2)
+        self.make_request('Lima', 0.4, 'default')
+        self.assertEqual(update_rollups()['weather_requests'], 2)
+
+        self.make_request('Lima', 4.0)
+        self.assertEqual(update_rollups()['weather_requests'], 1)
+        self.assertEqual(update_rollups()['weather_requests'], 0)
+
+        hourly = WeatherRollup.objects.get(period='hour', city='Lima')
+        self.assertEqual(hourly.count, 3)
+        self.assertAlmostEqual(hourly.avg_response_time, 4.6 / 3)
+        self.assertEqual(hourly.request_types, {'random': 2, 'default': 1})
+        self.assertEqual(WeatherRollup.objects.get(period='day', city='Lima').count, 3)
+
+    def test_rows_committed_out_of_id_order(self):
+        """Ids the watermark skipped (not committed yet) are rolled up once their rows commit"""
+        first, late, last = (self.make_request('Lima', 0.2) for _ in range(3))
+        late_id = late.id
+        late.delete()  # stands in for a write buffer flush still in its transaction
+        self.assertEqual(update_rollups()['weather_requests'], 2)
+        self.assertEqual(RollupWatermark.objects.get(name='weather_request').last_id, last.id)
+
+        late.id = late_id
+        late.save(force_insert=True)
+        self.assertEqual(update_rollups()['weather_requests'], 1)
+        self.assertEqual(update_rollups()['weather_requests'], 0)
+        self.assertEqual(WeatherRollup.objects.get(period='hour', city='Lima').count, 3)
+        self.assertEqual(RollupWatermark.objects.get(name='weather_request').gaps, [])
+
+    def test_rolled_back_ids_expire(self):
+        """Gaps that never fill (rolled back inserts) stop being re-checked after ROLLUP_GAP_TIMEOUT"""
+        self.make_request('Lima', 0.2)
+        self.make_request('Lima', 0.2).delete()
+        self.make_request('Lima', 0.2)
+        update_rollups()
+        self.assertEqual(len(RollupWatermark.objects.get(name='weather_request').gaps), 1)
+
+        with patch('weather_app.rollups.time.time', return_value=time.time() + settings.ROLLUP_GAP_TIMEOUT):
+            update_rollups()
+        self.assertEqual(RollupWatermark.objects.get(name='weather_request').gaps, [])
+
+    def test_summary_from_rollups(self):
+        """Summaries read the rollups, not the raw table"""
+        for response_time in [0.1] * 9 + [4.0]:
+            self.make_request('Quito', response_time)
+        UserActivity.objects.create(session_key='s', ip_address='127.0.0.1', user_agent='test',
+                                    action='page_load', response_time=0.3)
+        update_rollups()
+
+        with self.assertNumQueries(1):
+            summary = weather_summary(hours=24)
+        self.assertEqual(summary['requests'], 10)
+        self.assertEqual(summary['p50_response_time'], 0.1)
+        self.assertEqual(summary['p95_response_time'], 5.0)
+        self.assertEqual(summary['top_cities'][0]['city'], 'Quito')
+        self.assertEqual(activity_summary(hours=24), {'page_load': 1})
+
+    def test_overflow_percentile_uses_recorded_max(self):
+        """Latencies past the last bucket are reported as the slowest one seen, not the bucket bound"""
+        for response_time in [0.1] * 8 + [12.5, 30.0]:
+            self.make_request('Quito', response_time)
+        update_rollups()
+
+        summary = weather_summary(hours=24)
+        self.assertEqual(summary['p95_response_time'], 30.0)
+        self.assertEqual(summary['max_response_time'], 30.0)
+        self.assertIsNone(percentile([0] * len(LATENCY_BUCKETS) + [1], 0.95))
+
+class ExportTestCase(TestCase):
+    """Test streaming CSV/NDJSON exports"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        for city, request_type in [('London', 'default'), ('Paris', 'random'), ('London', 'search')]:
+            WeatherRequest.objects.create(
+                city=city, country='UK', temperature=10, feels_like=9, description='Cloudy', humidity=80,
+                pressure=1010, wind_speed=4, api_response_time=0.2, request_type=request_type
+            )
+        UserActivity.objects.create(session_key='s', ip_address='127.0.0.1', user_agent='test',
+                                    action='search', city_requested='London', response_time=0.1)
+
+    def test_export_requires_staff(self):
+        """Anonymous users get 401, non-staff 403"""
+        url = '/api/export/weather/'
+        self.assertEqual(self.client.get(url).status_code, 401)
+        User.objects.create_user('plain', password='pw')
+        self.client.login(username='plain', password='pw')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_csv_export_streams(self):
+        self.client.login(username='staff', password='pw')
+        response = self.client.get('/api/export/weather/', {'city': 'london'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('weather_export.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['request_type'] for row in rows], ['default', 'search'])
+
+    def test_ndjson_gzip_export(self):
+        self.client.login(username='staff', password='pw')
+        response = self.client.get(
+            '/api/export/activity/', {'format': 'ndjson', 'gzip': '1', 'action': 'search'}
+        )
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['city_requested'] for line in lines], ['London'])
+
+    def test_bad_filters_are_rejected(self):
+        self.client.login(username='staff', password='pw')
+        url = '/api/export/weather/'
+        self.assertEqual(self.client.get(url, {'start': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/users/').status_code, 400)
+
+    async def test_asgi_export_streams_asynchronously(self):
+        """Under ASGI the export is an async iterator, not read into memory up front"""
+        client = AsyncClient()
+        await client.aforce_login(await User.objects.aget(username='staff'))
+        response = await client.get('/api/export/weather/')
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), 4)
+
+    def test_export_command(self):
+        today = timezone.now().date().isoformat()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'weather.ndjson')
+            call_command('export_data', 'weather', format='ndjson', request_type='random',
+                         start=today, end=today, output=path, stderr=io.StringIO())
+            with open(path) as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([row['city'] for row in rows], ['Paris'])
+
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'weather', start='not-a-date', stdout=io.StringIO())
+
 class EmailClientTestCase(TestCase):
     def test_email_api_initialization(self):
         """Test EmailAPI can be initialized"""
@@ -92,6 +1544,95 @@ class EmailClientTestCase(TestCase):
         mock_send_mail.assert_called_once()
         self.assertTrue(result['success'])
 
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_batch_sending(self):
+        """A batch is sent over one connection with a result per message"""
+        api = EmailAPI()
+        with patch('weather_app.email_client.get_connection', wraps=get_connection) as mock_connection:
+            results = api.send_batch([
+                ('one@example.com', 'First', 'Subject 1'),
+                ('two@example.com', 'Second', 'Subject 2'),
+            ])
+
+        mock_connection.assert_called_once()
+        self.assertEqual([r['success'] for r in results], [True, True])
+        self.assertEqual([m.to for m in mail.outbox], [['one@example.com'], ['two@example.com']])
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    @patch('weather_app.tasks.check_email_rate_limit', return_value=True)
+    def test_send_message_batch_drains_queue(self, mock_rate_limit):
+        """send_message_batch sends queued messages and reports failures per message"""
+        user = User.objects.create_user(username='batch', email='batch@example.com', password='testpass123')
+        for body in ['ok', 'bad']:
+            EmailMessage.objects.create(user=user, message_type='weather_update', temperature=20,
+                                        location='Lima', delivery_status='queued', body=body)
+
+        real_send = mail.backends.locmem.EmailBackend.send_messages
+        def send_messages(backend, messages):
+            if messages[0].body == 'bad':
+                raise ConnectionError('rejected')
+            return real_send(backend, messages)
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_messages):
+            result = send_message_batch()
+
+        self.assertEqual(result, {'sent': 1, 'deferred': 0, 'failed': 1})
+        bad = EmailMessage.objects.get(body='bad')
+        self.assertEqual((bad.delivery_status, bad.retry_count), ('queued', 1))
+        self.assertEqual(EmailMessage.objects.get(body='ok').delivery_status, 'sent')
+
+    @patch('weather_app.tasks.check_email_rate_limit', return_value=True)
+    def test_send_message_batch_keeps_claim_when_interrupted(self, mock_rate_limit):
+        """A batch interrupted mid-send leaves its messages claimed, not queued for a second send"""
+        user = User.objects.create_user(username='claimed', email='claimed@example.com', password='testpass123')
+        msg = EmailMessage.objects.create(user=user, message_type='weather_update', temperature=20,
+                                          location='Lima', delivery_status='queued', body='hi')
+
+        with patch('weather_app.tasks.email_api.send_batch', side_effect=TimeoutError):
+            with self.assertRaises(TimeoutError):
+                send_message_batch()
+
+        msg.refresh_from_db()
+        self.assertEqual(msg.delivery_status, 'sending')
+        self.assertIsNotNone(msg.claimed_at)
+        with patch('weather_app.tasks.email_api.send_batch') as mock_send:
+            self.assertEqual(send_message_batch(), {'sent': 0, 'deferred': 0, 'failed': 0})
+        mock_send.assert_not_called()
+
+    @patch('weather_app.tasks.check_email_rate_limit', return_value=True)
+    def test_send_message_batch_releases_stale_claims(self, mock_rate_limit):
+        """Claims older than EMAIL_SEND_CLAIM_TIMEOUT go back to queued and are sent"""
+        user = User.objects.create_user(username='stale', email='stale@example.com', password='testpass123')
+        msg = EmailMessage.objects.create(user=user, message_type='weather_update', temperature=20,
+                                          location='Lima', delivery_status='sending', body='hi')
+        EmailMessage.objects.filter(id=msg.id).update(
+            claimed_at=timezone.now() - timedelta(seconds=settings.EMAIL_SEND_CLAIM_TIMEOUT + 1)
+        )
+
+        with patch('weather_app.tasks.email_api.send_batch', return_value=[{'success': True, 'messages': [{'id': 'm1'}]}]):
+            self.assertEqual(send_message_batch(), {'sent': 1, 'deferred': 0, 'failed': 0})
+
+        msg.refresh_from_db()
+        self.assertEqual((msg.delivery_status, msg.email_message_id, msg.claimed_at), ('sent', 'm1', None))
+
+    @patch('weather_app.tasks.send_to_dead_letter.delay')
+    @patch('weather_app.tasks.check_email_rate_limit', return_value=True)
+    def test_send_message_batch_dead_letters_on_commit(self, mock_rate_limit, mock_dead_letter):
+        """Messages out of retries are dead-lettered only once their status is committed"""
+        user = User.objects.create_user(username='dead', email='dead@example.com', password='testpass123')
+        EmailMessage.objects.create(user=user, message_type='weather_update', temperature=20, location='Lima',
+                                    delivery_status='queued', retry_count=3, body='hi')
+
+        with patch('weather_app.tasks.email_api.send_batch', return_value=[{'success': False, 'error': 'rejected'}]):
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                send_message_batch()
+            mock_dead_letter.assert_not_called()
+            for callback in callbacks:
+                callback()
+
+        mock_dead_letter.assert_called_once_with('dead@example.com', 'hi', user.id, 'rejected')
+        self.assertEqual(EmailMessage.objects.get(body='hi').delivery_status, 'failed')
+
 class ModelTestCase(TestCase):
     """Test models work correctly"""
     
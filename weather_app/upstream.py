@@ -0,0 +1,249 @@
+# weather_app/upstream.py
+# Protection around WeatherAPI calls
+#
+# The circuit breaker state lives in Redis so every web and Celery process
+# sees the same picture: once enough calls fail within a window the circuit
+# opens and callers fail fast (and fall back to the last-known-good value)
+# instead of each holding a thread until its own timeout. After a cooldown
+# one process is let through as a probe; its result closes or reopens it.
+#
+# Read timeouts follow a high percentile of recently observed latencies, so
+# a healthy upstream gets tight timeouts and a slow one doesn't trip them.
+#
+# Bulk calls (up to WEATHER_BULK_BATCH_SIZE locations each) are much slower
+# than single lookups, so they have their own breaker: their own latency
+# samples and read timeout, and their failures don't open the circuit for
+# single lookups.
+
+import threading
+import time
+import httpx
+import redis
+import requests
+from redis.commands.core import AsyncScript
+from django.conf import settings
+from .redis_clients import get_redis
+
+redis_client = get_redis('cache')
+
+# KEYS open, tripped, probe | ARGV probe_ttl_ms -> 0 rejected, 1 allowed, 2 allowed as the half-open probe
+ALLOW_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 1
+end
+if redis.call('SET', KEYS[3], '1', 'NX', 'PX', ARGV[1]) then
+    return 2
+end
+return 0
+"""
+
+# KEYS failures, open, tripped, probe | ARGV window_ms, threshold, cooldown_ms, is_probe -> 1 if the circuit opened
+FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if failures == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+if ARGV[4] == '1' or failures >= tonumber(ARGV[2]) then
+    redis.call('SET', KEYS[2], '1', 'PX', ARGV[3])
+    redis.call('SET', KEYS[3], '1')
+    redis.call('DEL', KEYS[1], KEYS[4])
+    return 1
+end
+return 0
+"""
+
+_allow_script = redis_client.register_script(ALLOW_SCRIPT)
+_failure_script = redis_client.register_script(FAILURE_SCRIPT)
+#async clients are per event loop, so these are called with client=
+_async_allow_script = AsyncScript(redis_client, ALLOW_SCRIPT)
+_async_failure_script = AsyncScript(redis_client, FAILURE_SCRIPT)
+
+
+class UpstreamUnavailable(Exception):
+    """WeatherAPI was not called: the circuit is open or the city failed moments ago"""
+
+
+def is_upstream_failure(exc):
+    """
+    True for errors that say WeatherAPI itself is unhealthy (timeouts, connection
+    errors, 5xx and 429), False for errors about the request such as an unknown city
+    """
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 500
+        return status >= 500 or status == 429
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(exc, (requests.exceptions.RequestException, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Redis-backed circuit breaker with latency-derived timeouts
+
+    closed    - calls go through, upstream failures are counted per window
+    open      - calls are rejected with UpstreamUnavailable until the cooldown ends
+    half-open - after the cooldown one caller probes, the rest are still rejected
+
+    Redis errors fail open: without Redis the breaker just lets calls through.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        prefix = f"circuit:{name}"
+        self.failures_key = f"{prefix}:failures"
+        self.open_key = f"{prefix}:open"
+        self.tripped_key = f"{prefix}:tripped"
+        self.probe_key = f"{prefix}:probe"
+        self.latency_key = f"{prefix}:latencies"
+        self._lock = threading.Lock()
+        self._read_timeout = None
+        self._read_timeout_at = 0
+
+    def _probe_ttl_ms(self):
+        return int((settings.WEATHER_CONNECT_TIMEOUT + settings.WEATHER_READ_TIMEOUT_MAX) * 1000) + 1000
+
+    def _failure_args(self, probe):
+        return [
+            int(settings.WEATHER_CIRCUIT_FAILURE_WINDOW * 1000),
+            settings.WEATHER_CIRCUIT_FAILURE_THRESHOLD,
+            int(settings.WEATHER_CIRCUIT_COOLDOWN * 1000),
+            1 if probe else 0,
+        ]
+
+    def _success_commands(self, pipe, latency, probe):
+        pipe.lpush(self.latency_key, round(latency, 4))
+        pipe.ltrim(self.latency_key, 0, settings.WEATHER_LATENCY_SAMPLES - 1)
+        if probe:
+            pipe.delete(self.tripped_key, self.probe_key, self.failures_key)
+
+    def _state(self, is_open, tripped):
+        if is_open:
+            return 'open'
+        return 'half_open' if tripped else 'closed'
+
+    # SYNC
+
+    def before_call(self):
+        """
+        Ask to call upstream, raises UpstreamUnavailable while the circuit is open
+        Returns True when this call is the half-open probe (pass it to record_*)
+        """
+        try:
+            allowed = _allow_script(
+                keys=[self.open_key, self.tripped_key, self.probe_key], args=[self._probe_ttl_ms()]
+            )
+        except redis.RedisError:
+            return False
+        if not allowed:
+            raise UpstreamUnavailable(f"{self.name} circuit is open")
+        return allowed == 2
+
+    def record_success(self, latency, probe=False):
+        """Store a latency sample, and close the circuit if this was the probe"""
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            self._success_commands(pipe, latency, probe)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def record_failure(self, probe=False):
+        """Count an upstream failure, returns True if it opened the circuit"""
+        try:
+            return bool(_failure_script(
+                keys=[self.failures_key, self.open_key, self.tripped_key, self.probe_key],
+                args=self._failure_args(probe)
+            ))
+        except redis.RedisError:
+            return False
+
+    def read_timeout(self):
+        """Read timeout from recent latencies, recomputed at most every WEATHER_TIMEOUT_REFRESH seconds"""
+        if time.time() < self._read_timeout_at:
+            return self._read_timeout
+        try:
+            samples = redis_client.lrange(self.latency_key, 0, -1)
+        except redis.RedisError:
+            samples = []
+        return self._store_read_timeout(samples)
+
+    def timeouts(self, cap=None):
+        """(connect, read) timeouts for requests, read capped at cap (e.g. a batch deadline)"""
+        read = self.read_timeout()
+        return settings.WEATHER_CONNECT_TIMEOUT, min(read, cap) if cap else read
+
+    def state(self):
+        """'closed', 'open' or 'half_open'"""
+        try:
+            return self._state(*redis_client.mget(self.open_key, self.tripped_key))
+        except redis.RedisError:
+            return 'unknown'
+
+    # ASYNC (the async redis client is bound to the caller's event loop, so it's passed in)
+
+    async def abefore_call(self, async_redis_client):
+        """Async before_call"""
+        try:
+            allowed = await _async_allow_script(
+                keys=[self.open_key, self.tripped_key, self.probe_key], args=[self._probe_ttl_ms()],
+                client=async_redis_client
+            )
+        except redis.RedisError:
+            return False
+        if not allowed:
+            raise UpstreamUnavailable(f"{self.name} circuit is open")
+        return allowed == 2
+
+    async def arecord_success(self, async_redis_client, latency, probe=False):
+        """Async record_success"""
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            self._success_commands(pipe, latency, probe)
+            await pipe.execute()
+        except redis.RedisError:
+            pass
+
+    async def arecord_failure(self, async_redis_client, probe=False):
+        """Async record_failure"""
+        try:
+            return bool(await _async_failure_script(
+                keys=[self.failures_key, self.open_key, self.tripped_key, self.probe_key],
+                args=self._failure_args(probe), client=async_redis_client
+            ))
+        except redis.RedisError:
+            return False
+
+    async def atimeouts(self, async_redis_client, cap=None):
+        """httpx.Timeout for an async call, same rules as timeouts()"""
+        read = self._read_timeout
+        if time.time() >= self._read_timeout_at:
+            try:
+                samples = await async_redis_client.lrange(self.latency_key, 0, -1)
+            except redis.RedisError:
+                samples = []
+            read = self._store_read_timeout(samples)
+        return httpx.Timeout(min(read, cap) if cap else read, connect=settings.WEATHER_CONNECT_TIMEOUT)
+
+    def _store_read_timeout(self, samples):
+        """p99 of the samples times WEATHER_READ_TIMEOUT_FACTOR, clamped; the max with too few samples"""
+        latencies = sorted(float(sample) for sample in samples)
+        if len(latencies) < 10:
+            read = settings.WEATHER_READ_TIMEOUT_MAX
+        else:
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            read = min(
+                settings.WEATHER_READ_TIMEOUT_MAX,
+                max(settings.WEATHER_READ_TIMEOUT_MIN, p99 * settings.WEATHER_READ_TIMEOUT_FACTOR)
+            )
+        with self._lock:
+            self._read_timeout = read
+            self._read_timeout_at = time.time() + settings.WEATHER_TIMEOUT_REFRESH
+        return read
+
+
+weather_breaker = CircuitBreaker('weatherapi')
+weather_bulk_breaker = CircuitBreaker('weatherapi_bulk')
@@ -13,5 +13,7 @@ urlpatterns = [
     #dashborad endpoints
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('api/dashboard-stats/', views.dashboard_stats_api, name='dashboard_stats'),
+    #data export (staff only): /api/export/weather/ or /api/export/activity/
+    path('api/export/<str:kind>/', views.export_data, name='export_data'),
 ]
 
@@ -1,56 +1,405 @@
 # weather_app/utils.py
+# Rate limiting for IPs (views) and email addresses (tasks)
+#
+# Every check is one Lua script call, so the read-modify-write happens atomically
+# inside Redis in a single round-trip. Three algorithms are available:
+#   fixed_window  - counter that resets every window (cheapest)
+#   sliding_log   - sorted set of request timestamps, exact over any window
+#   token_bucket  - bucket of `max_requests` tokens refilled evenly over the window
+
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from typing import NamedTuple
 import redis
+from redis.commands.core import AsyncScript
 from django.conf import settings
+from .redis_clients import get_redis
+
+logger = logging.getLogger(__name__)
+
+redis_client = get_redis('ratelimit')
+
+# KEYS[1] counter | ARGV limit, window_ms, [already admitted locally] -> {allowed, used, reset_ms}
+FIXED_WINDOW_SCRIPT = """
+local pending = tonumber(ARGV[3] or '0')
+if pending > 0 then
+    if redis.call('INCRBY', KEYS[1], pending) == pending then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+end
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+local limit = tonumber(ARGV[1])
+if used >= limit then
+    return {0, used, redis.call('PTTL', KEYS[1])}
+end
+used = redis.call('INCR', KEYS[1])
+if used == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return {1, used, redis.call('PTTL', KEYS[1])}
+"""
+
+# KEYS[1] sorted set | ARGV limit, window_ms, now_ms, member -> {allowed, used, reset_ms}
+SLIDING_LOG_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local used = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if used < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], window)
+    used = used + 1
+    allowed = 1
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+local reset = 0
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window - now
+end
+return {allowed, used, reset}
+"""
+
+# KEYS[1] hash | ARGV capacity, window_ms, now_ms -> {allowed, used, reset_ms}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local rate = capacity / window
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], window)
+local reset = 0
+if tokens < 1 then
+    reset = math.ceil((1 - tokens) / rate)
+end
+return {allowed, capacity - math.floor(tokens), reset}
+"""
+
+# KEYS counters | ARGV window_ms, increment per key -> {used, reset_ms, used, reset_ms, ...}
+RECONCILE_SCRIPT = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    local increment = tonumber(ARGV[i + 1])
+    local used = redis.call('INCRBY', key, increment)
+    if used == increment then
+        redis.call('PEXPIRE', key, ARGV[1])
+    end
+    table.insert(result, used)
+    table.insert(result, redis.call('PTTL', key))
+end
+return result
+"""
+
+RATE_LIMIT_SCRIPTS = {
+    'fixed_window': FIXED_WINDOW_SCRIPT,
+    'sliding_log': SLIDING_LOG_SCRIPT,
+    'token_bucket': TOKEN_BUCKET_SCRIPT,
+}
+
+# Scripts are sent once and then called by SHA (register_script falls back to EVAL on NOSCRIPT)
+_registered_scripts = {
+    algorithm: redis_client.register_script(script)
+    for algorithm, script in RATE_LIMIT_SCRIPTS.items()
+}
+_reconcile_script = redis_client.register_script(RECONCILE_SCRIPT)
+#async clients are per event loop, so these are called with client=
+_async_scripts = {
+    algorithm: AsyncScript(redis_client, script)
+    for algorithm, script in RATE_LIMIT_SCRIPTS.items()
+}
+_async_reconcile_script = AsyncScript(redis_client, RECONCILE_SCRIPT)
+
+
+class RateLimitResult(NamedTuple):
+    """Outcome of one rate limit check"""
+    allowed: bool
+    limit: int
+    used: int
+    reset_after: int  # seconds until the client gets capacity back
+
+    @property
+    def remaining(self):
+        return max(0, self.limit - self.used)
+
+    def headers(self):
+        """Standard X-RateLimit-* response headers (plus Retry-After when denied)"""
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset_after),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.reset_after)
+        return headers
+
+
+def _script_args(identity, max_requests, window_seconds, algorithm, prefix):
+    """Build (keys, args) for one of the rate limit scripts"""
+    if algorithm not in RATE_LIMIT_SCRIPTS:
+        raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+
+    window_ms = int(window_seconds * 1000)
+    if algorithm == 'fixed_window':
+        # same key the original counter used
+        return [f"{prefix}:{identity}"], [max_requests, window_ms]
 
-redis_client = redis.Redis(
-    host=settings.REDIS_HOST, 
-    port=settings.REDIS_PORT, 
-    db=settings.REDIS_DB,
-    decode_responses=True
-)
+    now_ms = int(time.time() * 1000)
+    if algorithm == 'sliding_log':
+        return [f"{prefix}:log:{identity}"], [max_requests, window_ms, now_ms, f"{now_ms}-{uuid.uuid4().hex[:8]}"]
+    return [f"{prefix}:bucket:{identity}"], [max_requests, window_ms, now_ms]
 
-# ORIGINAL function for views.py (IP rate limiting)
-def check_rate_limit(ip_address, max_requests=100, window_minutes=1):
+
+def _to_result(response, max_requests):
+    allowed, used, reset_ms = response
+    return RateLimitResult(
+        allowed=bool(allowed),
+        limit=max_requests,
+        used=int(used),
+        reset_after=max(0, -(-int(reset_ms) // 1000)),  # round up to whole seconds
+    )
+
+
+def check_rate_limit(identity, max_requests=100, window_seconds=60, algorithm=None, prefix='rate_limit'):
     """
-    Check if IP address has exceeded rate limit
-    Returns (allowed: bool, requests_made: int, time_until_reset: int)
+    Check and count one request for identity (an IP address, email, ...)
+    Returns a RateLimitResult. If Redis is down the request is allowed.
     """
-    key = f"rate_limit:{ip_address}"
-    window_seconds = window_minutes * 60
+    algorithm = algorithm or settings.RATE_LIMIT_ALGORITHM
+    keys, args = _script_args(identity, max_requests, window_seconds, algorithm, prefix)
 
     try:
-        current_requests = redis_client.get(key)
-
-        if current_requests is None:
-            redis_client.setex(key, window_seconds, 1)
-            return True, 1, 0
-       
-        current_requests = int(current_requests)
-
-        if current_requests >= max_requests:
-            ttl = redis_client.ttl(key)
-            return False, current_requests, ttl
-       
-        redis_client.incr(key)
-        return True, current_requests + 1, 0
-   
+        return _to_result(_registered_scripts[algorithm](keys=keys, args=args), max_requests)
     except redis.RedisError:
-        return True, 0, 0
+        return RateLimitResult(True, max_requests, 0, 0)
+
+
+async def acheck_rate_limit(async_redis_client, identity, max_requests=100, window_seconds=60,
+                            algorithm=None, prefix='rate_limit'):
+    """Async check_rate_limit using a redis.asyncio client"""
+    algorithm = algorithm or settings.RATE_LIMIT_ALGORITHM
+    keys, args = _script_args(identity, max_requests, window_seconds, algorithm, prefix)
 
-# NEW function for tasks.py (Email rate limiting)  
-def check_email_rate_limit(email_address):
-    """Email rate limiting - Returns True/False only"""
-    key = f"email_rate_limit:{email_address}"
-    
     try:
-        current_count = redis_client.get(key) or 0
-        if int(current_count) >= 500:
-            return False
-        
-        redis_client.incr(key)
-        redis_client.expire(key, 86400)  # 24 hours
-        return True
-        
-    except Exception:
-        return True  # Allow if Redis fails
+        response = await _async_scripts[algorithm](keys=keys, args=args, client=async_redis_client)
+        return _to_result(response, max_requests)
+    except redis.RedisError:
+        return RateLimitResult(True, max_requests, 0, 0)
+
 
+def check_email_rate_limit(email_address):
+    """Email rate limiting (500 per 24 hours) - Returns True/False only"""
+    result = check_rate_limit(
+        email_address,
+        max_requests=500,
+        window_seconds=86400,
+        algorithm='fixed_window',
+        prefix='email_rate_limit'
+    )
+    return result.allowed
+
+
+class HybridRateLimiter:
+    """
+    Fixed-window IP limiter that answers most checks from memory
+
+    Each worker keeps, per client, the count it last saw in Redis plus the
+    requests it has admitted since (pending). The headroom below (1 - tolerance)
+    of the limit is split between the `workers` processes sharing the limit,
+    and while a worker's pending count fits in its share requests are admitted
+    locally with no Redis call, so all workers together stay under the limit
+    between syncs. Pending counts from all clients are pushed to Redis in one
+    script call every sync_interval seconds. Clients seen for the first time in
+    a window, or near their limit, always get an authoritative Redis check
+    (which also flushes their pending count).
+
+    The Redis counters are the same ones the fixed_window algorithm uses, so
+    this only stands in for that algorithm (see acheck_ip_rate_limit).
+    """
+
+    def __init__(self, window_seconds=60, tolerance=None, sync_interval=None, workers=None, prefix='rate_limit'):
+        self.window_seconds = window_seconds
+        self.tolerance = settings.RATE_LIMIT_LOCAL_TOLERANCE if tolerance is None else tolerance
+        self.sync_interval = settings.RATE_LIMIT_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.workers = max(1, settings.RATE_LIMIT_WORKERS if workers is None else workers)
+        self.prefix = prefix
+        self._states = {}  # identity -> {'synced': int, 'pending': int, 'reset_at': epoch seconds}
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._pid = os.getpid()
+
+    def _key(self, identity):
+        return f"{self.prefix}:{identity}"
+
+    def _check_fork(self):
+        """A forked child starts with an empty view (call with the lock held)"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._states = {}
+
+    def _check_locally(self, identity, max_requests):
+        """Admit the request from memory if it is safely under the limit, else return None"""
+        now = time.time()
+        with self._lock:
+            self._check_fork()
+            state = self._states.get(identity)
+            if state is None or state['reset_at'] <= now:
+                return None
+
+            #every worker may be admitting as many as this one
+            if state['synced'] + (state['pending'] + 1) * self.workers > max_requests * (1 - self.tolerance):
+                return None
+
+            state['pending'] += 1
+            used = state['synced'] + state['pending']
+            return RateLimitResult(True, max_requests, used, math.ceil(state['reset_at'] - now))
+
+    def _take_pending(self, identity):
+        with self._lock:
+            state = self._states.get(identity)
+            if state is None:
+                return 0
+            pending, state['pending'] = state['pending'], 0
+            return pending
+
+    def _restore_pending(self, identity, pending):
+        with self._lock:
+            state = self._states.setdefault(identity, {'synced': 0, 'pending': 0, 'reset_at': time.time() + self.window_seconds})
+            state['pending'] += pending
+
+    def _store(self, identity, used, reset_ms):
+        with self._lock:
+            state = self._states.setdefault(identity, {'synced': 0, 'pending': 0, 'reset_at': 0})
+            state['synced'] = int(used)
+            state['reset_at'] = time.time() + max(0, int(reset_ms)) / 1000
+
+    def _sync_due(self):
+        """True (once) when it is time to push pending counts to Redis"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sync < self.sync_interval:
+                return False
+            self._last_sync = now
+            return True
+
+    def _take_all_pending(self):
+        """Pop every pending count and drop clients whose window has ended"""
+        now = time.time()
+        with self._lock:
+            self._check_fork()
+            batch = {}
+            for identity, state in list(self._states.items()):
+                if state['pending']:
+                    batch[identity] = state['pending']
+                    state['pending'] = 0
+                elif state['reset_at'] <= now:
+                    del self._states[identity]
+            return batch
+
+    def _store_reconciled(self, batch, response):
+        for index, identity in enumerate(batch):
+            self._store(identity, response[index * 2], response[index * 2 + 1])
+
+    def sync(self):
+        """Push all pending counts to Redis in one round-trip and refresh our view of the totals"""
+        batch = self._take_all_pending()
+        if not batch:
+            return
+        keys = [self._key(identity) for identity in batch]
+        try:
+            response = _reconcile_script(keys=keys, args=[int(self.window_seconds * 1000), *batch.values()])
+            self._store_reconciled(batch, response)
+        except redis.RedisError:
+            for identity, pending in batch.items():
+                self._restore_pending(identity, pending)
+
+    async def async_sync(self, async_redis_client):
+        """Async sync"""
+        batch = self._take_all_pending()
+        if not batch:
+            return
+        keys = [self._key(identity) for identity in batch]
+        try:
+            response = await _async_reconcile_script(
+                keys=keys, args=[int(self.window_seconds * 1000), *batch.values()], client=async_redis_client
+            )
+            self._store_reconciled(batch, response)
+        except redis.RedisError:
+            for identity, pending in batch.items():
+                self._restore_pending(identity, pending)
+
+    def _check_args(self, identity, max_requests):
+        pending = self._take_pending(identity)
+        return pending, [self._key(identity)], [max_requests, int(self.window_seconds * 1000), pending]
+
+    def check(self, identity, max_requests=100):
+        """Check and count one request, going to Redis only when needed"""
+        if self._sync_due():
+            self.sync()
+
+        result = self._check_locally(identity, max_requests)
+        if result is not None:
+            return result
+
+        pending, keys, args = self._check_args(identity, max_requests)
+        try:
+            response = _registered_scripts['fixed_window'](keys=keys, args=args)
+        except redis.RedisError:
+            self._restore_pending(identity, pending)
+            return RateLimitResult(True, max_requests, 0, 0)
+
+        self._store(identity, response[1], response[2])
+        return _to_result(response, max_requests)
+
+    async def acheck(self, async_redis_client, identity, max_requests=100):
+        """Async check"""
+        if self._sync_due():
+            await self.async_sync(async_redis_client)
+
+        result = self._check_locally(identity, max_requests)
+        if result is not None:
+            return result
+
+        pending, keys, args = self._check_args(identity, max_requests)
+        try:
+            response = await _async_scripts['fixed_window'](keys=keys, args=args, client=async_redis_client)
+        except redis.RedisError:
+            self._restore_pending(identity, pending)
+            return RateLimitResult(True, max_requests, 0, 0)
+
+        self._store(identity, response[1], response[2])
+        return _to_result(response, max_requests)
+
+
+# Shared per-process limiter for the IP limits in views
+ip_rate_limiter = HybridRateLimiter()
+
+if settings.RATE_LIMIT_HYBRID and settings.RATE_LIMIT_ALGORITHM != 'fixed_window':
+    logger.warning(
+        f"RATE_LIMIT_HYBRID only applies to fixed_window, IP limits check {settings.RATE_LIMIT_ALGORITHM} "
+        f"in Redis on every request"
+    )
+
+
+async def acheck_ip_rate_limit(async_redis_client, ip_address, max_requests=100):
+    """
+    IP limit for the views - the hybrid local/Redis limiter when RATE_LIMIT_HYBRID
+    is on and RATE_LIMIT_ALGORITHM is fixed_window, otherwise the configured
+    algorithm in Redis
+    """
+    if settings.RATE_LIMIT_HYBRID and settings.RATE_LIMIT_ALGORITHM == 'fixed_window':
+        return await ip_rate_limiter.acheck(async_redis_client, ip_address, max_requests)
+    return await acheck_rate_limit(async_redis_client, ip_address, max_requests, algorithm=settings.RATE_LIMIT_ALGORITHM)
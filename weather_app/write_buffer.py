@@ -0,0 +1,144 @@
+# weather_app/write_buffer.py
+# Write-behind buffering for log rows (WeatherRequest, UserActivity)
+#
+# Rows are collected in memory and written with bulk_create by a background
+# thread (see flushers.py), so the request path no longer waits on an
+# INSERT + commit.
+
+import threading
+import logging
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from . import flushers
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer(flushers.PeriodicFlusher):
+    """
+    Per-process buffer of unsaved model instances for one model
+
+    Flushes when max_size rows are waiting or every flush_interval seconds,
+    whichever comes first. If the database falls behind and max_pending rows
+    are already waiting, the overflow policy decides what happens:
+        'drop_oldest' - discard the oldest row (logging stays best-effort)
+        'flush'       - the caller flushes inline (back-pressure)
+    """
+
+    def __init__(self, model, max_size=100, flush_interval=2.0, max_pending=10000, overflow='drop_oldest'):
+        super().__init__(flush_interval)
+        self.thread_name = f"{model.__name__}-write-buffer"
+        self.model = model
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.dropped = 0
+        self._rows = deque()
+        self._flush_lock = threading.Lock()
+
+    def add(self, instance):
+        """Queue an unsaved model instance for the next bulk insert"""
+        self.ensure_flusher()
+
+        if self.needs_inline_flush():
+            self.flush()
+
+        with self._lock:
+            if len(self._rows) >= self.max_pending:
+                self._rows.popleft()
+                self.dropped += 1
+            self._rows.append(instance)
+            full = len(self._rows) >= self.max_size
+
+        if full:
+            self.wake()
+
+    def needs_inline_flush(self):
+        """True when the 'flush' overflow policy wants the caller to write now"""
+        return self.overflow == 'flush' and len(self._rows) >= self.max_pending
+
+    def flush(self):
+        """Write everything waiting with bulk_create, returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._rows)
+                self._rows.clear()
+            if not rows:
+                return 0
+
+            try:
+                self.model.objects.bulk_create(rows, batch_size=500)
+                return len(rows)
+            except Exception as e:
+                logger.error(f"Error flushing {len(rows)} {self.model.__name__} rows: {e}")
+                # put them back (oldest first) unless that would overflow
+                with self._lock:
+                    room = max(0, self.max_pending - len(self._rows))
+                    self._rows.extendleft(reversed(rows[-room:] if room else []))
+                    self.dropped += len(rows) - min(room, len(rows))
+                return 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def reset(self):
+        self._rows.clear()
+
+    def after_flush(self):
+        close_old_connections()
+
+
+_buffers = {}
+
+def get_buffer(model):
+    """Shared buffer for a model, configured from settings"""
+    buffer = _buffers.get(model)
+    if buffer is None:
+        buffer = _buffers.setdefault(model, flushers.register(WriteBuffer(
+            model,
+            max_size=settings.WRITE_BUFFER_MAX_SIZE,
+            flush_interval=settings.WRITE_BUFFER_FLUSH_INTERVAL,
+            max_pending=settings.WRITE_BUFFER_MAX_PENDING,
+            overflow=settings.WRITE_BUFFER_OVERFLOW,
+        )))
+    return buffer
+
+def buffered_create(model, **fields):
+    """model.objects.create, but write-behind when WRITE_BUFFER_ENABLED is on"""
+    if not settings.WRITE_BUFFER_ENABLED:
+        return model.objects.create(**fields)
+    instance = model(**fields)
+    get_buffer(model).add(instance)
+    return instance
+
+def buffered_bulk_create(model, instances):
+    """model.objects.bulk_create, but write-behind when WRITE_BUFFER_ENABLED is on"""
+    if not settings.WRITE_BUFFER_ENABLED:
+        return model.objects.bulk_create(instances)
+    buffer = get_buffer(model)
+    for instance in instances:
+        buffer.add(instance)
+    return instances
+
+async def abuffered_create(model, **fields):
+    """Async buffered_create - buffering itself never blocks"""
+    if not settings.WRITE_BUFFER_ENABLED:
+        return await model.objects.acreate(**fields)
+    instance = model(**fields)
+    buffer = get_buffer(model)
+    if buffer.needs_inline_flush():
+        #the ORM can't run on the event loop
+        await sync_to_async(buffer.flush)()
+    buffer.add(instance)
+    return instance
+
+def flush_all_buffers():
+    """Flush every buffer in this process"""
+    total = 0
+    for buffer in list(_buffers.values()):
+        total += buffer.flush()
+    if total:
+        logger.info(f"Flushed {total} buffered rows")
+    return total
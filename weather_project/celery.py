@@ -20,11 +20,22 @@ priority_exchange = Exchange('priority', type='direct')
 CELERY_TASK_ROUTES = {
     'weather_app.tasks.collect_weather_requests': {'queue': 'digest'},
     'weather_app.tasks.convert_temperature': {'queue': 'conversion'},
+    'weather_app.tasks.convert_temperatures': {'queue': 'conversion'},
+    'weather_app.tasks.format_messages': {'queue': 'formatting'},
     'weather_app.tasks.format_message': {'queue': 'formatting'},
     'weather_app.tasks.send_message': {'queue': 'sending'},
+    'weather_app.tasks.send_message_batch': {'queue': 'sending'},
     'weather_app.tasks.send_priority_message': {'queue': 'priority_sending'},
     'weather_app.tasks.trigger_scheduled_weather': {'queue': 'digest'},
     'weather_app.tasks.check_temperature_changes': {'queue': 'conversion'},
+    'weather_app.tasks.refresh_weather_cache': {'queue': 'conversion'},
+    'weather_app.tasks.warm_weather_cache': {'queue': 'digest'},
+    'weather_app.tasks.warm_cities': {'queue': 'conversion'},
+    'weather_app.tasks.flush_popular_city_counts': {'queue': 'digest'},
+    'weather_app.tasks.refresh_dashboard_snapshot': {'queue': 'digest'},
+    'weather_app.tasks.collect_celery_inspection': {'queue': 'digest'},
+    'weather_app.tasks.create_upcoming_partitions': {'queue': 'digest'},
+    'weather_app.tasks.update_analytics_rollups': {'queue': 'digest'},
     'weather_app.tasks.process_dead_letter_queue': {'queue': 'dead_letter'},
     'weather_app.tasks.send_to_dead_letter': {'queue': 'dead_letter'},
 }
@@ -125,12 +125,18 @@ CACHES = {
         'LOCATION': os.environ.get('REDIS_URL'),
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SERIALIZER': 'weather_app.cache_serializer.WeatherCacheSerializer',
         },
         'KEY_PREFIX': 'weather_app',
         'TIMEOUT': 300, #Default 5 minute cached data timeout (deleted)
     }
 }
 
+# Cached values are orjson (or msgpack) behind a versioned header, see weather_app/cache_serializer.py
+CACHE_SERIALIZER_FORMAT = os.environ.get('CACHE_SERIALIZER_FORMAT', 'orjson') #orjson, msgpack or pickle
+CACHE_COMPRESSION = os.environ.get('CACHE_COMPRESSION', 'zlib') #none, zlib, zstd (zstandard) or lz4
+CACHE_COMPRESS_MIN_SIZE = 1024 #bytes, smaller payloads are stored uncompressed
+
 #Redis Session Storage 
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
@@ -141,6 +147,29 @@ REDIS_HOST = os.environ.get('REDIS_HOST')
 REDIS_PORT = os.environ.get('REDIS_PORT')
 REDIS_DB = os.environ.get('REDIS_DB')
 
+#Redis client pools (weather_app/redis_clients.py) - one per purpose and process
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50)) #per purpose and process
+REDIS_POOL_TIMEOUT = 5 #seconds to wait for a free pooled connection
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', 2))
+REDIS_HEALTH_CHECK_INTERVAL = 30 #seconds idle before a connection is pinged on checkout
+REDIS_CLIENTS = {} #per-purpose overrides, e.g. {'ratelimit': {'db': 2, 'max_connections': 100}}
+REDIS_SCAN_COUNT = 1000 #COUNT hint per SCAN call when enumerating keys
+REDIS_UNLINK_BATCH_SIZE = 500 #keys unlinked per pipelined round-trip
+
+RATE_LIMIT_ALGORITHM = os.environ.get('RATE_LIMIT_ALGORITHM', 'fixed_window') #fixed_window, sliding_log or token_bucket
+RATE_LIMIT_HYBRID = os.environ.get('RATE_LIMIT_HYBRID', 'True') == 'True' #answer IP checks from memory when far under the limit (fixed_window only)
+RATE_LIMIT_LOCAL_TOLERANCE = float(os.environ.get('RATE_LIMIT_LOCAL_TOLERANCE', 0.2)) #fraction of the limit always checked in Redis
+RATE_LIMIT_WORKERS = int(os.environ.get('RATE_LIMIT_WORKERS', 4)) #processes sharing each IP limit, the local headroom is split between them
+RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', 1.0)) #seconds between batched count flushes
+
+#Write-behind buffering for WeatherRequest / UserActivity log rows
+WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER_ENABLED', 'True') == 'True'
+WRITE_BUFFER_MAX_SIZE = int(os.environ.get('WRITE_BUFFER_MAX_SIZE', 100)) #rows that trigger a flush
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.environ.get('WRITE_BUFFER_FLUSH_INTERVAL', 2.0)) #seconds between flushes
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', 10000)) #rows held before the overflow policy kicks in
+WRITE_BUFFER_OVERFLOW = os.environ.get('WRITE_BUFFER_OVERFLOW', 'drop_oldest') #drop_oldest or flush
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -184,6 +213,51 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 #OpenWeatherAPI
 WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY')
+WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'http://api.weatherapi.com/v1/current.json')
+
+#Upstream fetch tuning for multi-city requests
+WEATHER_HTTP_POOL_SIZE = int(os.environ.get('WEATHER_HTTP_POOL_SIZE', 20)) #pooled keep-alive connections
+WEATHER_FETCH_MAX_WORKERS = int(os.environ.get('WEATHER_FETCH_MAX_WORKERS', 8)) #parallel upstream fetches per process
+WEATHER_BATCH_DEADLINE = float(os.environ.get('WEATHER_BATCH_DEADLINE', 10)) #seconds for a whole batch
+WEATHER_BULK_BATCH_SIZE = int(os.environ.get('WEATHER_BULK_BATCH_SIZE', 50)) #locations per bulk POST (WeatherAPI allows 50)
+
+#Upstream protection - circuit breaker shared through Redis, latency-derived timeouts, failure fallbacks
+WEATHER_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('WEATHER_CIRCUIT_FAILURE_THRESHOLD', 5)) #failures in the window that open the circuit
+WEATHER_CIRCUIT_FAILURE_WINDOW = 30 #seconds failures are counted over
+WEATHER_CIRCUIT_COOLDOWN = float(os.environ.get('WEATHER_CIRCUIT_COOLDOWN', 30)) #seconds open before one probe is let through
+WEATHER_CONNECT_TIMEOUT = float(os.environ.get('WEATHER_CONNECT_TIMEOUT', 2))
+WEATHER_READ_TIMEOUT_MIN = 1.0 #read timeout = p99 of recent latencies * factor, clamped to min/max
+WEATHER_READ_TIMEOUT_MAX = float(os.environ.get('WEATHER_READ_TIMEOUT_MAX', 10))
+WEATHER_READ_TIMEOUT_FACTOR = 3.0
+WEATHER_LATENCY_SAMPLES = 200 #recent latencies kept in Redis
+WEATHER_TIMEOUT_REFRESH = 30 #seconds a process reuses its computed read timeout
+WEATHER_NEGATIVE_TTL = int(os.environ.get('WEATHER_NEGATIVE_TTL', 30)) #seconds a failed city isn't fetched again
+WEATHER_LKG_TTL = 86400 #seconds the last-known-good value is kept to fall back on
+
+#Cache miss coalescing - one process refills a city while the others wait for it
+WEATHER_FILL_LOCK_TTL = float(os.environ.get('WEATHER_FILL_LOCK_TTL', 5)) #seconds the refill lock is held at most
+WEATHER_FILL_WAIT = float(os.environ.get('WEATHER_FILL_WAIT', 3)) #seconds a waiter polls before fetching itself
+WEATHER_FILL_POLL_INTERVAL = 0.05
+
+#Weather cache expiry - fresh until the soft TTL, then served stale while a background refresh runs
+WEATHER_CACHE_SOFT_TTL = int(os.environ.get('WEATHER_CACHE_SOFT_TTL', 300))
+WEATHER_CACHE_HARD_TTL = int(os.environ.get('WEATHER_CACHE_HARD_TTL', 900))
+WEATHER_XFETCH_BETA = float(os.environ.get('WEATHER_XFETCH_BETA', 1.0)) #>1 refreshes earlier, <1 later
+WEATHER_REFRESH_QUEUE_TTL = 30 #seconds before another refresh can be queued for the same city
+WEATHER_GENERATION_TTL = 2 #seconds a process reuses the cache generation numbers (invalidation lag)
+
+# Cache hit/miss metrics are buffered per process and flushed to per-minute Redis hashes
+CACHE_METRICS_FLUSH_INTERVAL = float(os.environ.get('CACHE_METRICS_FLUSH_INTERVAL', 5.0)) #seconds between flushes
+
+# Cache warming (warm_weather_cache): popular, listed and pending-digest cities are refreshed before going stale
+WEATHER_WARM_INTERVAL = 60 #seconds between warming runs, refreshes are spread over it
+WEATHER_WARM_LEAD = 90 #refresh entries going stale within this many seconds (keep above the interval)
+WEATHER_WARM_TOP_N = int(os.environ.get('WEATHER_WARM_TOP_N', 20)) #most requested cities kept warm
+WEATHER_WARM_LOOKUPS_PER_MINUTE = int(os.environ.get('WEATHER_WARM_LOOKUPS_PER_MINUTE', 100)) #upstream quota share for warming
+
+#In-process (L1) cache in front of Redis for hot weather keys, invalidated across workers over pub/sub
+WEATHER_L1_MAX_ENTRIES = int(os.environ.get('WEATHER_L1_MAX_ENTRIES', 256)) #0 disables the L1 cache
+WEATHER_L1_TTL = float(os.environ.get('WEATHER_L1_TTL', 10)) #seconds, bounds staleness if an invalidation is missed
 
 #WHATSAPP_ACCESS_TOKEN = ''
 #WHATSAPP_PHONE_ID = ''
@@ -208,6 +282,28 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Los_Angeles'  
+
+# WeatherRequest, UserActivity and EmailMessage are partitioned by month on PostgreSQL
+PARTITION_MONTHS_AHEAD = 2 #future monthly partitions kept ready by create_upcoming_partitions
+
+# Analytics read hourly/daily rollups maintained by update_analytics_rollups
+ROLLUP_BATCH_SIZE = 5000 #raw rows merged per transaction
+ROLLUP_GAP_TIMEOUT = 600 #seconds an id skipped by the watermark is re-checked before it counts as rolled back
+EXPORT_CHUNK_SIZE = 2000 #rows fetched per server-side cursor round trip by exports
+
+# Dashboard stats are computed by a beat task into a Redis snapshot
+DASHBOARD_SNAPSHOT_TTL = 120 #seconds, rebuilt on demand if the task stops running
+DASHBOARD_INSPECT_TIMEOUT = 2.0 #seconds the collector waits for workers to reply
+DASHBOARD_INSPECT_TTL = 60 #after this the worker data is dropped and shown as Unknown
+
+# Digest pipeline: requests are claimed in chunks and users handled in batches
+DIGEST_CHUNK_SIZE = 500 #requests claimed per transaction
+DIGEST_MAX_CHUNKS = 20 #chunks claimed per collect_weather_requests run
+DIGEST_USER_BATCH_SIZE = 100 #users per format/send task
+DIGEST_CLAIM_TIMEOUT = 600 #seconds before an unfinished claim goes back to pending
+EMAIL_BATCH_SIZE = 100 #messages sent per SMTP connection by send_message_batch
+EMAIL_SEND_CLAIM_TIMEOUT = 300 #seconds before an unfinished send claim goes back to queued (> the task soft time limit)
+
 # Beat Schedule
 CELERY_BEAT_SCHEDULE = {
     'collect-weather-requests': {
@@ -226,5 +322,33 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'weather_app.tasks.process_dead_letter_queue',
         'schedule': crontab(hour=9, minute=0),
     },
+    'send-queued-messages': {
+        'task': 'weather_app.tasks.send_message_batch',
+        'schedule': 30.0,
+    },
+    'refresh-dashboard-snapshot': {
+        'task': 'weather_app.tasks.refresh_dashboard_snapshot',
+        'schedule': 10.0,
+    },
+    'collect-celery-inspection': {
+        'task': 'weather_app.tasks.collect_celery_inspection',
+        'schedule': 15.0,
+    },
+    'create-upcoming-partitions': {
+        'task': 'weather_app.tasks.create_upcoming_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'update-analytics-rollups': {
+        'task': 'weather_app.tasks.update_analytics_rollups',
+        'schedule': 300.0,
+    },
+    'flush-popular-city-counts': {
+        'task': 'weather_app.tasks.flush_popular_city_counts',
+        'schedule': 30.0,
+    },
+    'warm-weather-cache': {
+        'task': 'weather_app.tasks.warm_weather_cache',
+        'schedule': float(WEATHER_WARM_INTERVAL),
+    },
 }
 
@@ -40,6 +40,7 @@ CACHES = {
         'LOCATION': f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",  # ← Simplified format
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SERIALIZER': 'weather_app.cache_serializer.WeatherCacheSerializer',
         },
         'KEY_PREFIX': 'weather_test',  # ← Add test prefix
         'TIMEOUT': 300,
@@ -56,6 +57,12 @@ REDIS_HOST = REDIS_HOST  # ← Make sure these are available
 REDIS_PORT = REDIS_PORT
 REDIS_DB = REDIS_DB
 
+# Write log rows straight away so they land inside each test's transaction
+WRITE_BUFFER_ENABLED = False
+
+# No background flush thread for cache metrics, tests flush them explicitly
+CACHE_METRICS_FLUSH_INTERVAL = 0
+
 # Test API credentials
 WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY', 'test_api_key_12345')
 